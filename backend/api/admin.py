@@ -1,18 +1,36 @@
 from django.contrib import admin
-from .models import Vehicle, FuelEvent, SupportTicket
+from .models import Vehicle, FuelEvent, SupportTicket, VehicleDayStats
 
 # Мы регистрируем модели, чтобы Django создал для них интерфейс в админке.
 # Теперь ты сможешь добавлять, удалять и редактировать записи через браузер.
 
 @admin.register(Vehicle)
 class VehicleAdmin(admin.ModelAdmin):
-    list_display = ('name', 'device_id', 'sensors_count') # Колонки в списке
+    list_display = ('name', 'device_id', 'sensors_count', 'events_processed_until') # Колонки в списке
     search_fields = ('name', 'device_id')               # Поле поиска
 
 @admin.register(FuelEvent)
 class FuelEventAdmin(admin.ModelAdmin):
     list_display = ('vehicle', 'event_type', 'timestamp', 'volume', 'is_confirmed')
     list_filter = ('event_type', 'is_confirmed')        # Фильтры справа
+    list_select_related = ('vehicle',)                  # Без запроса ТС на каждую строку
+    raw_id_fields = ('vehicle',)
+    ordering = ('-timestamp', '-id')
+    show_full_result_count = False                      # Без COUNT(*) по всей таблице
+    actions = ['confirm_events', 'unconfirm_events']
+
+    @admin.action(description='Подтвердить выбранные события')
+    def confirm_events(self, request, queryset):
+        queryset.update(is_confirmed=True)
+
+    @admin.action(description='Снять подтверждение')
+    def unconfirm_events(self, request, queryset):
+        queryset.update(is_confirmed=False)
+
+@admin.register(VehicleDayStats)
+class VehicleDayStatsAdmin(admin.ModelAdmin):
+    list_display = ('vehicle', 'day', 'mileage_km', 'engine_seconds', 'fuel_consumed', 'is_complete')
+    list_filter = ('is_complete',)
 
 @admin.register(SupportTicket)
 class SupportTicketAdmin(admin.ModelAdmin):
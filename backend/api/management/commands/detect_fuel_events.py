@@ -0,0 +1,54 @@
+"""
+Поиск сливов и заправок по трекам ТС схемы.
+
+    python manage.py detect_fuel_events --schema <id> (--session-id <id> | --login <l> --password <p>)
+        [--from "2026-01-01 00:00"] [--to "2026-02-01 00:00"] [--devices id1,id2] [--workers 8]
+
+Без --from/--to - последние сутки. Повторный прогон за тот же период
+заменяет неподтвержденные события, подтвержденные не трогает.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services.fuel_events import scan_fuel_events
+from api.services.session_manager import session_manager
+from api.services.track import autograph_to_epoch, epoch_to_autograph
+from api.views.analytics import format_autograph_date, parse_device_ids
+
+
+class Command(BaseCommand):
+    help = 'Ищет сливы и заправки в треках ТС и записывает их в FuelEvent'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', required=True, help='ID схемы AutoGRAPH')
+        parser.add_argument('--session-id', help='Токен сессии AutoGRAPH')
+        parser.add_argument('--login', help='Логин AutoGRAPH (если нет --session-id)')
+        parser.add_argument('--password', help='Пароль AutoGRAPH')
+        parser.add_argument('--from', dest='date_from', help='Начало периода, "YYYY-MM-DD HH:MM"')
+        parser.add_argument('--to', dest='date_to', help='Конец периода, "YYYY-MM-DD HH:MM"')
+        parser.add_argument('--devices', help='ID ТС через запятую (по умолчанию все ТС схемы)')
+        parser.add_argument('--workers', type=int, help='Сколько треков качать параллельно')
+
+    def handle(self, *args, **options):
+        session_id = options['session_id']
+        if not session_id:
+            if not options['login'] or not options['password']:
+                raise CommandError('Нужен --session-id или --login и --password')
+            session_id = session_manager.get_token(options['login'], options['password'])
+            if not session_id:
+                raise CommandError('Не удалось войти в AutoGRAPH')
+
+        end_dt = format_autograph_date(options['date_to']) if options['date_to'] else epoch_to_autograph(time.time())
+        start_dt = (format_autograph_date(options['date_from']) if options['date_from']
+                    else epoch_to_autograph(autograph_to_epoch(end_dt) - 86400))
+
+        stats = scan_fuel_events(
+            session_id, options['schema'], start_dt, end_dt,
+            device_ids=parse_device_ids(options['devices']) if options['devices'] else None,
+            workers=options['workers'],
+        )
+        self.stdout.write(
+            f"ТС: {stats['vehicles']}, событий: {stats['events']}"
+            + (f", неполные треки: {','.join(stats['partial'])}" if stats['partial'] else '')
+        )
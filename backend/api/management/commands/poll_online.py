@@ -0,0 +1,29 @@
+"""
+Фоновый опрос онлайн-данных парка.
+
+    python manage.py poll_online [--interval 15] [--batch-size 200] [--once]
+"""
+from django.core.management.base import BaseCommand
+
+from api.services.online_poller import FleetPoller
+
+
+class Command(BaseCommand):
+    help = 'Опрашивает GetOnlineInfo по просматриваемым схемам и пишет снимки в общее хранилище'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Шаг опроса, секунд')
+        parser.add_argument('--batch-size', type=int, help='ID ТС в одном запросе GetOnlineInfo')
+        parser.add_argument('--once', action='store_true', help='Один проход и выход')
+
+    def handle(self, *args, **options):
+        poller = FleetPoller(interval=options['interval'], batch_size=options['batch_size'])
+        if options['once']:
+            poller.poll_once()
+            return
+
+        self.stdout.write(f'Опрос онлайн-данных каждые {poller.interval} с (Ctrl+C - остановка)')
+        try:
+            poller.run()
+        except KeyboardInterrupt:
+            pass
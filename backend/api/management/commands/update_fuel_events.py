@@ -0,0 +1,76 @@
+"""
+Инкрементальный поиск сливов и заправок по всему парку.
+
+    python manage.py update_fuel_events [--schema <id> (--session-id <id> | --login <l> --password <p>)]
+        [--interval 600] [--workers 8] [--once]
+
+Без --schema разбираются схемы, которые недавно смотрели (как у poll_online),
+сессией последнего смотревшего. Каждый проход берет только новые данные
+после отметки ТС, поэтому работа пропорциональна приросту данных.
+Для cron: --once.
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services.fuel_events import fuel_events_config, update_fuel_events
+from api.services.online_store import online_store
+from api.services.session_manager import session_manager
+
+
+class Command(BaseCommand):
+    help = 'Дописывает сливы и заправки по новым данным ТС начиная с их отметок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', help='ID схемы AutoGRAPH (по умолчанию - просматриваемые схемы)')
+        parser.add_argument('--session-id', help='Токен сессии AutoGRAPH')
+        parser.add_argument('--login', help='Логин AutoGRAPH (если нет --session-id)')
+        parser.add_argument('--password', help='Пароль AutoGRAPH')
+        parser.add_argument('--interval', type=float, help='Шаг прогона, секунд')
+        parser.add_argument('--workers', type=int, help='Сколько треков качать параллельно')
+        parser.add_argument('--once', action='store_true', help='Один проход и выход')
+
+    def schemas(self, options):
+        """{schema_id: session_id} для прохода"""
+        if not options['schema']:
+            return online_store.watched()
+        session_id = options['session_id']
+        if not session_id:
+            if not options['login'] or not options['password']:
+                raise CommandError('Для --schema нужен --session-id или --login и --password')
+            # Токен берется на каждый проход: менеджер сессий обновляет его сам
+            session_id = session_manager.get_token(options['login'], options['password'])
+            if not session_id:
+                raise CommandError('Не удалось войти в AutoGRAPH')
+        return {options['schema']: session_id}
+
+    def run_once(self, options):
+        for schema_id, session_id in self.schemas(options).items():
+            started = time.monotonic()
+            try:
+                stats = update_fuel_events(session_id, schema_id, workers=options['workers'])
+            except Exception as e:
+                self.stderr.write(f'Схема {schema_id}: {e}')
+                continue
+            self.stdout.write(
+                f"Схема {schema_id}: ТС {stats['vehicles']}, событий {stats['events']}, "
+                f"без новых данных {stats['up_to_date']}, неполные треки {len(stats['partial'])}, "
+                f"{time.monotonic() - started:.1f} с"
+            )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.run_once(options)
+            return
+
+        interval = options['interval'] or fuel_events_config()['UPDATE_INTERVAL']
+        self.stdout.write(f'Поиск событий каждые {interval} с (Ctrl+C - остановка)')
+        stop_event = threading.Event()
+        try:
+            while not stop_event.is_set():
+                started = time.monotonic()
+                self.run_once(options)
+                stop_event.wait(max(0.0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
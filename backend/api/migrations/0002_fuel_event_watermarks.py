@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='events_processed_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='События найдены по'),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='events_state',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Состояние фильтра на отметке'),
+        ),
+        migrations.AddConstraint(
+            model_name='fuelevent',
+            constraint=models.UniqueConstraint(fields=('vehicle', 'event_type', 'timestamp'), name='unique_fuel_event'),
+        ),
+    ]
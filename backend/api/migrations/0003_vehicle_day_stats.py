@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_fuel_event_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleDayStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('mileage_km', models.FloatField(default=0, verbose_name='Пробег (км)')),
+                ('moving_seconds', models.FloatField(default=0, verbose_name='В движении (с)')),
+                ('idle_seconds', models.FloatField(default=0, verbose_name='Холостой ход (с)')),
+                ('engine_seconds', models.FloatField(default=0, verbose_name='Моточасы (с)')),
+                ('max_speed', models.FloatField(default=0, verbose_name='Макс. скорость (км/ч)')),
+                ('fuel_start', models.FloatField(null=True, verbose_name='Топливо на начало (л)')),
+                ('fuel_end', models.FloatField(null=True, verbose_name='Топливо на конец (л)')),
+                ('refills', models.IntegerField(default=0, verbose_name='Заправок')),
+                ('refill_litres', models.FloatField(default=0, verbose_name='Заправлено (л)')),
+                ('drains', models.IntegerField(default=0, verbose_name='Сливов')),
+                ('drain_litres', models.FloatField(default=0, verbose_name='Слито (л)')),
+                ('fuel_consumed', models.FloatField(default=0, verbose_name='Расход (л)')),
+                ('fuel_expected', models.FloatField(default=0, verbose_name='Расход по норме (л)')),
+                ('points', models.IntegerField(default=0, verbose_name='Точек трека')),
+                ('is_complete', models.BooleanField(default=False, verbose_name='Данные за сутки полные')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_stats', to='api.vehicle')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('vehicle', 'day'), name='unique_vehicle_day')],
+            },
+        ),
+    ]
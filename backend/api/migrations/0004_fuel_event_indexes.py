@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_vehicle_day_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fuelevent',
+            index=models.Index(fields=['vehicle', 'timestamp'], name='fuel_event_vehicle_ts'),
+        ),
+        migrations.AddIndex(
+            model_name='fuelevent',
+            index=models.Index(fields=['event_type', 'timestamp'], name='fuel_event_type_ts'),
+        ),
+        migrations.AddIndex(
+            model_name='fuelevent',
+            index=models.Index(fields=['timestamp', 'id'], name='fuel_event_ts_id'),
+        ),
+    ]
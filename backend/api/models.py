@@ -13,6 +13,10 @@ class Vehicle(models.Model):
     # Чтобы знать, сколько датчиков мы ожидаем
     sensors_count = models.IntegerField("Количество ДУТ", default=1)
 
+    # Инкрементальный поиск сливов/заправок: до какого момента данные разобраны
+    events_processed_until = models.DateTimeField("События найдены по", null=True, blank=True)
+    events_state = models.JSONField("Состояние фильтра на отметке", default=dict, blank=True)
+
     def __str__(self):
         return f"{self.name} ({self.device_id})"
 
@@ -32,10 +36,53 @@ class FuelEvent(models.Model):
     volume = models.FloatField("Объем (литры)")
     is_confirmed = models.BooleanField("Подтверждено пользователем", default=False)
 
+    class Meta:
+        constraints = [
+            # Повторный прогон детектора обновляет событие, а не дублирует его
+            models.UniqueConstraint(fields=['vehicle', 'event_type', 'timestamp'], name='unique_fuel_event'),
+        ]
+        # Список событий идет по времени (timestamp, id) с фильтрами по ТС и типу
+        indexes = [
+            models.Index(fields=['vehicle', 'timestamp'], name='fuel_event_vehicle_ts'),
+            models.Index(fields=['event_type', 'timestamp'], name='fuel_event_type_ts'),
+            models.Index(fields=['timestamp', 'id'], name='fuel_event_ts_id'),
+        ]
+
     def __str__(self):
         return f"{self.get_event_type_display()} на {self.vehicle.name}"
 
 
+class VehicleDayStats(models.Model):
+    """Суточные итоги по ТС для отчетов (день - по UTC)."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='day_stats')
+    day = models.DateField("День")
+    mileage_km = models.FloatField("Пробег (км)", default=0)
+    moving_seconds = models.FloatField("В движении (с)", default=0)
+    idle_seconds = models.FloatField("Холостой ход (с)", default=0)
+    engine_seconds = models.FloatField("Моточасы (с)", default=0)
+    max_speed = models.FloatField("Макс. скорость (км/ч)", default=0)
+    fuel_start = models.FloatField("Топливо на начало (л)", null=True)
+    fuel_end = models.FloatField("Топливо на конец (л)", null=True)
+    refills = models.IntegerField("Заправок", default=0)
+    refill_litres = models.FloatField("Заправлено (л)", default=0)
+    drains = models.IntegerField("Сливов", default=0)
+    drain_litres = models.FloatField("Слито (л)", default=0)
+    fuel_consumed = models.FloatField("Расход (л)", default=0)
+    fuel_expected = models.FloatField("Расход по норме (л)", default=0)
+    points = models.IntegerField("Точек трека", default=0)
+    # Сутки еще не закончились (или данные не устоялись) - строка будет пересчитана
+    is_complete = models.BooleanField("Данные за сутки полные", default=False)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'day'], name='unique_vehicle_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.vehicle.name} за {self.day}"
+
+
 class SupportTicket(models.Model):
     """Обращения в техподдержку."""
     email = models.EmailField("Email для ответа")
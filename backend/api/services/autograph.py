@@ -1,74 +1,204 @@
 import requests
 import logging
-import numpy as np
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, List, Any
-import json
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .calibration import CalibrationTable
+from .single_flight import coalesced
+from ..utils.cache import cache_result
+from .track import (
+    TrackFetchResult, autograph_to_epoch, clip_chunk_segments, drain_segments, epoch_to_autograph,
+    extract_segments, merge_chunk_segments, split_period,
+)
 
 logger = logging.getLogger(__name__)
 
+# Настройки по умолчанию, переопределяются через settings.AUTOGRAPH
+DEFAULT_CONFIG = {
+    'BASE_URL': "https://web.tk-ekat.ru/ServiceJSON",
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': 32,
+    'MAX_RETRIES': 3,
+    'BACKOFF_FACTOR': 0.5,
+    'BACKOFF_MAX': 8.0,
+    'DEFAULT_TIMEOUT': 15,
+    'TIMEOUTS': {
+        'GetTrack': 30,
+    },
+    'TRACK_CHUNK_HOURS': 24,    # Длинный период GetTrack режется на такие части
+    'TRACK_WORKERS': 4,         # Сколько частей качается одновременно
+    'TRACK_CHUNK_RETRIES': 2,   # Повторы упавшей части (поверх повторов _request)
+    'BATCH_TRACK_WORKERS': 8,   # Сколько ТС одновременно в пакетном запросе треков
+    'TRACK_CONCURRENCY': 8,     # Сколько GetTrack одновременно на процесс, по всем запросам
+    'SINGLE_FLIGHT_SHARED': False,  # Объединять одинаковые запросы и между процессами (через кэш)
+}
+
+# Сколько помним ответы AutoGRAPH в памяти процесса (cache_result): (обычный, пустой), секунд.
+# Пустой ответ - ошибка или нет доступа: повторяем его не чаще раза в несколько секунд.
+SCHEMAS_CACHE = (300, 30)
+DEVICES_CACHE = (60, 15)
+ONLINE_CACHE = (5, 5)           # Меньше шага опроса онлайн-данных
+TRACK_CACHE = (60, 30)          # Трек сохраняет telemetry_store; здесь - только повторы частей
+
+# Коды ответа, при которых имеет смысл повторить запрос
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AutoGraphError(Exception):
+    """Ошибка обращения к AutoGRAPH (сеть или неуспешный ответ)"""
+
 
 class AutoGraphService:
-    def __init__(self):
-        self.base_url = "https://web.tk-ekat.ru/ServiceJSON"
+    # Пул соединений и счетчики общие для всех экземпляров сервиса
+    _sessions: Dict[str, requests.Session] = {}
+    _sessions_lock = threading.Lock()
+    # Пулы ТС (пакетные треки, отчеты, события) вложены в пулы частей трека:
+    # общий семафор держит число GetTrack к серверу в пределах TRACK_CONCURRENCY
+    _track_slots: Dict[str, threading.BoundedSemaphore] = {}
+    stats = {'requests': 0, 'retries': 0, 'failures': 0}
+    _stats_lock = threading.Lock()
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = {**DEFAULT_CONFIG, **getattr(settings, 'AUTOGRAPH', {}), **(config or {})}
+        self.base_url = self.config['BASE_URL']
+        self.timeouts = {**DEFAULT_CONFIG['TIMEOUTS'], **self.config.get('TIMEOUTS', {})}
+
+    @property
+    def session(self) -> requests.Session:
+        """Общая keep-alive сессия с пулом соединений."""
+        session = self._sessions.get(self.base_url)
+        if session is None:
+            with self._sessions_lock:
+                session = self._sessions.get(self.base_url)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=self.config['POOL_CONNECTIONS'],
+                        pool_maxsize=self.config['POOL_MAXSIZE'],
+                        max_retries=0,
+                    )
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._sessions[self.base_url] = session
+        return session
+
+    @property
+    def track_slots(self) -> threading.BoundedSemaphore:
+        """Общий на процесс лимит одновременных GetTrack к серверу."""
+        slots = self._track_slots.get(self.base_url)
+        if slots is None:
+            with self._sessions_lock:
+                slots = self._track_slots.setdefault(
+                    self.base_url, threading.BoundedSemaphore(self.config['TRACK_CONCURRENCY'])
+                )
+        return slots
+
+    def cache_scope(self):
+        """Часть ключа cache_result: ответы разных серверов AutoGRAPH не смешиваются"""
+        return self.base_url
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _backoff(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным джиттером."""
+        ceiling = min(self.config['BACKOFF_MAX'], self.config['BACKOFF_FACTOR'] * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def _request(self, endpoint: str, params: Dict[str, Any], retry: bool = True) -> requests.Response:
+        """
+        GET-запрос к AutoGRAPH через общий пул.
+        Идемпотентные вызовы повторяются при сетевых ошибках и 429/5xx.
+        """
+        url = f"{self.base_url}/{endpoint}"
+        timeout = self.timeouts.get(endpoint, self.config['DEFAULT_TIMEOUT'])
+        attempts = (self.config['MAX_RETRIES'] if retry else 0) + 1
+
+        for attempt in range(attempts):
+            self._count('requests')
+            last_attempt = attempt == attempts - 1
+            try:
+                response = self.session.get(url, params=params, timeout=timeout)
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+                logger.warning(f"⚠️ {endpoint} returned {response.status_code}, retrying")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt:
+                    self._count('failures')
+                    raise
+                logger.warning(f"⚠️ {endpoint} network error: {e}, retrying")
+
+            self._count('retries')
+            time.sleep(self._backoff(attempt))
 
     def get_session_token(self, user: str, password: str) -> Optional[str]:
-        url = f"{self.base_url}/Login"
         params = {"UserName": user, "Password": password}
         try:
-            with requests.Session() as s:
-                response = s.get(url, params=params, timeout=15)
-                response.raise_for_status()
-                token = response.text.strip().replace('"', '')
-                return token if (token and len(token) > 20) else None
+            # Логин не повторяем, чтобы не множить попытки входа
+            response = self._request("Login", params, retry=False)
+            response.raise_for_status()
+            token = response.text.strip().replace('"', '')
+            return token if (token and len(token) > 20) else None
         except Exception as e:
             logger.error(f"❌ Auth Error: {e}")
             return None
 
+    @cache_result(*SCHEMAS_CACHE)
     def get_schemas(self, session_id: str) -> List[Dict[str, Any]]:
-        url = f"{self.base_url}/EnumSchemas"
+        return self.fetch_schemas(session_id)
+
+    @coalesced('EnumSchemas')
+    def fetch_schemas(self, session_id: str) -> List[Dict[str, Any]]:
+        """EnumSchemas мимо кэша процесса: пустой ответ значит, что сессия уже не действует"""
         params = {"session": session_id}
         try:
-            with requests.Session() as s:
-                response = s.get(url, params=params, timeout=15)
-                response.raise_for_status()
-                return response.json()
+            response = self._request("EnumSchemas", params)
+            response.raise_for_status()
+            return response.json()
         except Exception as e:
             logger.error(f"❌ EnumSchemas Error: {e}")
             return []
 
+    @cache_result(*DEVICES_CACHE)
+    @coalesced('EnumDevices')
     def get_vehicles_by_schema(self, session_id: str, schema_id: str) -> List[Dict[str, Any]]:
-        url = f"{self.base_url}/EnumDevices"
         params = {"session": session_id, "schemaID": schema_id}
         try:
-            with requests.Session() as s:
-                response = s.get(url, params=params, timeout=15)
-                response.raise_for_status()
-                data = response.json()
-                if isinstance(data, dict):
-                    return data.get("Items", [])
-                return data if isinstance(data, list) else []
+            response = self._request("EnumDevices", params)
+            response.raise_for_status()
+            data = response.json()
+            if isinstance(data, dict):
+                return data.get("Items", [])
+            return data if isinstance(data, list) else []
         except Exception as e:
             logger.error(f"❌ EnumDevices Error: {e}")
             return []
 
+    @cache_result(*ONLINE_CACHE)
+    @coalesced('GetOnlineInfo')
     def get_online_info(self, session_id, schema_id, device_ids):
-        url = f"{self.base_url}/GetOnlineInfo"
         params = {"session": session_id, "schemaID": schema_id, "IDs": device_ids}
         try:
-            with requests.Session() as s:
-                response = s.get(url, params=params, timeout=15)
-                response.raise_for_status()
-                return response.json()
+            response = self._request("GetOnlineInfo", params)
+            response.raise_for_status()
+            return response.json()
         except Exception as e:
             logger.error(f"❌ GetOnlineInfo Error: {e}")
             return {}
 
-    def get_track_data(self, session_id, schema_id, device_id, start_dt, end_dt):
+    @cache_result(*TRACK_CACHE, max_bytes=64 * 1024 * 1024)
+    @coalesced('GetTrack')
+    def fetch_track(self, session_id, schema_id, device_id, start_dt, end_dt):
         """
-        Получение сырого трека.
-        AutoGRAPH возвращает объект с массивами DT (Time), Speed, и т.д.
+        Получение сырого трека с пробросом ошибок (AutoGraphError).
+        Нужен там, где пустой трек и сбой запроса надо различать.
         """
-        url = f"{self.base_url}/GetTrack"
         params = {
             "session": session_id,
             "schemaID": schema_id,
@@ -77,14 +207,88 @@ class AutoGraphService:
             "ED": end_dt
         }
         try:
-            with requests.Session() as s:
-                response = s.get(url, params=params, timeout=30)
-                if response.status_code == 200:
-                    return response.json()
-                return []
+            with self.track_slots:
+                response = self._request("GetTrack", params)
+            if response.status_code != 200:
+                raise AutoGraphError(f"GetTrack returned {response.status_code}")
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise AutoGraphError(f"GetTrack failed: {e}") from e
+
+    def track_chunks(self, start_dt, end_dt):
+        """Части периода [(start, end)] в секундах epoch"""
+        chunk_seconds = int(self.config['TRACK_CHUNK_HOURS'] * 3600) // 60 * 60
+        return split_period(autograph_to_epoch(start_dt), autograph_to_epoch(end_dt), max(chunk_seconds, 60))
+
+    def _fetch_track_chunk(self, session_id, schema_id, device_id, chunk):
+        """Одна часть периода; при сбое повторяется отдельно от остальных"""
+        retries = self.config['TRACK_CHUNK_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                raw = self.fetch_track(session_id, schema_id, device_id,
+                                       epoch_to_autograph(chunk[0]), epoch_to_autograph(chunk[1]))
+                return extract_segments(raw, device_id)
+            except AutoGraphError as e:
+                if attempt == retries:
+                    logger.error(f"❌ GetTrack chunk {chunk} for {device_id} failed: {e}")
+                    return None
+                time.sleep(self._backoff(attempt))
+
+    def fetch_track_range(self, session_id, schema_id, device_id, start_dt, end_dt) -> TrackFetchResult:
+        """
+        Трек за длинный период: части качаются параллельно (не больше
+        TRACK_WORKERS одновременно, и не больше TRACK_CONCURRENCY GetTrack
+        на процесс) и склеиваются по времени.
+        Упавшие части не роняют запрос, а попадают в failed.
+        """
+        chunks = self.track_chunks(start_dt, end_dt)
+        workers = min(self.config['TRACK_WORKERS'], len(chunks))
+        if workers <= 1:
+            results = [self._fetch_track_chunk(session_id, schema_id, device_id, chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(
+                    lambda chunk: self._fetch_track_chunk(session_id, schema_id, device_id, chunk), chunks
+                ))
+
+        fetched = [(chunk, segments) for chunk, segments in zip(chunks, results) if segments is not None]
+        failed = [chunk for chunk, segments in zip(chunks, results) if segments is None]
+        return TrackFetchResult(merge_chunk_segments(fetched) if fetched else [], failed)
+
+    def iter_track_range(self, session_id, schema_id, device_id, start_dt, end_dt):
+        """
+        Тот же трек, что у fetch_track_range, но итератором сегментов для потоковой
+        выдачи: части качаются по одной, следующая - когда сегменты предыдущей
+        уже отданы, поэтому в памяти не больше одной части. Упавшие части пропускаются.
+        """
+        # Разбор дат - сразу, а не при первом обходе уже отправляемого ответа
+        chunks = self.track_chunks(start_dt, end_dt)
+        return self._iter_chunks(session_id, schema_id, device_id, chunks)
+
+    def _iter_chunks(self, session_id, schema_id, device_id, chunks):
+        last = len(chunks) - 1
+        for i, chunk in enumerate(chunks):
+            segments = self._fetch_track_chunk(session_id, schema_id, device_id, chunk)
+            if segments is None:
+                continue
+            if last:
+                segments = clip_chunk_segments(segments, chunk, first=i == 0, last=i == last)
+            yield from drain_segments(segments)
+
+    def get_track_data(self, session_id, schema_id, device_id, start_dt, end_dt):
+        """
+        Сырой трек для старого /api/analytics/: {device_id: [сегменты]}.
+        Период качается по частям с повтором каждой (fetch_track_range), как и
+        в новых views; части, которые так и не удалось получить, в ответ не попадают.
+        """
+        try:
+            result = self.fetch_track_range(session_id, schema_id, device_id, start_dt, end_dt)
         except Exception as e:
             logger.error(f"❌ GetTrack error: {e}")
             return []
+        if result.partial:
+            logger.warning(f"⚠️ GetTrack for {device_id}: chunks {result.failed} failed, track is partial")
+        return {device_id: result.segments}
 
     def parse_moto_hours(self, fdt_str: str) -> int:
         try:
@@ -98,22 +302,15 @@ class AutoGraphService:
 
     @staticmethod
     def interpolate_fuel(raw_value, taring_items):
+        """
+        Перевод одного показания ДУТ в литры.
+        Для массивов используйте calibration.get_calibration(...).to_litres().
+        """
         # Жесткая проверка входных данных на None
         if raw_value is None or taring_items is None or not taring_items:
             return 0.0
         try:
-            if raw_value in [127, 125, 4095]:
-                return 0.0
-
-            # Очистка таблицы тарировки от пустых значений
-            clean_table = [i for i in taring_items if i.get('inputVal') is not None and i.get('outputVal') is not None]
-            if not clean_table:
-                return 0.0
-
-            sorted_table = sorted(clean_table, key=lambda x: x['inputVal'])
-            x = [float(i['inputVal']) for i in sorted_table]
-            y = [float(i['outputVal']) for i in sorted_table]
-            return float(np.interp(float(raw_value), x, y))
+            return CalibrationTable(taring_items).interpolate(raw_value)
         except Exception as e:
             logger.error(f"Interpolation calculation error: {e}")
-            return 0.0
\ No newline at end of file
+            return 0.0
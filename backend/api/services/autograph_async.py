@@ -0,0 +1,194 @@
+"""
+Асинхронный клиент AutoGRAPH на httpx.
+Те же методы, что и у AutoGraphService, но без блокировки воркера:
+один ASGI-процесс держит сотни одновременных запросов к апстриму.
+"""
+import asyncio
+import logging
+import weakref
+from typing import Optional, Dict, List, Any
+
+import httpx
+
+from .autograph import (
+    AutoGraphService, AutoGraphError, RETRY_STATUS_CODES, DEVICES_CACHE, ONLINE_CACHE, SCHEMAS_CACHE, TRACK_CACHE,
+)
+from .single_flight import coalesced
+from ..utils.cache import cache_result
+from .track import TrackFetchResult, epoch_to_autograph, extract_segments, merge_chunk_segments
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAutoGraphService(AutoGraphService):
+    # httpx.AsyncClient привязан к event loop, поэтому держим по клиенту на loop
+    _clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+    _async_track_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+        weakref.WeakKeyDictionary()
+    )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Общий keep-alive клиент для текущего event loop."""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=self.config.get('ASYNC_MAX_CONNECTIONS', 200),
+                    max_keepalive_connections=self.config['POOL_MAXSIZE'],
+                ),
+            )
+            self._clients[loop] = client
+        return client
+
+    @property
+    def track_slots(self) -> asyncio.Semaphore:
+        """Лимит одновременных GetTrack (TRACK_CONCURRENCY) на event loop."""
+        loop = asyncio.get_running_loop()
+        slots = self._async_track_slots.get(loop)
+        if slots is None:
+            slots = self._async_track_slots[loop] = asyncio.Semaphore(self.config['TRACK_CONCURRENCY'])
+        return slots
+
+    async def _request(self, endpoint: str, params: Dict[str, Any], retry: bool = True) -> httpx.Response:
+        """
+        GET-запрос к AutoGRAPH через общий клиент.
+        Политика повторов та же, что у синхронного сервиса.
+        """
+        timeout = self.timeouts.get(endpoint, self.config['DEFAULT_TIMEOUT'])
+        attempts = (self.config['MAX_RETRIES'] if retry else 0) + 1
+
+        for attempt in range(attempts):
+            self._count('requests')
+            last_attempt = attempt == attempts - 1
+            try:
+                response = await self.client.get(f"/{endpoint}", params=params, timeout=timeout)
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+                logger.warning(f"⚠️ {endpoint} returned {response.status_code}, retrying")
+            except httpx.TransportError as e:
+                if last_attempt:
+                    self._count('failures')
+                    raise
+                logger.warning(f"⚠️ {endpoint} network error: {e}, retrying")
+
+            self._count('retries')
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def get_session_token(self, user: str, password: str) -> Optional[str]:
+        params = {"UserName": user, "Password": password}
+        try:
+            # Логин не повторяем, чтобы не множить попытки входа
+            response = await self._request("Login", params, retry=False)
+            response.raise_for_status()
+            token = response.text.strip().replace('"', '')
+            return token if (token and len(token) > 20) else None
+        except Exception as e:
+            logger.error(f"❌ Auth Error: {e}")
+            return None
+
+    @cache_result(*SCHEMAS_CACHE)
+    async def get_schemas(self, session_id: str) -> List[Dict[str, Any]]:
+        return await self.fetch_schemas(session_id)
+
+    @coalesced('EnumSchemas')
+    async def fetch_schemas(self, session_id: str) -> List[Dict[str, Any]]:
+        """EnumSchemas мимо кэша процесса: пустой ответ значит, что сессия уже не действует"""
+        params = {"session": session_id}
+        try:
+            response = await self._request("EnumSchemas", params)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error(f"❌ EnumSchemas Error: {e}")
+            return []
+
+    @cache_result(*DEVICES_CACHE)
+    @coalesced('EnumDevices')
+    async def get_vehicles_by_schema(self, session_id: str, schema_id: str) -> List[Dict[str, Any]]:
+        params = {"session": session_id, "schemaID": schema_id}
+        try:
+            response = await self._request("EnumDevices", params)
+            response.raise_for_status()
+            data = response.json()
+            if isinstance(data, dict):
+                return data.get("Items", [])
+            return data if isinstance(data, list) else []
+        except Exception as e:
+            logger.error(f"❌ EnumDevices Error: {e}")
+            return []
+
+    @cache_result(*ONLINE_CACHE)
+    @coalesced('GetOnlineInfo')
+    async def get_online_info(self, session_id, schema_id, device_ids):
+        params = {"session": session_id, "schemaID": schema_id, "IDs": device_ids}
+        try:
+            response = await self._request("GetOnlineInfo", params)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error(f"❌ GetOnlineInfo Error: {e}")
+            return {}
+
+    @cache_result(*TRACK_CACHE, max_bytes=64 * 1024 * 1024)
+    @coalesced('GetTrack')
+    async def fetch_track(self, session_id, schema_id, device_id, start_dt, end_dt):
+        """Получение сырого трека с пробросом ошибок (AutoGraphError)"""
+        params = {
+            "session": session_id,
+            "schemaID": schema_id,
+            "ID": device_id,
+            "SD": start_dt,
+            "ED": end_dt
+        }
+        try:
+            async with self.track_slots:
+                response = await self._request("GetTrack", params)
+            if response.status_code != 200:
+                raise AutoGraphError(f"GetTrack returned {response.status_code}")
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise AutoGraphError(f"GetTrack failed: {e}") from e
+
+    async def _fetch_track_chunk(self, session_id, schema_id, device_id, chunk, semaphore):
+        retries = self.config['TRACK_CHUNK_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                async with semaphore:
+                    raw = await self.fetch_track(session_id, schema_id, device_id,
+                                                 epoch_to_autograph(chunk[0]), epoch_to_autograph(chunk[1]))
+                return extract_segments(raw, device_id)
+            except AutoGraphError as e:
+                if attempt == retries:
+                    logger.error(f"❌ GetTrack chunk {chunk} for {device_id} failed: {e}")
+                    return None
+                await asyncio.sleep(self._backoff(attempt))
+
+    async def fetch_track_range(self, session_id, schema_id, device_id, start_dt, end_dt) -> TrackFetchResult:
+        """Трек за длинный период по частям, не больше TRACK_WORKERS одновременно"""
+        chunks = self.track_chunks(start_dt, end_dt)
+        semaphore = asyncio.Semaphore(self.config['TRACK_WORKERS'])
+        results = await asyncio.gather(*(
+            self._fetch_track_chunk(session_id, schema_id, device_id, chunk, semaphore) for chunk in chunks
+        ))
+
+        fetched = [(chunk, segments) for chunk, segments in zip(chunks, results) if segments is not None]
+        failed = [chunk for chunk, segments in zip(chunks, results) if segments is None]
+        return TrackFetchResult(merge_chunk_segments(fetched) if fetched else [], failed)
+
+    async def get_track_data(self, session_id, schema_id, device_id, start_dt, end_dt):
+        """
+        Сырой трек для старого /api/analytics/: {device_id: [сегменты]}.
+        Период качается по частям с повтором каждой (fetch_track_range), как и
+        в новых views; части, которые так и не удалось получить, в ответ не попадают.
+        """
+        try:
+            result = await self.fetch_track_range(session_id, schema_id, device_id, start_dt, end_dt)
+        except Exception as e:
+            logger.error(f"❌ GetTrack error: {e}")
+            return []
+        if result.partial:
+            logger.warning(f"⚠️ GetTrack for {device_id}: chunks {result.failed} failed, track is partial")
+        return {device_id: result.segments}
@@ -0,0 +1,121 @@
+"""
+Скомпилированные таблицы тарировки ДУТ (LLS).
+Таблица чистится и сортируется один раз, дальше весь массив сырых
+показаний переводится в литры одним вызовом np.interp.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Служебные коды ДУТ: обрыв, ошибка датчика, переполнение
+SENSOR_ERROR_CODES = (127, 125, 4095)
+
+# Сколько скомпилированных таблиц держать в памяти процесса
+MAX_COMPILED_TABLES = 2048
+
+
+class CalibrationTable:
+    """Таблица тарировки: сырые показания ДУТ -> литры."""
+    __slots__ = ('x', 'y')
+
+    def __init__(self, taring_items):
+        # Очистка таблицы тарировки от пустых значений
+        clean_table = [i for i in (taring_items or [])
+                       if i.get('inputVal') is not None and i.get('outputVal') is not None]
+        x = np.array([float(i['inputVal']) for i in clean_table], dtype=np.float64)
+        y = np.array([float(i['outputVal']) for i in clean_table], dtype=np.float64)
+        # Стабильная сортировка, как sorted() в прежней реализации
+        order = np.argsort(x, kind='stable')
+        self.x = x[order]
+        self.y = y[order]
+
+    def __bool__(self):
+        return self.x.size > 0
+
+    def to_litres(self, raw_values) -> np.ndarray:
+        """
+        Перевод массива сырых показаний в литры.
+        None, NaN, нечисловые значения и служебные коды дают 0.0.
+        """
+        raw = _as_float_array(raw_values)
+        if not self:
+            return np.zeros(raw.shape, dtype=np.float64)
+        invalid = np.isnan(raw) | np.isin(raw, SENSOR_ERROR_CODES)
+        litres = np.interp(np.where(invalid, 0.0, raw), self.x, self.y)
+        litres[invalid] = 0.0
+        return litres
+
+    def interpolate(self, raw_value) -> float:
+        """Перевод одного показания в литры."""
+        return float(self.to_litres([raw_value])[0])
+
+
+def _as_float_array(raw_values) -> np.ndarray:
+    try:
+        return np.asarray(raw_values, dtype=np.float64).ravel()
+    except (TypeError, ValueError):
+        # Мусор в данных: разбираем поэлементно, непонятное -> NaN
+        result = np.empty(len(raw_values), dtype=np.float64)
+        for i, value in enumerate(raw_values):
+            try:
+                result[i] = float(value)
+            except (TypeError, ValueError):
+                result[i] = np.nan
+        return result
+
+
+def table_version(taring_items) -> str:
+    """Хэш содержимого таблицы тарировки (меняется при перетарировке)."""
+    payload = json.dumps(taring_items, sort_keys=True, default=str)
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def get_calibration(device_id, sensor_name, taring_items, version=None) -> CalibrationTable:
+    """
+    Скомпилированная таблица для датчика ТС.
+    Кэшируется по (ТС, датчик, версия таблицы), вытесняется по LRU.
+    """
+    key = (str(device_id), sensor_name, version or table_version(taring_items))
+    with _compiled_lock:
+        table = _compiled.get(key)
+        if table is not None:
+            _compiled.move_to_end(key)
+            return table
+
+    table = CalibrationTable(taring_items)
+
+    with _compiled_lock:
+        _compiled[key] = table
+        while len(_compiled) > MAX_COMPILED_TABLES:
+            _compiled.popitem(last=False)
+    return table
+
+
+def extract_taring_tables(vehicle):
+    """Извлечение таблиц тарировок ДУТ из свойств ТС"""
+    taring_tables = {}
+    for prop in vehicle.get('Properties', []):
+        name = prop.get('Name', '')
+        if 'LLS' in name and isinstance(prop.get('Value'), dict):
+            table = prop['Value'].get('items', [])
+            if table:
+                taring_tables[name] = table
+    return taring_tables
+
+
+def compile_tables(device_id, taring_tables):
+    """Скомпилированные таблицы для всех ДУТ ТС: {имя датчика: CalibrationTable}"""
+    return {
+        name: get_calibration(device_id, name, table)
+        for name, table in taring_tables.items()
+    }
@@ -0,0 +1,167 @@
+"""
+Расход топлива по участкам трека и перерасход относительно норм ТС.
+
+Трек делится на участки по состоянию между соседними точками:
+- движение - скорость выше STAND_SPEED;
+- холостой ход - стоит с включенным зажиганием;
+- стоянка с выключенным зажиганием и разрывы связи (дольше MAX_GAP_SECONDS)
+  в расход не входят.
+
+Пробег - гаверсинус по Lat/Lng только на участках движения (дрейф GPS на
+стоянке не копится), скачки быстрее MAX_JUMP_KMH отбрасываются; между
+точками без координат пробег считается по скорости.
+Фактический расход - падение сглаженного уровня топлива, интервалы внутри
+заправок и сливов исключаются. Норма: движение - л/100 км, холостой ход - л/ч
+(Vehicle.expected_consumption_move / expected_consumption_idle).
+"""
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+
+DEFAULT_CONFIG = {
+    'STAND_SPEED': 5.0,             # км/ч; выше - движение
+    'MAX_GAP_SECONDS': 600,         # Разрыв между точками длиннее - не учитываем
+    'MAX_JUMP_KMH': 200.0,          # Скачок координат быстрее - ошибка GPS
+    'OVERRUN_TOLERANCE': 0.15,      # Допустимое превышение нормы (доля)
+    'OVERRUN_MIN_LITRES': 5.0,      # Меньшее превышение не считается перерасходом
+    'MIN_SEGMENT_SECONDS': 600,     # Короче - участок слишком шумный для перерасхода
+}
+
+EARTH_RADIUS_KM = 6371.0088
+
+STATE_GAP, STATE_OFF, STATE_IDLE, STATE_MOVING = -1, 0, 1, 2
+STATE_NAMES = {STATE_IDLE: 'idle', STATE_MOVING: 'moving'}
+
+Segment = namedtuple('Segment', ['state', 'start', 'end', 'seconds', 'distance', 'actual', 'expected'])
+
+
+def consumption_config(config=None):
+    return {**DEFAULT_CONFIG, **getattr(settings, 'CONSUMPTION', {}), **(config or {})}
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Расстояние по дуге между массивами точек, км"""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def step_distances(lat, lng, has_coords, fallback):
+    """
+    Расстояния между соседними точками (n - 1 значений).
+    Где у одной из точек нет координат - берется fallback (по скорости).
+    """
+    lat = np.nan_to_num(np.asarray(lat, dtype=np.float64))
+    lng = np.nan_to_num(np.asarray(lng, dtype=np.float64))
+    distances = haversine_km(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    return np.where(has_coords[:-1] & has_coords[1:], distances, fallback)
+
+
+def interval_states(ts, speed, ignition, config):
+    """Состояние на каждом интервале между соседними точками"""
+    dt = np.diff(ts)
+    moving = (speed[:-1] + speed[1:]) / 2 > config['STAND_SPEED']
+    ignition_on = np.ones(len(dt), dtype=bool) if ignition is None else np.asarray(ignition, dtype=bool)[:-1]
+    states = np.where(moving, STATE_MOVING, np.where(ignition_on, STATE_IDLE, STATE_OFF))
+    states[(dt <= 0) | (dt > config['MAX_GAP_SECONDS'])] = STATE_GAP
+    return states, dt
+
+
+def consumption_segments(ts, speed, lat, lng, has_coords, level, rates, ignition=None, exclude=(), config=None):
+    """
+    Участки движения и холостого хода с фактическим и нормативным расходом.
+    level - сглаженный уровень топлива, rates - (л/ч на холостом, л/100 км в движении),
+    exclude - [(начало, конец)] в секундах epoch: заправки и сливы.
+    """
+    config = consumption_config(config)
+    ts = np.asarray(ts, dtype=np.float64)
+    if len(ts) < 2:
+        return []
+    speed = np.asarray(speed, dtype=np.float64)
+    states, dt = interval_states(ts, speed, ignition, config)
+
+    by_speed = (speed[:-1] + speed[1:]) / 2 * dt / 3600
+    distance = step_distances(lat, lng, np.asarray(has_coords, dtype=bool), by_speed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        jump = distance / np.where(dt > 0, dt, np.inf) * 3600 > config['MAX_JUMP_KMH']
+    distance[jump | (states != STATE_MOVING)] = 0.0
+
+    used = level[:-1] - level[1:]
+    for start, end in exclude:
+        i0, i1 = np.searchsorted(ts, [start, end], side='left')
+        used[max(i0 - 1, 0):i1] = 0.0
+
+    # Границы участков - смена состояния
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(states)) + 1))
+    seconds = np.add.reduceat(dt, bounds)
+    distances = np.add.reduceat(distance, bounds)
+    actual = np.add.reduceat(used, bounds)
+    idle_rate, move_rate = rates
+
+    segments = []
+    ends = np.append(bounds[1:], len(states))
+    for i, (b0, b1) in enumerate(zip(bounds.tolist(), ends.tolist())):
+        state = int(states[b0])
+        if state not in STATE_NAMES:
+            continue
+        if state == STATE_MOVING:
+            expected = distances[i] * move_rate / 100
+        else:
+            expected = seconds[i] / 3600 * idle_rate
+        segments.append(Segment(
+            state=STATE_NAMES[state],
+            start=float(ts[b0]),
+            end=float(ts[b1]),
+            seconds=float(seconds[i]),
+            distance=float(distances[i]),
+            actual=float(actual[i]),
+            expected=float(expected),
+        ))
+    return segments
+
+
+def is_overrun(segment, config):
+    if segment.seconds < config['MIN_SEGMENT_SECONDS'] or segment.expected <= 0:
+        return False
+    excess = segment.actual - segment.expected
+    return excess >= config['OVERRUN_MIN_LITRES'] and segment.actual > segment.expected * (1 + config['OVERRUN_TOLERANCE'])
+
+
+def overrun_segments(segments, config=None):
+    """Участки с расходом выше нормы с учетом допуска"""
+    config = consumption_config(config)
+    return [segment for segment in segments if is_overrun(segment, config)]
+
+
+def consumption_totals(segments, config=None):
+    """Итоги по участкам за период"""
+    config = consumption_config(config)
+    totals = {
+        'mileage_km': 0.0,
+        'moving_hours': 0.0,
+        'idle_hours': 0.0,
+        'fuel_actual_move': 0.0,
+        'fuel_actual_idle': 0.0,
+        'fuel_expected_move': 0.0,
+        'fuel_expected_idle': 0.0,
+        'overrun_litres': 0.0,
+        'overruns': 0,
+    }
+    for segment in segments:
+        suffix = 'move' if segment.state == 'moving' else 'idle'
+        totals['mileage_km'] += segment.distance
+        totals['moving_hours' if suffix == 'move' else 'idle_hours'] += segment.seconds / 3600
+        totals[f'fuel_actual_{suffix}'] += segment.actual
+        totals[f'fuel_expected_{suffix}'] += segment.expected
+        if is_overrun(segment, config):
+            totals['overrun_litres'] += segment.actual - segment.expected
+            totals['overruns'] += 1
+
+    totals['fuel_actual'] = totals['fuel_actual_move'] + totals['fuel_actual_idle']
+    totals['fuel_expected'] = totals['fuel_expected_move'] + totals['fuel_expected_idle']
+    totals['deviation_percent'] = (
+        (totals['fuel_actual'] - totals['fuel_expected']) / totals['fuel_expected'] * 100
+        if totals['fuel_expected'] > 0 else None
+    )
+    return {key: round(value, 2) if isinstance(value, float) else value for key, value in totals.items()}
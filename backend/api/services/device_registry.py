@@ -0,0 +1,190 @@
+"""
+Кэш метаданных ТС (EnumDevices) на уровне схемы.
+
+EnumDevices со всеми Properties и тарировками тяжелый, а данные одни и те же
+для всех диспетчеров схемы. Реестр держит по схеме список ТС, индекс по ID
+и хэш Properties каждого ТС:
+- устаревшая запись отдается сразу и обновляется в фоне;
+- хэши входят в ключи зависимых кэшей (треки, список ТС), поэтому при
+  изменении тарировок устаревает только то, что относится к этому ТС.
+
+Доступ сессии к схеме проверяется по EnumSchemas (с кэшем), чтобы общий
+кэш не раздавал ТС чужим сессиям.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+
+from .autograph import AutoGraphService
+from ..utils.cache import invalidate_tags
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = 300       # Старше - обновляем в фоне, отдавая текущую запись
+MAX_AGE_SECONDS = 3600      # Старше - обновляем синхронно
+ACCESS_TTL = 600            # Сколько помним, что сессии доступна схема
+
+
+def properties_hash(vehicle):
+    """Хэш содержимого Properties ТС (тарировки, госномер и т.д.)"""
+    raw = json.dumps(vehicle.get('Properties', []), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+class SchemaDevices:
+    """ТС одной схемы: список, индекс по ID и хэши Properties."""
+    __slots__ = ('schema_id', 'devices', 'index', 'hashes', 'version', 'fetched_at', '_memo')
+
+    def __init__(self, schema_id, devices, fetched_at=None):
+        self.schema_id = schema_id
+        self.devices = [v for v in devices or [] if isinstance(v, dict)]
+        self.index = {str(v.get('ID')): v for v in self.devices}
+        self.hashes = {device_id: properties_hash(v) for device_id, v in self.index.items()}
+        self.version = hashlib.md5(json.dumps(sorted(self.hashes.items())).encode()).hexdigest()
+        self.fetched_at = time.monotonic() if fetched_at is None else fetched_at
+        self._memo = {}
+
+    def __bool__(self):
+        return bool(self.devices)
+
+    def get(self, device_id):
+        return self.index.get(str(device_id))
+
+    def memo(self, name, build):
+        """Производные данные (например, ответ списка ТС) живут столько же, сколько запись"""
+        if name not in self._memo:
+            self._memo[name] = build()
+        return self._memo[name]
+
+
+class DeviceRegistry:
+    def __init__(self, refresh_seconds=REFRESH_SECONDS, max_age_seconds=MAX_AGE_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self._entries = {}
+        self._access = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    # --- доступ сессии к схеме ---
+
+    def remember_schemas(self, session_id, schemas):
+        """Запоминаем схемы, полученные сессией из EnumSchemas"""
+        expires = time.monotonic() + ACCESS_TTL
+        with self._lock:
+            for schema in schemas or []:
+                if isinstance(schema, dict) and schema.get('ID') is not None:
+                    self._access[(session_id, str(schema['ID']))] = expires
+
+    def _access_known(self, session_id, schema_id):
+        return self._access.get((session_id, str(schema_id)), 0) > time.monotonic()
+
+    def has_access(self, service, session_id, schema_id):
+        if not self._access_known(session_id, schema_id):
+            self.remember_schemas(session_id, service.get_schemas(session_id))
+        return self._access_known(session_id, schema_id)
+
+    async def ahas_access(self, service, session_id, schema_id):
+        if not self._access_known(session_id, schema_id):
+            self.remember_schemas(session_id, await service.get_schemas(session_id))
+        return self._access_known(session_id, schema_id)
+
+    # --- чтение ---
+
+    def _cached(self, schema_id):
+        """(запись, нужно ли обновить в фоне); None - нужен синхронный запрос"""
+        entry = self._entries.get(str(schema_id))
+        if entry is None:
+            return None, False
+        age = time.monotonic() - entry.fetched_at
+        if age > self.max_age_seconds:
+            return None, False
+        return entry, age > self.refresh_seconds
+
+    def get(self, session_id, schema_id, service=None) -> SchemaDevices:
+        """ТС схемы для сессии: из кэша или из EnumDevices"""
+        service = service or AutoGraphService()
+        entry, stale = self._cached(schema_id)
+        if entry is None or not self.has_access(service, session_id, schema_id):
+            # Нет записи или доступ не подтвержден - решает сам AutoGRAPH
+            return self.refresh(session_id, schema_id, service)
+        if stale:
+            self._refresh_in_background(session_id, schema_id)
+        return entry
+
+    async def aget(self, session_id, schema_id, service) -> SchemaDevices:
+        """То же, что get, для AsyncAutoGraphService"""
+        entry, stale = self._cached(schema_id)
+        if entry is None or not await self.ahas_access(service, session_id, schema_id):
+            vehicles = await service.get_vehicles_by_schema(session_id, schema_id)
+            # store сбрасывает теги зависимых кэшей (запись в SQLite) - не на event loop
+            return await sync_to_async(self.store, thread_sensitive=False)(session_id, schema_id, vehicles)
+        if stale:
+            self._refresh_in_background(session_id, schema_id)
+        return entry
+
+    # --- обновление ---
+
+    def refresh(self, session_id, schema_id, service=None) -> SchemaDevices:
+        service = service or AutoGraphService()
+        return self.store(session_id, schema_id, service.get_vehicles_by_schema(session_id, schema_id))
+
+    def store(self, session_id, schema_id, devices) -> SchemaDevices:
+        """
+        Сохранение ответа EnumDevices. Пустой ответ (ошибка или нет доступа)
+        не кэшируется и не затирает имеющуюся запись.
+        """
+        schema_id = str(schema_id)
+        entry = SchemaDevices(schema_id, devices)
+        if not entry:
+            return entry
+
+        with self._lock:
+            self._access[(session_id, schema_id)] = time.monotonic() + ACCESS_TTL
+            old = self._entries.get(schema_id)
+            if old is not None and old.version == entry.version:
+                # Ничего не поменялось - сохраняем производные данные
+                old.fetched_at = entry.fetched_at
+                return old
+            self._entries[schema_id] = entry
+
+        if old is not None:
+            changed = [device_id for device_id, h in entry.hashes.items() if old.hashes.get(device_id) != h]
+            removed = [device_id for device_id in old.hashes if device_id not in entry.hashes]
+            logger.info(f"Schema {schema_id} devices changed: {changed}, removed: {removed}")
+            # Треки и расход этих ТС посчитаны по старым тарировкам - освобождаем место сразу
+            invalidate_tags(*[f'device:{device_id}' for device_id in changed + removed])
+        return entry
+
+    def _refresh_in_background(self, session_id, schema_id):
+        schema_id = str(schema_id)
+        with self._lock:
+            if schema_id in self._refreshing:
+                return
+            self._refreshing.add(schema_id)
+
+        def run():
+            try:
+                self.refresh(session_id, schema_id)
+            except Exception as e:
+                logger.error(f"❌ Background EnumDevices refresh for schema {schema_id} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(schema_id)
+
+        threading.Thread(target=run, name=f'devices-refresh-{schema_id}', daemon=True).start()
+
+    def invalidate(self, schema_id=None):
+        """Сброс записи схемы (или всех схем)"""
+        with self._lock:
+            if schema_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(schema_id), None)
+
+
+device_registry = DeviceRegistry()
@@ -0,0 +1,69 @@
+"""
+Прореживание треков для графиков: Largest-Triangle-Three-Buckets (LTTB).
+Скорость и топливо прореживаются независимо, затем индексы объединяются,
+поэтому резкие сливы/заправки не теряются из-за «спокойной» скорости.
+"""
+import numpy as np
+
+from .track import numeric_column
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Индексы точек, отобранных LTTB.
+    Первая и последняя точки всегда сохраняются.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Границы корзин: первая и последняя точки стоят отдельно
+    edges = (np.arange(n_out - 1) * ((n - 2) / (n_out - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    # Средние точки корзин считаем сразу для всех корзин
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    avg_x = np.append(avg_x, x[-1])
+    avg_y = np.append(avg_y, y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Площадь треугольника (a, кандидат, среднее следующей корзины)
+        ax, ay = x[a], y[a]
+        cx, cy = avg_x[i + 1], avg_y[i + 1]
+        areas = np.abs((ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_track(columns, max_points):
+    """
+    Прореживание трека до max_points точек.
+    Каждая серия (скорость, топливо) получает половину бюджета,
+    плюс сохраняются ее глобальные минимум и максимум.
+    """
+    n = len(columns)
+    if not max_points or n <= max_points:
+        return columns
+
+    if columns.t.dtype.kind in 'iuf':
+        x = columns.t.astype(np.float64)
+    else:
+        # Время строкой: ось X по порядковому номеру точки
+        x = np.arange(n, dtype=np.float64)
+
+    per_series = max(3, max_points // 2 - 2)
+    keep = []
+    for y in (numeric_column(columns.s), columns.f):
+        keep.append(lttb_indices(x, y, per_series))
+        keep.append([int(np.argmin(y)), int(np.argmax(y))])
+
+    indices = np.unique(np.concatenate(keep))
+    return columns.take(indices)
@@ -0,0 +1,454 @@
+"""
+Поиск сливов и заправок по ряду топлива из трека.
+
+Ряд топлива (литры по всем ДУТ, TrackColumns.f) шумит: волны в баке при
+разгоне и торможении, дребезг датчика, провалы в 0 при ошибке ДУТ. Поэтому:
+1. провалы датчика (0 л) заполняются предыдущим значением;
+2. медианный фильтр убирает выбросы, скользящее среднее - мелкий дребезг;
+3. ступенька - изменение уровня не меньше порога за STEP_SECONDS;
+4. объем считается по установившимся уровням (медиана за SETTLE_SECONDS
+   до и после ступеньки), поэтому кратковременные всплески отсекаются;
+5. ступенька в движении (скорость выше STAND_SPEED при включенном
+   зажигании) - колебания топлива в баке, а не заправка или слив.
+
+По точкам все шаги векторные, цикл идет только по найденным ступенькам.
+Перерасходы (overrun) - участки с расходом выше норм ТС, см. consumption.
+
+Инкрементальный режим (update_fuel_events): у каждого Vehicle есть отметка
+events_processed_until и состояние фильтра на ней (events_state). Прогон
+берет только новые данные с перекрытием OVERLAP = STEP_SECONDS +
+SETTLE_SECONDS, чтобы ступенька на границе была видна целиком, а пишет
+события только в [отметка, новая отметка). Каждое событие принадлежит
+ровно одному прогону, повторный прогон того же окна ничего не дублирует.
+"""
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from numpy.lib.stride_tricks import sliding_window_view
+
+from ..models import FuelEvent, Vehicle
+from .autograph import AutoGraphService
+from .calibration import compile_tables, extract_taring_tables
+from .consumption import consumption_segments, consumption_totals, overrun_segments
+from .device_registry import device_registry
+from .telemetry_store import telemetry_store
+from .track import TrackColumns, autograph_to_epoch, dt_to_epoch, epoch_to_autograph, numeric_column
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'MEDIAN_POINTS': 5,         # Окно медианного фильтра, точек
+    'MEAN_POINTS': 3,           # Окно скользящего среднего, точек
+    'STEP_SECONDS': 600,        # За сколько должна пройти ступенька
+    'SETTLE_SECONDS': 300,      # Окно установившегося уровня до/после
+    'REFILL_MIN_LITRES': 15.0,
+    'DRAIN_MIN_LITRES': 10.0,
+    'STAND_SPEED': 5.0,         # км/ч; выше - ТС едет
+    'MAX_MOVING_SHARE': 0.2,    # Доля точек ступеньки в движении, дальше - колебания
+    'IGNITION_FIELD': 'DIgnition',
+    'BULK_BATCH_SIZE': 1000,
+    'BACKFILL_SECONDS': 7 * 86400,  # С какой глубины начинать ТС без отметки
+    'UPDATE_INTERVAL': 600,         # Шаг инкрементального прогона, секунд
+}
+
+# Типы событий, которые находит детектор (остальные ставятся не им)
+DETECTED_TYPES = ('drain', 'refill', 'overrun')
+
+FuelStep = namedtuple('FuelStep', ['event_type', 'timestamp', 'volume', 'start', 'end'])
+
+
+def fuel_events_config(config=None):
+    return {**DEFAULT_CONFIG, **getattr(settings, 'FUEL_EVENTS', {}), **(config or {})}
+
+
+# --- фильтрация ---
+
+def fill_sensor_gaps(fuel, initial=None):
+    """
+    Нули (ошибка ДУТ) заменяются последним нормальным значением; None - данных нет.
+    initial - уровень до начала ряда (состояние с прошлого прогона).
+    """
+    valid = fuel > 0
+    if not valid.any():
+        return np.full(len(fuel), float(initial)) if initial else None
+    idx = np.where(valid, np.arange(len(fuel)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    filled = fuel[idx]
+    # До первого нормального значения - уровень с прошлого прогона или само это значение
+    first = np.argmax(valid)
+    filled[:first] = initial if initial else fuel[first]
+    return filled
+
+
+def median_filter(values, window):
+    """Скользящая медиана по window точек (края дополняются крайними значениями)"""
+    if window <= 1 or len(values) < window:
+        return values.copy()
+    half = window // 2
+    padded = np.pad(values, (half, window - 1 - half), mode='edge')
+    return np.median(sliding_window_view(padded, window), axis=1)
+
+
+def rolling_mean(values, window):
+    """Центрированное скользящее среднее по window точек"""
+    if window <= 1 or len(values) < window:
+        return values.copy()
+    half = window // 2
+    padded = np.pad(values, (half, window - 1 - half), mode='edge')
+    cumsum = np.concatenate(([0.0], np.cumsum(padded)))
+    return (cumsum[window:] - cumsum[:-window]) / window
+
+
+def smooth_fuel(fuel, config, initial=None):
+    filled = fill_sensor_gaps(np.asarray(fuel, dtype=np.float64), initial)
+    if filled is None:
+        return None
+    return rolling_mean(median_filter(filled, config['MEDIAN_POINTS']), config['MEAN_POINTS'])
+
+
+# --- ступеньки ---
+
+def _runs(mask):
+    """Непрерывные участки True: массивы начал и концов (конец не включается)"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def find_steps(ts, level, step_seconds, min_rise, min_drop):
+    """
+    Кандидаты в ступеньки: участки, где уровень за step_seconds вырос на
+    min_rise или упал на min_drop. Возвращает [(знак, начало, конец)] по индексам.
+    """
+    ahead = np.searchsorted(ts, ts + step_seconds, side='right') - 1
+    delta = level[ahead] - level
+
+    steps = []
+    for sign, mask in ((1, delta >= min_rise), (-1, delta <= -min_drop)):
+        starts, ends = _runs(mask)
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            stop = int(ahead[end - 1])
+            # Участки, перекрывающие друг друга, - одна ступенька
+            if steps and steps[-1][0] == sign and start <= steps[-1][2]:
+                steps[-1] = (sign, steps[-1][1], max(stop, steps[-1][2]))
+            else:
+                steps.append((sign, start, stop))
+    steps.sort(key=lambda step: step[1])
+    return steps
+
+
+def detect_fuel_events(ts, speed, fuel, ignition=None, config=None, initial_fuel=None):
+    """
+    Сливы и заправки в ряду топлива.
+    ts - секунды epoch, speed - км/ч, fuel - литры, ignition - bool или None (неизвестно),
+    initial_fuel - уровень перед первой точкой (из состояния прошлого прогона).
+    Возвращает [FuelStep] с временем события в секундах epoch.
+    """
+    config = fuel_events_config(config)
+    ts = np.asarray(ts, dtype=np.float64)
+    if len(ts) < 2:
+        return []
+    level = smooth_fuel(fuel, config, initial_fuel)
+    if level is None:
+        return []
+    return level_steps(ts, speed, level, ignition, config)
+
+
+def level_steps(ts, speed, level, ignition, config):
+    """Сливы и заправки по уже сглаженному уровню"""
+    moving = np.asarray(speed, dtype=np.float64) > config['STAND_SPEED']
+    if ignition is not None:
+        # Зажигание выключено - ТС стоит, даже если GPS дает скорость
+        moving &= np.asarray(ignition, dtype=bool)
+    moving_cumsum = np.concatenate(([0], np.cumsum(moving)))
+
+    settle = config['SETTLE_SECONDS']
+    events = []
+    for sign, start, end in find_steps(ts, level, config['STEP_SECONDS'],
+                                       config['REFILL_MIN_LITRES'], config['DRAIN_MIN_LITRES']):
+        moving_share = (moving_cumsum[end + 1] - moving_cumsum[start]) / (end + 1 - start)
+        if moving_share > config['MAX_MOVING_SHARE']:
+            continue
+
+        before_from = np.searchsorted(ts, ts[start] - settle, side='left')
+        after_to = np.searchsorted(ts, ts[end] + settle, side='right')
+        volume = float(np.median(level[end:after_to]) - np.median(level[before_from:start + 1]))
+        if sign > 0 and volume < config['REFILL_MIN_LITRES']:
+            continue
+        if sign < 0 and -volume < config['DRAIN_MIN_LITRES']:
+            continue
+
+        # Время события - самое резкое изменение уровня внутри ступеньки
+        peak = start + int(np.argmax(sign * np.diff(level[start:end + 1]))) + 1 if end > start else start
+        events.append(FuelStep(
+            event_type='refill' if sign > 0 else 'drain',
+            timestamp=float(ts[peak]),
+            volume=round(abs(volume), 1),
+            start=float(ts[start]),
+            end=float(ts[end]),
+        ))
+    return events
+
+
+# --- трек и база ---
+
+def ignition_column(track_segments, field=None):
+    """
+    Зажигание по точкам трека (в том же порядке, что TrackColumns).
+    None - поля нет ни в одном сегменте; точки без значения считаются включенными.
+    """
+    field = field or fuel_events_config()['IGNITION_FIELD']
+    chunks, found = [], False
+    for segment in track_segments:
+        n = min(len(segment.get('DT', [])), len(segment.get('Speed', [])))
+        if n == 0:
+            continue
+        column = np.ones(n, dtype=bool)
+        values = segment.get(field) or []
+        k = min(n, len(values))
+        if k:
+            found = True
+            column[:k] = [bool(v) if v is not None else True for v in values[:k]]
+        chunks.append(column)
+    return np.concatenate(chunks) if found else None
+
+
+def track_fuel_events(columns, ignition=None, config=None, initial_fuel=None):
+    """Сливы и заправки по колонкам трека (TrackColumns)"""
+    if len(columns) < 2:
+        return []
+    return detect_fuel_events(dt_to_epoch(columns.t), numeric_column(columns.s), columns.f,
+                              ignition, config, initial_fuel)
+
+
+def analyze_track(columns, ignition=None, rates=None, config=None, initial_fuel=None):
+    """
+    Разбор трека одного ТС: (события, итоги расхода или None).
+    rates - (л/ч на холостом, л/100 км в движении); с ними к сливам и заправкам
+    добавляются перерасходы по участкам, а в итогах - расход против нормы.
+    """
+    config = fuel_events_config(config)
+    if len(columns) < 2:
+        return [], None
+    ts = dt_to_epoch(columns.t)
+    speed = numeric_column(columns.s)
+    level = smooth_fuel(columns.f, config, initial_fuel)
+    if level is None:
+        return [], None
+
+    steps = level_steps(ts, speed, level, ignition, config)
+    if rates is None:
+        return steps, None
+
+    segments = consumption_segments(ts, speed, columns.lat, columns.lng, columns.has_coords, level, rates,
+                                    ignition, [(step.start, step.end) for step in steps])
+    for segment in overrun_segments(segments):
+        steps.append(FuelStep(
+            event_type='overrun',
+            timestamp=segment.start,
+            volume=round(segment.actual - segment.expected, 1),
+            start=segment.start,
+            end=segment.end,
+        ))
+
+    totals = consumption_totals(segments)
+    for event_type in ('refill', 'drain'):
+        volumes = [step.volume for step in steps if step.event_type == event_type]
+        totals[f'{event_type}s'] = len(volumes)
+        totals[f'{event_type}_litres'] = round(sum(volumes), 1)
+    totals['fuel_start'] = round(float(level[0]), 1)
+    totals['fuel_end'] = round(float(level[-1]), 1)
+    return sorted(steps, key=lambda step: step.timestamp), totals
+
+
+def vehicle_rates(vehicle):
+    """Нормы расхода ТС: (л/ч на холостом, л/100 км в движении)"""
+    return vehicle.expected_consumption_idle, vehicle.expected_consumption_move
+
+
+def fuel_state(columns, until):
+    """Состояние фильтра для следующего прогона: последний нормальный уровень до until"""
+    if not len(columns):
+        return {}
+    ts = dt_to_epoch(columns.t)
+    idx = np.flatnonzero(columns.f[:np.searchsorted(ts, until, side='left')] > 0)
+    if not len(idx):
+        return {}
+    return {'fuel': float(columns.f[idx[-1]]), 'ts': float(ts[idx[-1]])}
+
+
+def _as_datetime(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
+def replace_fuel_events(vehicle, start, end, steps, config=None):
+    """
+    Запись найденных событий ТС за период [start, end) (секунды epoch).
+    Неподтвержденные сливы/заправки периода заменяются результатом прогона,
+    подтвержденные пользователем не трогаются и не дублируются.
+    """
+    config = fuel_events_config(config)
+    period = {
+        'vehicle': vehicle,
+        'event_type__in': DETECTED_TYPES,
+        'timestamp__gte': _as_datetime(start),
+        'timestamp__lt': _as_datetime(end),
+    }
+    with transaction.atomic():
+        FuelEvent.objects.filter(is_confirmed=False, **period).delete()
+        # Подтвержденное событие рядом (в пределах STEP_SECONDS) - то же самое событие
+        confirmed = [
+            (event_type, timestamp.timestamp())
+            for event_type, timestamp in FuelEvent.objects.filter(is_confirmed=True, **period)
+            .values_list('event_type', 'timestamp')
+        ]
+        events = [
+            FuelEvent(vehicle=vehicle, event_type=step.event_type,
+                      timestamp=_as_datetime(step.timestamp), volume=step.volume)
+            for step in steps
+            if start <= step.timestamp < end and not any(
+                event_type == step.event_type and abs(ts - step.timestamp) <= config['STEP_SECONDS']
+                for event_type, ts in confirmed
+            )
+        ]
+        # Upsert по (ТС, тип, время): параллельный прогон того же окна не даст дублей
+        return FuelEvent.objects.bulk_create(
+            events, batch_size=config['BULK_BATCH_SIZE'],
+            update_conflicts=True, unique_fields=['vehicle', 'event_type', 'timestamp'], update_fields=['volume'],
+        )
+
+
+def ensure_vehicles(devices, device_ids):
+    """Записи Vehicle для ТС из реестра: {device_id: Vehicle}, недостающие создаются"""
+    vehicles = {v.device_id: v for v in Vehicle.objects.filter(device_id__in=device_ids)}
+    missing = [device_id for device_id in device_ids if device_id not in vehicles]
+    if missing:
+        Vehicle.objects.bulk_create(
+            [Vehicle(name=(devices.get(device_id) or {}).get('Name') or device_id, device_id=device_id)
+             for device_id in missing],
+            ignore_conflicts=True,
+        )
+        vehicles.update({v.device_id: v for v in Vehicle.objects.filter(device_id__in=missing)})
+    return vehicles
+
+
+def load_device_track(service, session_id, schema_id, device, start, end, config=None):
+    """Трек ТС за [start, end) (секунды epoch): (TrackColumns, зажигание, неполный ли трек)"""
+    device_id = str(device.get('ID'))
+    result = telemetry_store.get_track(service, session_id, schema_id, device_id,
+                                       epoch_to_autograph(start), epoch_to_autograph(end))
+    columns = TrackColumns.from_segments(result.segments, compile_tables(device_id, extract_taring_tables(device)))
+    ignition = ignition_column(result.segments, fuel_events_config(config)['IGNITION_FIELD'])
+    return columns, ignition, result.partial
+
+
+def analyze_device(service, session_id, schema_id, device, start, end, config=None,
+                   initial_fuel=None, state_until=None, rates=None):
+    """
+    Трек ТС за [start, end) -> ([FuelStep], неполный ли трек, состояние на state_until).
+    Без обращений к базе.
+    """
+    columns, ignition, partial = load_device_track(service, session_id, schema_id, device, start, end, config)
+    steps, _ = analyze_track(columns, ignition, rates, config, initial_fuel)
+    return steps, partial, fuel_state(columns, state_until) if state_until is not None else {}
+
+
+def _run_devices(service, session_id, schema_id, devices, jobs, workers, config, write):
+    """
+    Треки качаются и разбираются параллельно, в базу пишет только текущий поток.
+    jobs: {device_id: (start, end, initial_fuel, state_until, rates)}; write(device_id, steps, state).
+    ТС с неполным треком не пишутся, чтобы не затереть события из недокачанных кусков.
+    """
+    stats = {'vehicles': 0, 'events': 0, 'partial': []}
+    if not jobs:
+        return stats
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as pool:
+        futures = {
+            pool.submit(analyze_device, service, session_id, schema_id, devices.get(device_id),
+                        start, end, config, initial_fuel, state_until, rates): device_id
+            for device_id, (start, end, initial_fuel, state_until, rates) in jobs.items()
+        }
+        for future in as_completed(futures):
+            device_id = futures[future]
+            try:
+                steps, partial, state = future.result()
+            except Exception as e:
+                logger.error(f"❌ Fuel events for device {device_id} failed: {e}")
+                stats['partial'].append(device_id)
+                continue
+            if partial:
+                logger.warning(f"⚠️ Track of device {device_id} is incomplete, events are not saved")
+                stats['partial'].append(device_id)
+                continue
+            stats['events'] += len(write(device_id, steps, state))
+            stats['vehicles'] += 1
+    return stats
+
+
+def _schema_devices(session_id, schema_id, device_ids, service):
+    devices = device_registry.get(session_id, schema_id, service)
+    device_ids = [str(d) for d in device_ids] if device_ids else list(devices.index)
+    device_ids = [device_id for device_id in device_ids if devices.get(device_id)]
+    return devices, ensure_vehicles(devices, device_ids)
+
+
+def scan_fuel_events(session_id, schema_id, start_dt, end_dt, device_ids=None, service=None, workers=None, config=None):
+    """
+    Поиск сливов/заправок/перерасходов по ТС схемы за произвольный период (даты в формате AutoGRAPH).
+    Отметки ТС не меняются. Возвращает {'vehicles': N, 'events': N, 'partial': [device_id]}.
+    """
+    service = service or AutoGraphService()
+    devices, vehicles = _schema_devices(session_id, schema_id, device_ids, service)
+    start, end = autograph_to_epoch(start_dt), autograph_to_epoch(end_dt)
+    jobs = {device_id: (start, end, None, None, vehicle_rates(vehicle)) for device_id, vehicle in vehicles.items()}
+
+    def write(device_id, steps, state):
+        return replace_fuel_events(vehicles[device_id], start, end, steps, config)
+
+    return _run_devices(service, session_id, schema_id, devices, jobs,
+                        workers or service.config['BATCH_TRACK_WORKERS'], config, write)
+
+
+def update_fuel_events(session_id, schema_id, device_ids=None, service=None, workers=None, config=None, now=None):
+    """
+    Инкрементальный прогон по ТС схемы: только данные после отметки каждого ТС.
+    Новая отметка - граница устоявшихся данных хранилища минус OVERLAP
+    (события ближе к концу данных могут быть еще не завершены).
+    События и отметка пишутся в одной транзакции.
+    """
+    service = service or AutoGraphService()
+    config = fuel_events_config(config)
+    devices, vehicles = _schema_devices(session_id, schema_id, device_ids, service)
+    overlap = config['STEP_SECONDS'] + config['SETTLE_SECONDS']
+    data_end = (now if now is not None else telemetry_store.settled_until()) // 60 * 60
+    new_watermark = data_end - overlap
+
+    jobs, watermarks = {}, {}
+    for device_id, vehicle in vehicles.items():
+        if vehicle.events_processed_until is not None:
+            watermark = vehicle.events_processed_until.timestamp()
+        else:
+            watermark = new_watermark - config['BACKFILL_SECONDS']
+        if new_watermark - watermark < 60:
+            continue
+        watermarks[device_id] = watermark
+        jobs[device_id] = (watermark - overlap, data_end, (vehicle.events_state or {}).get('fuel'),
+                           new_watermark - overlap, vehicle_rates(vehicle))
+
+    def write(device_id, steps, state):
+        vehicle = vehicles[device_id]
+        with transaction.atomic():
+            created = replace_fuel_events(vehicle, watermarks[device_id], new_watermark, steps, config)
+            vehicle.events_processed_until = _as_datetime(new_watermark)
+            vehicle.events_state = state or vehicle.events_state
+            vehicle.save(update_fields=['events_processed_until', 'events_state'])
+        return created
+
+    stats = _run_devices(service, session_id, schema_id, devices, jobs,
+                         workers or service.config['BATCH_TRACK_WORKERS'], config, write)
+    stats['up_to_date'] = len(vehicles) - len(jobs)
+    return stats
@@ -0,0 +1,105 @@
+"""
+Фоновый опрос GetOnlineInfo по схемам.
+
+Число запросов к AutoGRAPH зависит от размера парка и частоты опроса,
+а не от числа открытых вкладок: опросчик раз в INTERVAL секунд берет
+схемы, которые недавно смотрели (online_store.watched), запрашивает
+их ТС пачками по BATCH_SIZE ID и пишет нормализованный снимок.
+
+Запуск: python manage.py poll_online
+или поток в процессе приложения (ONLINE_POLLER['RUN_IN_PROCESS']): его
+запускают core/asgi.py и core/wsgi.py, то есть только процессы, которые
+обслуживают запросы, а не migrate, shell, тесты или сам poll_online.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .autograph import AutoGraphService
+from .device_registry import device_registry
+from .online_store import online_store, normalize_online_info
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'INTERVAL': 15,
+    'BATCH_SIZE': 200,
+    'RUN_IN_PROCESS': False,
+}
+
+
+def poller_config():
+    return {**DEFAULT_CONFIG, **getattr(settings, 'ONLINE_POLLER', {})}
+
+
+class FleetPoller:
+    def __init__(self, service=None, store=online_store, interval=None, batch_size=None):
+        config = poller_config()
+        self.service = service or AutoGraphService()
+        self.store = store
+        self.interval = interval or config['INTERVAL']
+        self.batch_size = batch_size or config['BATCH_SIZE']
+
+    def poll_schema(self, schema_id, session_id):
+        """Опрос всех ТС схемы пачками; None - данных не получено"""
+        devices = device_registry.get(session_id, schema_id, self.service)
+        ids = list(devices.index)
+        online = {}
+        for start in range(0, len(ids), self.batch_size):
+            batch = ','.join(ids[start:start + self.batch_size])
+            raw_online = self.service.get_online_info(session_id, schema_id, batch)
+            if raw_online:
+                online.update(normalize_online_info(raw_online, self.service.parse_moto_hours))
+        if not online:
+            return None
+        return self.store.save(schema_id, online)
+
+    def poll_once(self):
+        for schema_id, session_id in self.store.watched().items():
+            try:
+                snapshot = self.poll_schema(schema_id, session_id)
+                if snapshot is None:
+                    logger.warning(f"⚠️ No online data for schema {schema_id}")
+            except Exception as e:
+                logger.error(f"❌ Online poll for schema {schema_id} failed: {e}")
+
+    def run(self, stop_event=None):
+        """Опрос с постоянным шагом, пока не выставлен stop_event"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            started = time.monotonic()
+            self.poll_once()
+            stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+def poll_if_stale(schema_id, session_id, service=None):
+    """
+    Опрос схемы, если снимок старше двух шагов опросчика (опросчик не запущен).
+    Блокировка в кэше: при многих подписчиках опрашивает один.
+    """
+    interval = poller_config()['INTERVAL']
+    if online_store.head(schema_id, max_age=interval * 2) is not None:
+        return
+    if cache.add(f'online:poll-lock:{schema_id}', 1, timeout=interval):
+        FleetPoller(service=service).poll_schema(schema_id, session_id)
+
+
+_thread = None
+
+
+def start_poller_thread():
+    """Опросчик в потоке текущего процесса (один на процесс)"""
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _thread = threading.Thread(target=FleetPoller().run, name='online-poller', daemon=True)
+        _thread.start()
+    return _thread
+
+
+def start_in_process_poller():
+    """Поток опросчика, если включен ONLINE_POLLER['RUN_IN_PROCESS']"""
+    if poller_config()['RUN_IN_PROCESS']:
+        return start_poller_thread()
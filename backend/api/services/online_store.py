@@ -0,0 +1,230 @@
+"""
+Общее хранилище онлайн-состояния парка: снимки GetOnlineInfo по схемам.
+
+Пишет фоновый опросчик (manage.py poll_online или поток в приложении),
+views только читают. Снимки лежат в кэше Django: с общим бэкендом
+(Redis/Memcached/файлы) они видны всем процессам.
+
+Снимок схемы:
+    {'version': N, 'updated_at': epoch,
+     'vehicles': {device_id: нормализованные данные},
+     'versions': {device_id: версия, в которой ТС последний раз менялось}}
+
+Рядом с каждым снимком лежит его заголовок {'version', 'updated_at'} -
+маленький ключ, по которому подписчики узнают об изменениях, не читая снимок.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from ..utils.cache import cache_tags, get_fresh, set_tagged
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_TTL = 3600
+WATCH_TTL = 600             # Схема опрашивается, пока ее смотрели не позже этого
+# Отметки просмотра - по ключу на схему (online:watched:<schema_id>, с TTL);
+# индекс схем меняется только под блокировкой в кэше, его пишут все процессы
+WATCHED_INDEX_KEY = 'online:watched-schemas'
+WATCHED_LOCK_KEY = 'online:watched-lock'
+WATCHED_LOCK_WAIT = 2
+# Версию снимка поднимает один писатель схемы: опросчиков может быть несколько
+# (поток в каждом воркере, poll_online, poll_if_stale подписчиков)
+SNAPSHOT_LOCK_WAIT = 5
+
+
+@contextmanager
+def cache_lock(lock_key, wait):
+    """Блокировка в кэше (cache.add) на время изменения общих ключей; True - взята"""
+    deadline = time.monotonic() + wait
+    while not cache.add(lock_key, 1, timeout=wait * 5):
+        if time.monotonic() > deadline:
+            yield False
+            return
+        time.sleep(0.01)
+    try:
+        yield True
+    finally:
+        cache.delete(lock_key)
+
+
+def normalize_online(data, parse_moto_hours):
+    """Данные одного ТС из GetOnlineInfo -> скорость, топливо, моточасы, зажигание"""
+    final_data = data.get('Final', {})
+    return {
+        'Address': data.get('Address', 'Координаты не определены'),
+        'Speed': data.get('Speed', 0),
+        'DT': data.get('DT'),
+        # Извлекаем моточасы из FDT
+        'moto_hours': parse_moto_hours(final_data.get('FDT', '0')),
+        'ignition': final_data.get('DIgnition', False),
+        'fuel': final_data.get('TankMainFuelLevel', 0),
+    }
+
+
+def normalize_online_info(raw_online, parse_moto_hours):
+    """Весь ответ GetOnlineInfo -> {device_id: нормализованные данные}"""
+    processed_online = {}
+    for device_id, data in raw_online.items():
+        try:
+            if not isinstance(data, dict):
+                continue
+            processed_online[device_id] = normalize_online(data, parse_moto_hours)
+
+        except Exception as device_error:
+            logger.error(f"Error processing device {device_id}: {device_error}")
+            # Добавляем устройство с минимальными данными
+            processed_online[device_id] = {
+                'Address': 'Ошибка обработки данных',
+                'Speed': 0,
+                'DT': None,
+                'moto_hours': 0,
+                'ignition': False,
+                'fuel': 0,
+            }
+    return processed_online
+
+
+def field_deltas(previous, current):
+    """
+    Изменения между двумя состояниями {device_id: данные}:
+    ({device_id: {только изменившиеся поля}}, [удаленные device_id]).
+    """
+    changes = {}
+    for device_id, data in current.items():
+        old = previous.get(device_id)
+        if old is None:
+            changes[device_id] = data
+        elif old != data:
+            changes[device_id] = {key: value for key, value in data.items() if old.get(key) != value}
+    removed = [device_id for device_id in previous if device_id not in current]
+    return changes, removed
+
+
+class OnlineStore:
+    @staticmethod
+    def _key(schema_id):
+        return f'online:snapshot:{schema_id}'
+
+    @staticmethod
+    def _head_key(schema_id):
+        return f'online:head:{schema_id}'
+
+    @staticmethod
+    def _fresh(value, max_age):
+        if value is None or (max_age is not None and time.time() - value['updated_at'] > max_age):
+            return None
+        return value
+
+    def get(self, schema_id, max_age=None):
+        """Снимок схемы; None - нет или старше max_age секунд"""
+        return self._fresh(cache.get(self._key(schema_id)), max_age)
+
+    async def aget(self, schema_id, max_age=None):
+        return self._fresh(await cache.aget(self._key(schema_id)), max_age)
+
+    def head(self, schema_id, max_age=None):
+        """Версия и время снимка без самого снимка: {'version', 'updated_at'}"""
+        return self._fresh(cache.get(self._head_key(schema_id)), max_age)
+
+    async def ahead(self, schema_id, max_age=None):
+        return self._fresh(await cache.aget(self._head_key(schema_id)), max_age)
+
+    @staticmethod
+    def _lock_key(schema_id):
+        return f'online:snapshot-lock:{schema_id}'
+
+    def save(self, schema_id, vehicles):
+        """
+        Запись нового состояния; версия растет, только если что-то поменялось.
+        Чтение прошлой версии и запись новой - под блокировкой схемы, иначе два
+        опросчика выпустили бы одну версию с разным содержимым.
+        """
+        with cache_lock(self._lock_key(schema_id), SNAPSHOT_LOCK_WAIT) as locked:
+            if not locked:
+                # Снимок сейчас пишет другой опросчик; наше состояние запишет следующий шаг
+                logger.warning(f"⚠️ Online snapshot of schema {schema_id} is locked, skipping save")
+                return self.get(schema_id)
+            return self._save(schema_id, vehicles)
+
+    def _save(self, schema_id, vehicles):
+        previous = get_fresh(self._key(schema_id)) or {'version': 0, 'vehicles': {}, 'versions': {}}
+        version = previous['version'] + 1
+        versions = {}
+        changed = False
+        for device_id, data in vehicles.items():
+            if previous['vehicles'].get(device_id) == data:
+                versions[device_id] = previous['versions'].get(device_id, previous['version'])
+            else:
+                versions[device_id] = version
+                changed = True
+        changed = changed or bool(set(previous['vehicles']) - set(vehicles))
+
+        snapshot = {
+            'version': version if changed else previous['version'],
+            'updated_at': time.time(),
+            'vehicles': vehicles,
+            'versions': versions,
+        }
+        tags = cache_tags('online', schema_id)
+        set_tagged(self._key(schema_id), snapshot, SNAPSHOT_TTL, tags)
+        # Заголовок пишется после снимка: его версия не опережает снимок
+        set_tagged(self._head_key(schema_id), {'version': snapshot['version'], 'updated_at': snapshot['updated_at']},
+                   SNAPSHOT_TTL, tags)
+        return snapshot
+
+    @staticmethod
+    def _watch_key(schema_id):
+        return f'online:watched:{schema_id}'
+
+    def watch(self, schema_id, session_id):
+        """Отметка, что схему смотрят: опросчик будет ее опрашивать этой сессией"""
+        schema_id = str(schema_id)
+        current = cache.get(self._watch_key(schema_id))
+        # Пишем в кэш не чаще, чем раз в половину WATCH_TTL
+        if current and current[1] - time.time() > WATCH_TTL / 2:
+            return
+        cache.set(self._watch_key(schema_id), (session_id, time.time() + WATCH_TTL), timeout=WATCH_TTL)
+        if not self._update_index(lambda index: index | {schema_id}):
+            # Схема могла не попасть в индекс - следующий вызов попробует снова
+            cache.delete(self._watch_key(schema_id))
+
+    def watched(self):
+        """{schema_id: session_id} для схем, которые недавно смотрели"""
+        index = cache.get(WATCHED_INDEX_KEY) or set()
+        marks = cache.get_many([self._watch_key(schema_id) for schema_id in index])
+        now = time.time()
+        watched = {}
+        for schema_id in index:
+            mark = marks.get(self._watch_key(schema_id))
+            if mark and mark[1] > now:
+                watched[schema_id] = mark[0]
+        if len(watched) < len(index):
+            self._update_index(self._without_expired)
+        return watched
+
+    def _without_expired(self, index):
+        # Перепроверяется под блокировкой: схему могли снова открыть после чтения индекса
+        now = time.time()
+        return {
+            schema_id for schema_id in index
+            if (get_fresh(self._watch_key(schema_id)) or (None, 0))[1] > now
+        }
+
+    @staticmethod
+    def _update_index(change):
+        """Изменение индекса схем под блокировкой в кэше; change(set) -> set. False - не дождались"""
+        with cache_lock(WATCHED_LOCK_KEY, WATCHED_LOCK_WAIT) as locked:
+            if not locked:
+                logger.warning("⚠️ Watched schemas index is locked, skipping update")
+                return False
+            index = get_fresh(WATCHED_INDEX_KEY) or set()
+            updated = change(index)
+            if updated != index:
+                cache.set(WATCHED_INDEX_KEY, updated, timeout=None)
+        return True
+
+
+online_store = OnlineStore()
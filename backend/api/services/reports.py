@@ -0,0 +1,243 @@
+"""
+Отчеты по парку на суточных итогах (VehicleDayStats).
+
+Сутки ТС считаются по треку один раз и лежат в базе строкой (ТС, день).
+Отчет за любой период - агрегат по этим строкам. Считаются только
+отсутствующие дни и дни, которые на момент расчета были неполными
+(текущие сутки или данные еще не устоялись в хранилище треков).
+
+Сливы и заправки ищутся по всему загруженному периоду и относятся к дню
+по времени события; расход и пробег считаются по участкам внутри суток.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+from django.db.models import Max, Sum
+
+from ..models import VehicleDayStats
+from .autograph import AutoGraphService
+from .consumption import consumption_segments, consumption_totals
+from .fuel_events import (
+    ensure_vehicles, fuel_events_config, level_steps, load_device_track, smooth_fuel, vehicle_rates,
+)
+from .device_registry import device_registry
+from .telemetry_store import telemetry_store
+from .track import dt_to_epoch, numeric_column
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+
+# Поля строки, которые пересчитываются (upsert)
+STATS_FIELDS = [
+    'mileage_km', 'moving_seconds', 'idle_seconds', 'engine_seconds', 'max_speed',
+    'fuel_start', 'fuel_end', 'refills', 'refill_litres', 'drains', 'drain_litres',
+    'fuel_consumed', 'fuel_expected', 'points', 'is_complete',
+]
+
+
+def day_start(day):
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+def days_between(first, last):
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def daily_stats(columns, ignition, rates):
+    """
+    Суточные итоги по треку: {date: {поля VehicleDayStats}}.
+    Интервал между точками относится к дню своей первой точки.
+    """
+    if len(columns) < 2:
+        return {}
+    config = fuel_events_config()
+    ts = dt_to_epoch(columns.t)
+    speed = numeric_column(columns.s)
+    level = smooth_fuel(columns.f, config)
+    steps = level_steps(ts, speed, level, ignition, config) if level is not None else []
+    exclude = [(step.start, step.end) for step in steps]
+    # Без ДУТ пробег и время все равно считаются, расход - нет
+    segment_level = level if level is not None else np.zeros(len(ts))
+
+    day_numbers = (ts // DAY).astype(np.int64)
+    days = np.unique(day_numbers)
+    starts = np.searchsorted(day_numbers, days, side='left')
+    stops = np.searchsorted(day_numbers, days, side='right')
+
+    stats = {}
+    for day_number, i0, i1 in zip(days.tolist(), starts.tolist(), stops.tolist()):
+        # Плюс первая точка следующего дня, чтобы закрыть последний интервал суток
+        part = slice(i0, min(i1 + 1, len(ts)))
+        day_ignition = ignition[part] if ignition is not None else None
+        row = {
+            'points': i1 - i0,
+            'max_speed': float(speed[i0:i1].max()),
+            'fuel_start': None,
+            'fuel_end': None,
+        }
+        segments = consumption_segments(ts[part], speed[part], columns.lat[part], columns.lng[part],
+                                        columns.has_coords[part], segment_level[part], rates, day_ignition, exclude)
+        totals = consumption_totals(segments)
+        if level is not None:
+            row['fuel_start'] = round(float(level[i0]), 1)
+            row['fuel_end'] = round(float(level[i1 - 1]), 1)
+
+        day_steps = [step for step in steps if step.timestamp // DAY == day_number]
+        row.update({
+            'mileage_km': totals['mileage_km'],
+            # Секунды - по участкам: часы в итогах округлены до сотых
+            'moving_seconds': round(sum(seg.seconds for seg in segments if seg.state == 'moving')),
+            'idle_seconds': round(sum(seg.seconds for seg in segments if seg.state == 'idle')),
+            'fuel_consumed': totals['fuel_actual'],
+            'fuel_expected': totals['fuel_expected'],
+            'refills': sum(1 for step in day_steps if step.event_type == 'refill'),
+            'refill_litres': round(sum(step.volume for step in day_steps if step.event_type == 'refill'), 1),
+            'drains': sum(1 for step in day_steps if step.event_type == 'drain'),
+            'drain_litres': round(sum(step.volume for step in day_steps if step.event_type == 'drain'), 1),
+        })
+        # Моточасы - время работы двигателя: движение + холостой ход
+        row['engine_seconds'] = row['moving_seconds'] + row['idle_seconds']
+        stats[date(1970, 1, 1) + timedelta(days=day_number)] = row
+    return stats
+
+
+def _device_days(service, session_id, schema_id, device, first, last, rates):
+    """Итоги ТС по дням [first, last] (без обращений к базе): ({date: row}, неполный ли трек)"""
+    # Будущее не запрашиваем: текущие сутки - по текущую минуту
+    start, end = day_start(first), min(day_start(last) + DAY, int(time.time()) // 60 * 60)
+    columns, ignition, partial = load_device_track(service, session_id, schema_id, device, start, end)
+    stats = daily_stats(columns, ignition, rates)
+    return {day: row for day, row in stats.items() if first <= day <= last}, partial
+
+
+def refresh_day_stats(session_id, schema_id, first, last, device_ids=None, service=None, workers=None):
+    """
+    Досчитывает суточные итоги ТС схемы за дни [first, last], которых нет
+    или которые были неполными. Возвращает {'vehicles', 'days', 'partial'}.
+    """
+    service = service or AutoGraphService()
+    devices = device_registry.get(session_id, schema_id, service)
+    device_ids = [str(d) for d in device_ids] if device_ids else list(devices.index)
+    device_ids = [device_id for device_id in device_ids if devices.get(device_id)]
+    vehicles = ensure_vehicles(devices, device_ids)
+
+    days = days_between(first, last)
+    done = set(
+        VehicleDayStats.objects
+        .filter(vehicle__in=vehicles.values(), day__gte=first, day__lte=last, is_complete=True)
+        .values_list('vehicle__device_id', 'day')
+    )
+    todo = {}
+    for device_id in vehicles:
+        missing = [day for day in days if (device_id, day) not in done]
+        if missing:
+            todo[device_id] = (missing[0], missing[-1])
+
+    stats = {'vehicles': 0, 'days': 0, 'partial': []}
+    if not todo:
+        return stats
+
+    # Сутки полные, если закончились до границы устоявшихся данных хранилища
+    settled = telemetry_store.settled_until()
+    workers = max(1, min(workers or service.config['BATCH_TRACK_WORKERS'], len(todo)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_device_days, service, session_id, schema_id, devices.get(device_id),
+                        span[0], span[1], vehicle_rates(vehicles[device_id])): device_id
+            for device_id, span in todo.items()
+        }
+        for future in as_completed(futures):
+            device_id = futures[future]
+            try:
+                rows, partial = future.result()
+            except Exception as e:
+                logger.error(f"❌ Day stats for device {device_id} failed: {e}")
+                stats['partial'].append(device_id)
+                continue
+            if partial:
+                stats['partial'].append(device_id)
+                continue
+
+            first_day, last_day = todo[device_id]
+            objects = []
+            for day in days_between(first_day, last_day):
+                if (device_id, day) in done:
+                    continue
+                # День без точек - тоже строка (нулевой пробег), чтобы не качать его снова
+                row = rows.get(day, {'points': 0})
+                objects.append(VehicleDayStats(
+                    vehicle=vehicles[device_id], day=day,
+                    is_complete=day_start(day) + DAY <= settled, **row,
+                ))
+            VehicleDayStats.objects.bulk_create(
+                objects, update_conflicts=True, unique_fields=['vehicle', 'day'], update_fields=STATS_FIELDS,
+            )
+            stats['vehicles'] += 1
+            stats['days'] += len(objects)
+    return stats
+
+
+def fleet_report(vehicles, first, last):
+    """
+    Отчет по ТС за дни [first, last] одним агрегатным запросом по суточным итогам.
+    vehicles - {device_id: Vehicle}. Топливо на начало/конец - из первого/последнего дня с данными.
+    """
+    rows = (
+        VehicleDayStats.objects
+        .filter(vehicle__in=vehicles.values(), day__gte=first, day__lte=last)
+        .values('vehicle_id')
+        .annotate(
+            mileage_km=Sum('mileage_km'),
+            moving_seconds=Sum('moving_seconds'),
+            idle_seconds=Sum('idle_seconds'),
+            engine_seconds=Sum('engine_seconds'),
+            max_speed=Max('max_speed'),
+            refills=Sum('refills'),
+            refill_litres=Sum('refill_litres'),
+            drains=Sum('drains'),
+            drain_litres=Sum('drain_litres'),
+            fuel_consumed=Sum('fuel_consumed'),
+            fuel_expected=Sum('fuel_expected'),
+            points=Sum('points'),
+        )
+    )
+    by_vehicle = {row.pop('vehicle_id'): row for row in rows}
+
+    fuel = {}
+    for vehicle_id, fuel_start, fuel_end in (
+        VehicleDayStats.objects
+        .filter(vehicle__in=vehicles.values(), day__gte=first, day__lte=last, fuel_start__isnull=False)
+        .order_by('day')
+        .values_list('vehicle_id', 'fuel_start', 'fuel_end')
+    ):
+        fuel.setdefault(vehicle_id, [fuel_start, fuel_end])[1] = fuel_end
+
+    report = []
+    for device_id, vehicle in vehicles.items():
+        row = by_vehicle.get(vehicle.id)
+        if row is None:
+            continue
+        fuel_start, fuel_end = fuel.get(vehicle.id, (None, None))
+        report.append({
+            'device_id': device_id,
+            'name': vehicle.name,
+            'distance': round(row['mileage_km'], 1),
+            'engine_hours': round(row['engine_seconds'] / 3600, 1),
+            'moving_hours': round(row['moving_seconds'] / 3600, 1),
+            'idle_hours': round(row['idle_seconds'] / 3600, 1),
+            'max_speed': row['max_speed'],
+            'fuel_start': fuel_start,
+            'fuel_end': fuel_end,
+            'refills': row['refills'],
+            'refill_litres': round(row['refill_litres'], 1),
+            'drains': row['drains'],
+            'drain_litres': round(row['drain_litres'], 1),
+            'fuel_consumed': round(row['fuel_consumed'], 1),
+            'fuel_expected': round(row['fuel_expected'], 1),
+            'points': row['points'],
+        })
+    return report
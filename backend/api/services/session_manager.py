@@ -0,0 +1,151 @@
+"""
+Кэш сессий AutoGRAPH по учетным записям.
+
+Login к AutoGRAPH стоит на критическом пути каждого открытия дашборда.
+Менеджер держит токен на учетную запись SESSION_TTL секунд:
+- за SESSION_REFRESH_BEFORE до истечения токен обновляется в фоне,
+  а вызывающий сразу получает текущий;
+- одновременные входы под одной учетной записью дают один запрос Login;
+- with_session повторяет вызов один раз с новым токеном, если вызов
+  с токеном из кэша ничего не вернул (сессия могла истечь на стороне AutoGRAPH);
+  вызов должен идти в AutoGRAPH мимо cache_result (fetch_schemas, а не get_schemas),
+  иначе истекший токен еще несколько минут получает ответы из кэша.
+
+Учетная запись в кэше - HMAC(SECRET_KEY) от логина и пароля, пароли не хранятся.
+"""
+import hashlib
+import hmac
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .autograph import AutoGraphService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'SESSION_TTL': 1800,
+    'SESSION_REFRESH_BEFORE': 300,
+}
+# Блокировки входа - фиксированный набор по хэшу учетной записи: словарь
+# блокировок рос бы с каждой новой парой логин/пароль, в том числе неверной
+LOGIN_LOCK_STRIPES = 64
+
+
+def account_key(user, password):
+    message = f'{user}\0{password}'.encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+class SessionManager:
+    def __init__(self, ttl=None, refresh_before=None):
+        config = {**DEFAULT_CONFIG, **getattr(settings, 'AUTOGRAPH', {})}
+        self.ttl = config['SESSION_TTL'] if ttl is None else ttl
+        self.refresh_before = config['SESSION_REFRESH_BEFORE'] if refresh_before is None else refresh_before
+        self._tokens = {}           # ключ учетной записи -> (токен, когда истекает)
+        self._locks = [threading.Lock() for _ in range(LOGIN_LOCK_STRIPES)]
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _login_lock(self, key):
+        return self._locks[int(key[:8], 16) % len(self._locks)]
+
+    def _cached(self, key):
+        """(токен, пора ли обновлять) или (None, False)"""
+        token, expires = self._tokens.get(key, (None, 0))
+        left = expires - time.monotonic()
+        if token is None or left <= 0:
+            return None, False
+        return token, left <= self.refresh_before
+
+    def get_token(self, user, password, service=None):
+        """Токен сессии для учетной записи: из кэша или через Login"""
+        key = account_key(user, password)
+        token, refresh = self._cached(key)
+        if token:
+            if refresh:
+                self._refresh_in_background(key, user, password)
+            return token
+
+        with self._login_lock(key):
+            # Пока ждали блокировку, вход мог выполнить другой поток
+            token, _ = self._cached(key)
+            return token or self._login(key, user, password, service)
+
+    async def aget_token(self, user, password):
+        """Асинхронный вариант: попадание в кэш без ухода в поток"""
+        key = account_key(user, password)
+        token, refresh = self._cached(key)
+        if token:
+            if refresh:
+                self._refresh_in_background(key, user, password)
+            return token
+        return await sync_to_async(self.get_token, thread_sensitive=False)(user, password)
+
+    def _login(self, key, user, password, service=None):
+        token = (service or AutoGraphService()).get_session_token(user, password)
+        if token:
+            self._tokens[key] = (token, time.monotonic() + self.ttl)
+        return token
+
+    def _refresh_in_background(self, key, user, password):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                with self._login_lock(key):
+                    self._login(key, user, password)
+            except Exception as e:
+                logger.error(f"❌ Background session refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name='session-refresh', daemon=True).start()
+
+    def invalidate(self, token):
+        """Убрать токен из кэша (например, AutoGRAPH его больше не принимает)"""
+        with self._lock:
+            for key, (cached, _) in list(self._tokens.items()):
+                if cached == token:
+                    del self._tokens[key]
+
+    def with_session(self, user, password, call, service=None):
+        """
+        (токен, call(токен)). Если токен был из кэша, а call вернул пустой
+        результат, сессия считается истекшей: вход заново и один повтор.
+        """
+        cached = self._cached(account_key(user, password))[0]
+        token = self.get_token(user, password, service)
+        if not token:
+            return None, None
+        result = call(token)
+        if not result and token == cached:
+            logger.info("Cached AutoGRAPH session returned nothing, logging in again")
+            self.invalidate(token)
+            token = self.get_token(user, password, service)
+            result = call(token) if token else None
+        return token, result
+
+    async def awith_session(self, user, password, call):
+        """Асинхронный with_session; call - корутинная функция"""
+        cached = self._cached(account_key(user, password))[0]
+        token = await self.aget_token(user, password)
+        if not token:
+            return None, None
+        result = await call(token)
+        if not result and token == cached:
+            logger.info("Cached AutoGRAPH session returned nothing, logging in again")
+            self.invalidate(token)
+            token = await self.aget_token(user, password)
+            result = await call(token) if token else None
+        return token, result
+
+
+session_manager = SessionManager()
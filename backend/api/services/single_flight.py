@@ -0,0 +1,186 @@
+"""
+Single-flight: одновременные одинаковые вызовы AutoGRAPH делят один запрос.
+
+Когда в начале смены десятки диспетчеров открывают один парк, каждый промах
+кэша порождает одинаковый запрос к апстриму. Декоратор coalesced объединяет
+вызовы с тем же методом и нормализованными аргументами: первый выполняет
+запрос, остальные ждут его результат (или ту же ошибку).
+
+- между потоками процесса - всегда;
+- между процессами - если AUTOGRAPH['SINGLE_FLIGHT_SHARED']: блокировка через
+  cache.add и передача результата через кэш на несколько секунд.
+
+Результат общий для всех ожидающих, менять его на месте нельзя.
+"""
+import asyncio
+import functools
+import hashlib
+import inspect
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Сколько живет результат в общем кэше для ожидающих процессов
+SHARED_RESULT_TTL = 5
+SHARED_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+
+def normalize_arg(value):
+    """Списки ID через запятую сравниваются без учета порядка и повторов"""
+    if isinstance(value, str) and ',' in value:
+        return ','.join(sorted({part.strip() for part in value.split(',') if part.strip()}))
+    return value
+
+
+def flight_key(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key, func, shared=False, wait=30):
+        """Результат func(); одновременные вызовы с тем же key ждут первый"""
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.stats['shared'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._shared(key, func, wait) if shared else func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def ado(self, key, func, shared=False, wait=30):
+        """Асинхронный do: func - корутинная функция; общий вызов в рамках event loop"""
+        loop = asyncio.get_running_loop()
+        future = self._async_calls.get((loop, key))
+        self.stats['calls'] += 1
+        if future is not None:
+            self.stats['shared'] += 1
+            return await asyncio.shield(future)
+
+        future = self._async_calls[(loop, key)] = loop.create_future()
+        try:
+            result = await (self._ashared(key, func, wait) if shared else func())
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже пробрасывается лидеру, ожидающих может и не быть
+            future.exception()
+            raise
+        finally:
+            self._async_calls.pop((loop, key), None)
+
+    # --- между процессами через общий кэш ---
+
+    @staticmethod
+    def _shared_keys(key):
+        return f'sf:lock:{key}', f'sf:result:{key}'
+
+    def _shared(self, key, func, wait):
+        lock_key, result_key = self._shared_keys(key)
+        deadline = time.monotonic() + wait
+        while not cache.add(lock_key, 1, timeout=wait):
+            result = cache.get(result_key, _MISSING)
+            if result is not _MISSING:
+                return result
+            if time.monotonic() > deadline:
+                break
+            time.sleep(SHARED_POLL_INTERVAL)
+        else:
+            try:
+                result = func()
+                cache.set(result_key, result, timeout=SHARED_RESULT_TTL)
+                return result
+            finally:
+                cache.delete(lock_key)
+        # Не дождались другого процесса - выполняем сами
+        return func()
+
+    async def _ashared(self, key, func, wait):
+        lock_key, result_key = self._shared_keys(key)
+        deadline = time.monotonic() + wait
+        while not await cache.aadd(lock_key, 1, timeout=wait):
+            result = await cache.aget(result_key, _MISSING)
+            if result is not _MISSING:
+                return result
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+        else:
+            try:
+                result = await func()
+                await cache.aset(result_key, result, timeout=SHARED_RESULT_TTL)
+                return result
+            finally:
+                await cache.adelete(lock_key)
+        return await func()
+
+
+single_flight = SingleFlight()
+
+
+def coalesced(endpoint):
+    """
+    Декоратор метода сервиса AutoGRAPH: ключ - base_url, endpoint и
+    нормализованные аргументы. Работает и для async-методов.
+    """
+    def decorator(func):
+        def options(service, args, kwargs):
+            normalized = tuple(normalize_arg(a) for a in args)
+            key = flight_key(service.base_url, endpoint, normalized, sorted(kwargs.items()))
+            return key, service.config.get('SINGLE_FLIGHT_SHARED', False), service.config['DEFAULT_TIMEOUT'] * 2
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                key, shared, wait = options(self, args, kwargs)
+                return await single_flight.ado(key, lambda: func(self, *args, **kwargs), shared, wait)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            key, shared, wait = options(self, args, kwargs)
+            return single_flight.do(key, lambda: func(self, *args, **kwargs), shared, wait)
+        return wrapper
+    return decorator
@@ -0,0 +1,303 @@
+"""
+Локальное хранилище телеметрии (SQLite, отдельный файл от основной БД).
+
+Сегменты GetTrack хранятся блоками «ТС + сутки», а в таблице coverage
+записано, какие интервалы времени уже скачаны. При запросе трека из
+AutoGRAPH докачиваются только недостающие интервалы, остальное читается
+с диска. Свежий «хвост» (последние SETTLE_SECONDS) не сохраняется:
+приборы досылают данные с задержкой.
+
+Время везде - секунды epoch; даты AutoGRAPH (YYYYMMDD-HHMM) и строки DT
+трактуются в одной и той же шкале (как UTC без смещения).
+"""
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+import msgpack
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .track import (
+    TrackFetchResult, autograph_to_epoch, drain_segments, dt_to_epoch, epoch_to_autograph,
+    extract_segments, slice_segment_by_time,
+)
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+MINUTE = 60
+
+DEFAULT_CONFIG = {
+    'PATH': None,               # None -> BASE_DIR / 'telemetry.sqlite3'
+    'SETTLE_SECONDS': 900,      # Данные моложе этого не считаются окончательными
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS track_days (
+    device_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (device_id, day)
+);
+CREATE TABLE IF NOT EXISTS coverage (
+    device_id TEXT NOT NULL,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_device ON coverage (device_id, start_ts);
+"""
+
+def _pack_day(entries):
+    payload = [{'ts': ts.tobytes(), 'segment': segment} for segment, ts in entries]
+    return zlib.compress(msgpack.packb(payload, use_bin_type=True), 3)
+
+
+def _unpack_day(blob):
+    payload = msgpack.unpackb(zlib.decompress(blob), raw=False)
+    return [(item['segment'], np.frombuffer(item['ts'], dtype=np.float64)) for item in payload]
+
+
+class TelemetryStore:
+    """Хранилище сегментов трека с учетом скачанных интервалов."""
+
+    def __init__(self, path=None, settle_seconds=None):
+        config = {**DEFAULT_CONFIG, **getattr(settings, 'TELEMETRY_STORE', {})}
+        self.path = str(path or config['PATH'] or settings.BASE_DIR / 'telemetry.sqlite3')
+        self.settle_seconds = config['SETTLE_SECONDS'] if settle_seconds is None else settle_seconds
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def settled_until(self, now=None):
+        """Граница окончательных данных, выровненная по минуте"""
+        now = time.time() if now is None else now
+        return int(now - self.settle_seconds) // MINUTE * MINUTE
+
+    @staticmethod
+    def _covered(conn, device_id, start, end):
+        return conn.execute(
+            'SELECT start_ts, end_ts FROM coverage '
+            'WHERE device_id = ? AND end_ts > ? AND start_ts < ? ORDER BY start_ts',
+            (device_id, start, end),
+        ).fetchall()
+
+    def covered_ranges(self, device_id, start, end):
+        conn = self._connect()
+        try:
+            return self._covered(conn, device_id, start, end)
+        finally:
+            conn.close()
+
+    def missing_ranges(self, device_id, start, end):
+        """Интервалы внутри [start, end), которых еще нет в хранилище"""
+        return range_gaps(self.covered_ranges(device_id, start, end), start, end)
+
+    def save(self, device_id, start, end, segments):
+        """
+        Сохранение сегментов, скачанных за [start, end), и отметка интервала.
+        Точки вне интервала отбрасываются, поэтому на стыках нет дублей.
+        Покрытие перечитывается под блокировкой записи: части интервала, которые
+        уже сохранил параллельный запрос того же пробела, повторно не пишутся.
+        """
+        prepared = []
+        for segment in segments:
+            dt = segment.get('DT') or []
+            if dt:
+                prepared.append((segment, dt_to_epoch(dt)))
+
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            by_day = {}
+            for lo, hi in range_gaps(self._covered(conn, device_id, start, end), start, end):
+                for segment, ts in prepared:
+                    day = int(lo // DAY)
+                    while day * DAY < hi:
+                        part, part_ts = slice_segment_by_time(segment, ts, max(lo, day * DAY),
+                                                              min(hi, (day + 1) * DAY))
+                        if part is not None:
+                            by_day.setdefault(day, []).append((part, part_ts))
+                        day += 1
+
+            for day, entries in by_day.items():
+                row = conn.execute(
+                    'SELECT data FROM track_days WHERE device_id = ? AND day = ?', (device_id, day)
+                ).fetchone()
+                if row:
+                    entries = _unpack_day(row[0]) + entries
+                entries.sort(key=lambda entry: entry[1][0])
+                conn.execute(
+                    'INSERT OR REPLACE INTO track_days (device_id, day, data) VALUES (?, ?, ?)',
+                    (device_id, day, _pack_day(entries)),
+                )
+            self._mark_covered(conn, device_id, start, end)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _mark_covered(conn, device_id, start, end):
+        """Добавление интервала с объединением пересекающихся и соседних"""
+        rows = conn.execute(
+            'SELECT rowid, start_ts, end_ts FROM coverage '
+            'WHERE device_id = ? AND end_ts >= ? AND start_ts <= ?',
+            (device_id, start, end),
+        ).fetchall()
+        for rowid, covered_start, covered_end in rows:
+            start, end = min(start, covered_start), max(end, covered_end)
+            conn.execute('DELETE FROM coverage WHERE rowid = ?', (rowid,))
+        conn.execute(
+            'INSERT INTO coverage (device_id, start_ts, end_ts) VALUES (?, ?, ?)',
+            (device_id, start, end),
+        )
+
+    def load(self, device_id, start, end):
+        """Сегменты из хранилища с точками из [start, end), по времени"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT data FROM track_days WHERE device_id = ? AND day >= ? AND day < ? ORDER BY day',
+                (device_id, int(start // DAY), int((end - 1) // DAY) + 1),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        segments = []
+        for (blob,) in rows:
+            for segment, ts in _unpack_day(blob):
+                part, _ = slice_segment_by_time(segment, ts, start, end)
+                if part is not None:
+                    segments.append(part)
+        return segments
+
+    def _prepare_track(self, service, session_id, schema_id, device_id, start_dt, end_dt):
+        """
+        Докачка недостающих интервалов и свежего хвоста.
+        Возвращает (start, settled, хвост, неполученные интервалы).
+        """
+        start, end = autograph_to_epoch(start_dt), autograph_to_epoch(end_dt)
+        settled = min(end, max(start, self.settled_until()))
+        failed = []
+
+        for gap in self.missing_ranges(device_id, start, settled):
+            result = service.fetch_track_range(session_id, schema_id, device_id, *map(epoch_to_autograph, gap))
+            for covered in subtract_ranges(gap, result.failed):
+                self.save(device_id, *covered, result.segments)
+            failed += result.failed
+
+        # Свежий хвост всегда берем из AutoGRAPH и не сохраняем
+        tail = []
+        if settled < end:
+            result = service.fetch_track_range(session_id, schema_id, device_id, epoch_to_autograph(settled), end_dt)
+            tail = self._tail(result.segments, settled, end)
+            failed += result.failed
+
+        return start, settled, tail, failed
+
+    def get_track(self, service, session_id, schema_id, device_id, start_dt, end_dt):
+        """
+        Трек за период: из хранилища + докачка недостающих интервалов.
+        start_dt/end_dt в формате AutoGRAPH (YYYYMMDD-HHMM).
+        Длинные интервалы качаются по частям (service.fetch_track_range).
+        """
+        start, settled, tail, failed = self._prepare_track(service, session_id, schema_id, device_id,
+                                                           start_dt, end_dt)
+        segments = self.load(device_id, start, settled) if settled > start else []
+        return TrackFetchResult(segments + tail, failed)
+
+    def iter_track(self, service, session_id, schema_id, device_id, start_dt, end_dt):
+        """
+        То же, что get_track, но segments - итератор: сохраненные данные
+        читаются из хранилища по суткам по мере обхода, в памяти не больше
+        одних суток трека (и свежего хвоста).
+        """
+        start, settled, tail, failed = self._prepare_track(service, session_id, schema_id, device_id,
+                                                           start_dt, end_dt)
+        return TrackFetchResult(self._iter_days(device_id, start, settled, tail), failed)
+
+    def _iter_days(self, device_id, start, end, tail):
+        day = int(start // DAY)
+        while day * DAY < end:
+            yield from drain_segments(self.load(device_id, max(start, day * DAY), min(end, (day + 1) * DAY)))
+            day += 1
+        yield from drain_segments(tail)
+
+    async def aget_track(self, service, session_id, schema_id, device_id, start_dt, end_dt):
+        """То же, что get_track, для AsyncAutoGraphService; SQLite - в пуле потоков"""
+        start, end = autograph_to_epoch(start_dt), autograph_to_epoch(end_dt)
+        settled = min(end, max(start, self.settled_until()))
+        failed = []
+        in_thread = lambda func: sync_to_async(func, thread_sensitive=False)
+
+        for gap in await in_thread(self.missing_ranges)(device_id, start, settled):
+            result = await service.fetch_track_range(session_id, schema_id, device_id,
+                                                     *map(epoch_to_autograph, gap))
+            for covered in subtract_ranges(gap, result.failed):
+                await in_thread(self.save)(device_id, *covered, result.segments)
+            failed += result.failed
+
+        segments = await in_thread(self.load)(device_id, start, settled) if settled > start else []
+
+        if settled < end:
+            result = await service.fetch_track_range(session_id, schema_id, device_id,
+                                                     epoch_to_autograph(settled), end_dt)
+            segments += self._tail(result.segments, settled, end)
+            failed += result.failed
+
+        return TrackFetchResult(segments, failed)
+
+    @staticmethod
+    def _tail(segments, start, end):
+        parts = []
+        for segment in segments:
+            dt = segment.get('DT') or []
+            if dt:
+                part, _ = slice_segment_by_time(segment, dt_to_epoch(dt), start, end)
+                if part is not None:
+                    parts.append(part)
+        return parts
+
+
+def range_gaps(covered, start, end):
+    """Части [start, end), не покрытые отсортированными интервалами covered"""
+    gaps = []
+    cursor = start
+    for covered_start, covered_end in covered:
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def subtract_ranges(interval, excluded):
+    """Части interval, не покрытые отсортированными интервалами excluded"""
+    start, end = interval
+    parts = []
+    for ex_start, ex_end in excluded:
+        if ex_start > start:
+            parts.append((start, min(ex_start, end)))
+        start = max(start, ex_end)
+    if start < end:
+        parts.append((start, end))
+    return parts
+
+
+telemetry_store = TelemetryStore()
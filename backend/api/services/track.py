@@ -0,0 +1,388 @@
+"""
+Колоночная обработка треков AutoGRAPH.
+Сегменты GetTrack превращаются в NumPy-колонки (DT, Speed, Lat, Lng, топливо),
+топливо считается векторно по всем ДУТ, JSON собирается прямо из колонок.
+"""
+import json
+import logging
+import warnings
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+POINT_WITH_COORDS = '{"t":%s,"s":%s,"lat":%s,"lng":%s,"f":%s}'
+POINT_WITHOUT_COORDS = '{"t":%s,"s":%s,"f":%s}'
+
+# Сколько точек кодировать за один шаг в потоковом режиме
+STREAM_CHUNK_POINTS = 5000
+
+
+def extract_segments(raw_track, device_id):
+    """Список сегментов трека из ответа GetTrack"""
+    # Структура ответа может быть разной
+    if isinstance(raw_track, dict):
+        # Формат: {device_id: [segments]} или {device_id: segment}
+        track_segments = raw_track.get(device_id, [])
+        if isinstance(track_segments, dict):
+            track_segments = [track_segments]
+    elif isinstance(raw_track, list):
+        # Формат: [segments]
+        track_segments = raw_track
+    else:
+        track_segments = []
+    return [segment for segment in track_segments if isinstance(segment, dict)]
+
+
+def _column(values):
+    """
+    Колонка из списка значений.
+    Чисто числовые данные -> int64/float64, все остальное (None, строки) -> object,
+    чтобы значения вернулись клиенту ровно в том виде, в каком пришли.
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'iuf' and arr.ndim == 1:
+        return arr
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
+def _concat(chunks):
+    if not chunks:
+        return np.empty(0, dtype=np.float64)
+    kinds = {chunk.dtype.kind for chunk in chunks}
+    if kinds <= set('iuf'):
+        return np.concatenate(chunks)
+    return np.concatenate([chunk.astype(object) for chunk in chunks])
+
+
+def _json_values(column):
+    """JSON-представление каждого значения колонки"""
+    values = column.tolist()
+    if column.dtype.kind in 'iuf':
+        # repr у int/float совпадает с тем, что выдает json.dumps
+        return list(map(repr, values))
+    return [json.dumps(v, ensure_ascii=False) for v in values]
+
+
+class TrackColumns:
+    """Трек в колоночном виде: одна NumPy-колонка на каждое поле точки."""
+    __slots__ = ('t', 's', 'lat', 'lng', 'f', 'has_coords')
+
+    def __init__(self, t, s, lat, lng, f, has_coords):
+        self.t = t
+        self.s = s
+        self.lat = lat
+        self.lng = lng
+        self.f = f
+        self.has_coords = has_coords
+
+    def __len__(self):
+        return len(self.t)
+
+    @classmethod
+    def from_segments(cls, track_segments, calibrations):
+        """
+        Сборка колонок из сегментов трека.
+        calibrations: {имя датчика: CalibrationTable}
+        """
+        t_chunks, s_chunks, lat_chunks, lng_chunks, f_chunks, coords_chunks = [], [], [], [], [], []
+
+        for segment in track_segments:
+            dt_array = segment.get('DT', [])
+            speed_array = segment.get('Speed', [])
+            n = min(len(dt_array), len(speed_array))
+            if n == 0:
+                continue
+
+            t_chunks.append(_column(dt_array[:n]))
+            s_chunks.append(_column(speed_array[:n]))
+
+            # Координаты есть только у точек, для которых пришли и Lat, и Lng
+            lat_array = segment.get('Lat') or []
+            lng_array = segment.get('Lng') or []
+            k = min(n, len(lat_array), len(lng_array))
+            has_coords = np.zeros(n, dtype=bool)
+            has_coords[:k] = True
+            coords_chunks.append(has_coords)
+            lat_chunks.append(_padded(lat_array[:k], n))
+            lng_chunks.append(_padded(lng_array[:k], n))
+
+            # Расчет топлива: сумма литров по всем ДУТ
+            fuel = np.zeros(n, dtype=np.float64)
+            for sensor_name, calibration in calibrations.items():
+                sensor_array = segment.get(sensor_name)
+                if sensor_array:
+                    m = min(n, len(sensor_array))
+                    fuel[:m] += calibration.to_litres(sensor_array[:m])
+            f_chunks.append(fuel)
+
+        fuel = _concat(f_chunks)
+        # round() поштучно, чтобы округление совпадало с прежним round(x, 1)
+        fuel = np.fromiter((round(v, 1) if v > 0 else 0.0 for v in fuel.tolist()),
+                           dtype=np.float64, count=len(fuel))
+
+        return cls(
+            t=_concat(t_chunks),
+            s=_concat(s_chunks),
+            lat=_concat(lat_chunks),
+            lng=_concat(lng_chunks),
+            f=fuel,
+            has_coords=_concat(coords_chunks).astype(bool),
+        )
+
+    def take(self, indices):
+        """Подвыборка точек по индексам"""
+        return TrackColumns(
+            t=self.t[indices],
+            s=self.s[indices],
+            lat=self.lat[indices],
+            lng=self.lng[indices],
+            f=self.f[indices],
+            has_coords=self.has_coords[indices],
+        )
+
+    def iter_chunks(self, chunk_size=STREAM_CHUNK_POINTS):
+        """Трек кусками по chunk_size точек"""
+        for start in range(0, len(self), chunk_size):
+            yield self.take(slice(start, start + chunk_size))
+
+    def to_points(self):
+        """Список точек в формате {'t','s','lat','lng','f'}"""
+        points = []
+        rows = zip(self.t.tolist(), self.s.tolist(), self.lat.tolist(), self.lng.tolist(),
+                   self.f.tolist(), self.has_coords.tolist())
+        for t, s, lat, lng, f, has_coords in rows:
+            if has_coords:
+                points.append({'t': t, 's': s, 'lat': lat, 'lng': lng, 'f': f})
+            else:
+                points.append({'t': t, 's': s, 'f': f})
+        return points
+
+    def summary(self):
+        """Короткая сводка по треку без самих точек"""
+        if not len(self):
+            return {'count': 0}
+        speed = numeric_column(self.s)
+        return {
+            'count': len(self),
+            'from': self.t[:1].tolist()[0],
+            'to': self.t[-1:].tolist()[0],
+            'max_speed': float(speed.max()),
+            'avg_speed': round(float(speed.mean()), 1),
+            'fuel_start': float(self.f[0]),
+            'fuel_end': float(self.f[-1]),
+            'fuel_min': float(self.f.min()),
+            'fuel_max': float(self.f.max()),
+        }
+
+    def iter_json_points(self):
+        """JSON-строки точек, собранные напрямую из колонок"""
+        rows = zip(_json_values(self.t), _json_values(self.s), _json_values(self.lat),
+                   _json_values(self.lng), _json_values(self.f), self.has_coords.tolist())
+        for t, s, lat, lng, f, has_coords in rows:
+            if has_coords:
+                yield POINT_WITH_COORDS % (t, s, lat, lng, f)
+            else:
+                yield POINT_WITHOUT_COORDS % (t, s, f)
+
+
+def numeric_column(column):
+    """Колонка как float64; нечисловые значения -> 0"""
+    try:
+        values = np.asarray(column, dtype=np.float64)
+    except (TypeError, ValueError):
+        values = np.array([v if isinstance(v, (int, float)) else np.nan for v in column.tolist()],
+                          dtype=np.float64)
+    return np.nan_to_num(values, nan=0.0)
+
+
+def _padded(values, n):
+    """Колонка длины n: сначала values, дальше заполнитель"""
+    column = _column(values)
+    if len(column) == n:
+        return column
+    if column.dtype.kind in 'iuf':
+        padded = np.full(n, np.nan, dtype=np.float64)
+    else:
+        padded = np.full(n, None, dtype=object)
+    padded[:len(column)] = column
+    return padded
+
+
+def encode_track_response(columns, **fields):
+    """
+    JSON-ответ трека: {"success": true, "points": [...], "count": N, **fields}.
+    Точки пишутся сразу из колонок, без промежуточных dict.
+    """
+    tail = json.dumps({'count': len(columns), **fields}, ensure_ascii=False, separators=(',', ':'))
+    return ''.join([
+        '{"success":true,"points":[',
+        ','.join(columns.iter_json_points()),
+        '],',
+        tail[1:],
+    ]).encode()
+
+
+def _slice_segment(segment, start, stop, calibrations):
+    """Срез сегмента по точкам [start, stop) только по нужным полям"""
+    part = {}
+    for key in ('DT', 'Speed', 'Lat', 'Lng', *calibrations):
+        values = segment.get(key)
+        if values:
+            part[key] = values[start:stop]
+    return part
+
+
+def drain_segments(track_segments):
+    """
+    Сегменты по одному. Список опустошается по ходу обхода, так что выданный
+    сегмент больше нигде не удерживается; итератор просто перебирается.
+    """
+    if not isinstance(track_segments, list):
+        yield from track_segments
+        return
+    track_segments.reverse()
+    while track_segments:
+        yield track_segments.pop()
+
+
+def iter_track_columns(track_segments, calibrations, chunk_size=STREAM_CHUNK_POINTS):
+    """
+    Колонки трека кусками не больше chunk_size точек.
+    track_segments - список (опустошается по мере обработки) или итератор
+    сегментов: обработанный сегмент освобождается до перехода к следующему.
+    """
+    for segment in drain_segments(track_segments):
+        if not isinstance(segment, dict):
+            continue
+        n = min(len(segment.get('DT', [])), len(segment.get('Speed', [])))
+        for start in range(0, n, chunk_size):
+            part = _slice_segment(segment, start, start + chunk_size, calibrations)
+            yield TrackColumns.from_segments([part], calibrations)
+        del segment
+
+
+def iter_track_response(chunks, **fields):
+    """
+    Потоковый вариант encode_track_response: байты ответа по мере готовности.
+    chunks - итератор TrackColumns; count пишется в конце, после точек.
+    """
+    yield b'{"success":true,"points":['
+    count = 0
+    for columns in chunks:
+        if not len(columns):
+            continue
+        prefix = ',' if count else ''
+        yield (prefix + ','.join(columns.iter_json_points())).encode()
+        count += len(columns)
+    tail = json.dumps({'count': count, **fields}, ensure_ascii=False, separators=(',', ':'))
+    yield ('],' + tail[1:]).encode()
+
+
+# --- Время и разбиение периода на части ---
+# Время - секунды epoch; даты AutoGRAPH (YYYYMMDD-HHMM) и строки DT
+# трактуются в одной шкале (как UTC без смещения).
+
+class TrackFetchResult(namedtuple('TrackFetchResult', ['segments', 'failed'])):
+    """Сегменты трека и интервалы (start, end), которые скачать не удалось"""
+    __slots__ = ()
+
+    @property
+    def partial(self):
+        return bool(self.failed)
+
+
+def autograph_to_epoch(value):
+    """'20260117-0956' -> секунды epoch"""
+    dt = datetime.strptime(value, '%Y%m%d-%H%M').replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def epoch_to_autograph(ts):
+    """Секунды epoch -> '20260117-0956'"""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y%m%d-%H%M')
+
+
+def dt_to_epoch(values):
+    """Колонка DT (числа epoch или ISO-строки) -> float64 секунд"""
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'iuf':
+        return arr.astype(np.float64)
+    try:
+        # Смещение часового пояса numpy учитывает, но предупреждает об этом
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            return arr.astype('datetime64[s]').astype(np.int64).astype(np.float64)
+    except (TypeError, ValueError):
+        result = np.empty(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            dt = datetime.fromisoformat(str(value))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            result[i] = dt.timestamp()
+        return result
+
+
+def slice_segment_by_time(segment, ts, start, end):
+    """
+    Часть сегмента с точками из [start, end) и ее метки времени.
+    Все массивы режутся по одним индексам, остальные поля копируются.
+    """
+    i0, i1 = np.searchsorted(ts, [start, end], side='left')
+    if i0 >= i1:
+        return None, None
+    part = {
+        key: (value[i0:i1] if isinstance(value, list) else value)
+        for key, value in segment.items()
+    }
+    return part, ts[i0:i1]
+
+
+def split_period(start, end, chunk_seconds):
+    """
+    Разбиение [start, end) на части, выровненные по chunk_seconds
+    (при суточных частях границы совпадают с полуночью).
+    """
+    chunks = []
+    cursor = start
+    while cursor < end:
+        boundary = min(end, (cursor // chunk_seconds + 1) * chunk_seconds)
+        chunks.append((cursor, boundary))
+        cursor = boundary
+    return chunks
+
+
+def merge_chunk_segments(chunk_segments):
+    """
+    Склейка сегментов, скачанных по частям: chunk_segments - список
+    ((start, end), segments) в порядке времени. Каждая часть обрезается до
+    своего полуинтервала, поэтому точка на границе попадает в ответ один раз.
+    """
+    if len(chunk_segments) == 1:
+        return list(chunk_segments[0][1])
+
+    merged = []
+    last = len(chunk_segments) - 1
+    for i, (chunk, segments) in enumerate(chunk_segments):
+        merged += clip_chunk_segments(segments, chunk, first=i == 0, last=i == last)
+    return merged
+
+
+def clip_chunk_segments(segments, chunk, first=False, last=False):
+    """Сегменты части chunk = (start, end), обрезанные до [start, end); у крайних частей край не режется"""
+    lo = -np.inf if first else chunk[0]
+    hi = np.inf if last else chunk[1]
+    parts = []
+    for segment in segments:
+        dt = segment.get('DT') or []
+        if not dt:
+            continue
+        part, _ = slice_segment_by_time(segment, dt_to_epoch(dt), lo, hi)
+        if part is not None:
+            parts.append(part)
+    return parts
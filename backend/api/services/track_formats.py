@@ -0,0 +1,115 @@
+"""
+Форматы ответа для треков.
+
+- json     (application/json): список точек {'t','s','lat','lng','f'}, как раньше;
+- columnar (application/vnd.tk.columnar+json): параллельные массивы t/s/f/lat/lng;
+- msgpack  (application/msgpack): те же колонки, числовые - типизированными
+  массивами (dtype + сырые байты little-endian), без текстового кодирования чисел.
+
+Формат выбирается параметром ?format=<name> или заголовком Accept.
+"""
+import json
+
+import msgpack
+import numpy as np
+
+from .track import TrackColumns, encode_track_response
+
+JSON_MEDIA_TYPE = 'application/json'
+COLUMNAR_MEDIA_TYPE = 'application/vnd.tk.columnar+json'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+
+def _nullable(column, mask):
+    """Список значений колонки с null там, где mask == False"""
+    values = column.astype(object)
+    values[~mask] = None
+    return values.tolist()
+
+
+def _typed_array(column):
+    """Числовая колонка -> {'dtype', 'data'}; прочие остаются списком"""
+    if column.dtype.kind in 'iuf':
+        column = np.ascontiguousarray(column, dtype=column.dtype.newbyteorder('<'))
+        return {'dtype': column.dtype.str, 'data': column.tobytes()}
+    return column.tolist()
+
+
+def columnar_payload(columns, **fields):
+    """Колонки трека как dict параллельных массивов (JSON-совместимые значения)"""
+    return {
+        'success': True,
+        'format': 'columnar',
+        'count': len(columns),
+        't': columns.t.tolist(),
+        's': columns.s.tolist(),
+        'f': columns.f.tolist(),
+        'lat': _nullable(columns.lat, columns.has_coords),
+        'lng': _nullable(columns.lng, columns.has_coords),
+        **fields,
+    }
+
+
+def encode_columnar_json(columns, **fields):
+    return json.dumps(columnar_payload(columns, **fields), ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def encode_msgpack(columns, **fields):
+    """
+    MessagePack с типизированными массивами.
+    Точки без координат: lat/lng = NaN, маска в has_coords (uint8).
+    """
+    lat, lng = columns.lat, columns.lng
+    if lat.dtype.kind not in 'iuf' or lng.dtype.kind not in 'iuf':
+        lat = np.where(columns.has_coords, lat, np.nan).astype(np.float64)
+        lng = np.where(columns.has_coords, lng, np.nan).astype(np.float64)
+
+    return msgpack.packb({
+        'success': True,
+        'format': 'msgpack',
+        'count': len(columns),
+        't': _typed_array(columns.t),
+        's': _typed_array(columns.s),
+        'f': _typed_array(columns.f),
+        'lat': _typed_array(lat),
+        'lng': _typed_array(lng),
+        'has_coords': _typed_array(columns.has_coords.astype(np.uint8)),
+        **fields,
+    }, use_bin_type=True)
+
+
+# имя формата -> (media type, кодировщик колонок)
+TRACK_FORMATS = {
+    'json': (JSON_MEDIA_TYPE, encode_track_response),
+    'columnar': (COLUMNAR_MEDIA_TYPE, encode_columnar_json),
+    'msgpack': (MSGPACK_MEDIA_TYPE, encode_msgpack),
+}
+
+
+def encode_track_payload(payload, track_format):
+    """
+    Кодирование ответа трека: payload = {'columns': TrackColumns, **поля}.
+    Возвращает (bytes, media type).
+    """
+    media_type, encoder = TRACK_FORMATS[track_format]
+    fields = dict(payload)
+    columns = fields.pop('columns')
+    return encoder(columns, **fields), media_type
+
+
+def is_track_payload(data):
+    return isinstance(data, dict) and isinstance(data.get('columns'), TrackColumns)
+
+
+def negotiate_track_format(request):
+    """
+    Выбор формата для обычных Django views.
+    ?format= важнее заголовка Accept; по умолчанию json.
+    """
+    requested = request.GET.get('format')
+    if requested:
+        return requested if requested in TRACK_FORMATS else None
+
+    media_types = {media_type: name for name, (media_type, _) in TRACK_FORMATS.items()}
+    preferred = request.get_preferred_type(list(media_types))
+    return media_types.get(preferred, 'json')
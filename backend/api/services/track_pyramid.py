@@ -0,0 +1,276 @@
+"""
+Пирамида агрегатов трека для масштабируемых графиков.
+
+Для каждого ТС и суток трек сворачивается в корзины фиксированной длины
+(LEVELS: 10 с, 1 мин, 10 мин, 1 ч); в корзине - число точек и
+минимум/максимум/среднее скорости и топлива. Каждый уровень собирается из
+предыдущего, а не из точек. Устоявшиеся сутки хранятся в том же файле SQLite,
+что и треки (таблица track_levels), с версией - хэшем Properties ТС:
+смена тарировок пересобирает пирамиду.
+
+Запрос графика обслуживается самым грубым уровнем, на котором за период
+набирается не меньше max_points корзин; затем корзины объединяются до
+~max_points. Границы корзин кратны их длине от начала epoch, поэтому при
+сдвиге окна соседние запросы возвращают те же корзины.
+Если даже 10-секундных корзин меньше max_points, отдаются сами точки
+(каждая - корзина из одной точки, при избытке прореженные LTTB).
+"""
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+import msgpack
+import numpy as np
+
+from .downsampling import downsample_track
+from .fuel_events import load_device_track
+from .telemetry_store import DAY, telemetry_store
+from .track import dt_to_epoch, numeric_column
+
+logger = logging.getLogger(__name__)
+
+LEVELS = (10, 60, 600, 3600)
+# Недостающих суток в одном запросе трека: за год без пирамиды в памяти
+# не держится весь трек сразу
+BATCH_DAYS = 3
+
+INT_FIELDS = ('t', 'n')
+VALUE_FIELDS = ('s_min', 's_max', 's_mean', 'f_min', 'f_max', 'f_mean')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS track_levels (
+    device_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (device_id, day, level)
+);
+"""
+
+
+def empty_buckets():
+    buckets = {field: np.empty(0, dtype=np.int64) for field in INT_FIELDS}
+    buckets.update({field: np.empty(0, dtype=np.float64) for field in VALUE_FIELDS})
+    return buckets
+
+
+def _bucket_starts(keys):
+    return np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+
+
+def aggregate_points(ts, speed, fuel, bucket):
+    """Точки (отсортированные по времени) -> корзины по bucket секунд"""
+    if not len(ts):
+        return empty_buckets()
+    keys = (ts // bucket).astype(np.int64)
+    starts = _bucket_starts(keys)
+    n = np.diff(np.append(starts, len(ts)))
+    buckets = {'t': keys[starts] * bucket, 'n': n}
+    for field, values in (('s', speed), ('f', fuel)):
+        buckets[f'{field}_min'] = np.minimum.reduceat(values, starts)
+        buckets[f'{field}_max'] = np.maximum.reduceat(values, starts)
+        buckets[f'{field}_mean'] = np.add.reduceat(values, starts) / n
+    return buckets
+
+
+def merge_buckets(buckets, bucket):
+    """Объединение корзин в более длинные (bucket кратен исходной длине)"""
+    if not len(buckets['t']):
+        return empty_buckets()
+    keys = buckets['t'] // bucket
+    starts = _bucket_starts(keys)
+    n = np.add.reduceat(buckets['n'], starts)
+    merged = {'t': keys[starts] * bucket, 'n': n}
+    for field in ('s', 'f'):
+        merged[f'{field}_min'] = np.minimum.reduceat(buckets[f'{field}_min'], starts)
+        merged[f'{field}_max'] = np.maximum.reduceat(buckets[f'{field}_max'], starts)
+        # Среднее взвешивается числом точек в корзинах
+        merged[f'{field}_mean'] = np.add.reduceat(buckets[f'{field}_mean'] * buckets['n'], starts) / n
+    return merged
+
+
+def build_pyramid(ts, speed, fuel):
+    """Все уровни для точек: {длина корзины: корзины}"""
+    order = np.argsort(ts, kind='stable') if np.any(np.diff(ts) < 0) else slice(None)
+    pyramid = {LEVELS[0]: aggregate_points(ts[order], speed[order], fuel[order], LEVELS[0])}
+    for finer, level in zip(LEVELS, LEVELS[1:]):
+        pyramid[level] = merge_buckets(pyramid[finer], level)
+    return pyramid
+
+
+def concat_buckets(parts):
+    if not parts:
+        return empty_buckets()
+    return {field: np.concatenate([part[field] for part in parts]) for field in INT_FIELDS + VALUE_FIELDS}
+
+
+def select_buckets(buckets, start, end, bucket):
+    """Корзины, пересекающиеся с [start, end)"""
+    mask = (buckets['t'] + bucket > start) & (buckets['t'] < end)
+    return {field: values[mask] for field, values in buckets.items()}
+
+
+def points_as_buckets(columns):
+    """Точки трека как корзины из одной точки"""
+    speed = numeric_column(columns.s)
+    buckets = {'t': dt_to_epoch(columns.t).astype(np.int64), 'n': np.ones(len(columns), dtype=np.int64)}
+    for field, values in (('s', speed), ('f', columns.f.astype(np.float64))):
+        buckets[f'{field}_min'] = buckets[f'{field}_max'] = buckets[f'{field}_mean'] = values
+    return buckets
+
+
+def day_batches(days, size=BATCH_DAYS):
+    """Отсортированные сутки -> отрезки подряд идущих суток не длиннее size"""
+    batches = []
+    for day in days:
+        if batches and day == batches[-1][-1] + 1 and len(batches[-1]) < size:
+            batches[-1].append(day)
+        else:
+            batches.append([day])
+    return batches
+
+
+def choose_level(span, max_points):
+    """Самый грубый уровень, дающий за span секунд не меньше max_points корзин; None - точки"""
+    for level in reversed(LEVELS):
+        if span / level >= max_points:
+            return level
+    return None
+
+
+def _pack_buckets(buckets):
+    payload = {field: values.tobytes() for field, values in buckets.items()}
+    return zlib.compress(msgpack.packb(payload, use_bin_type=True), 3)
+
+
+def _unpack_buckets(blob):
+    payload = msgpack.unpackb(zlib.decompress(blob), raw=False)
+    buckets = {field: np.frombuffer(payload[field], dtype=np.int64) for field in INT_FIELDS}
+    buckets.update({field: np.frombuffer(payload[field], dtype=np.float64) for field in VALUE_FIELDS})
+    return buckets
+
+
+class TrackPyramid:
+    """Уровни агрегатов по суткам ТС в SQLite (по умолчанию - файл хранилища треков)."""
+
+    def __init__(self, path=None):
+        self._path = path
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @property
+    def path(self):
+        return str(self._path or telemetry_store.path)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def load(self, device_id, version, first_day, last_day, level):
+        """{сутки: корзины уровня} для сохраненных суток той же версии"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT day, data FROM track_levels '
+                'WHERE device_id = ? AND level = ? AND version = ? AND day >= ? AND day <= ?',
+                (device_id, level, version, first_day, last_day),
+            ).fetchall()
+        finally:
+            conn.close()
+        return {day: _unpack_buckets(blob) for day, blob in rows}
+
+    def save(self, device_id, version, pyramids):
+        """pyramids: {сутки: {уровень: корзины}}"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT OR REPLACE INTO track_levels (device_id, day, level, version, data) VALUES (?, ?, ?, ?, ?)',
+                [(device_id, day, level, version, _pack_buckets(buckets))
+                 for day, pyramid in pyramids.items() for level, buckets in pyramid.items()],
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def day_buckets(self, service, session_id, schema_id, devices, device_id, first_day, last_day, level):
+        """
+        Корзины уровня по суткам [first_day, last_day]: сохраненные + досчитанные по треку.
+        Возвращает ({сутки: корзины}, неполный ли трек).
+        """
+        version = devices.hashes[device_id]
+        found = self.load(device_id, version, first_day, last_day, level)
+        missing = [day for day in range(first_day, last_day + 1) if day not in found]
+        partial = False
+        for batch in day_batches(missing):
+            partial = self._build_days(service, session_id, schema_id, devices, device_id,
+                                       version, batch, level, found) or partial
+        return found, partial
+
+    def _build_days(self, service, session_id, schema_id, devices, device_id, version, days, level, found):
+        """Пирамиды подряд идущих суток days одним запросом трека; возвращает, неполный ли трек"""
+        # Будущее не запрашиваем
+        start = days[0] * DAY
+        end = min((days[-1] + 1) * DAY, int(time.time()) // 60 * 60)
+        if start >= end:
+            return False
+        columns, _, partial = load_device_track(service, session_id, schema_id, devices.get(device_id), start, end)
+        ts = dt_to_epoch(columns.t)
+        speed = numeric_column(columns.s)
+        fuel = columns.f.astype(np.float64)
+        del columns
+
+        settled = telemetry_store.settled_until()
+        bounds = np.searchsorted(ts, [day * DAY for day in days] + [(days[-1] + 1) * DAY], side='left')
+        to_save = {}
+        for day, i0, i1 in zip(days, bounds[:-1].tolist(), bounds[1:].tolist()):
+            pyramid = build_pyramid(ts[i0:i1], speed[i0:i1], fuel[i0:i1])
+            found[day] = pyramid[level]
+            # Сохраняются только сутки с окончательными и полностью полученными данными
+            if not partial and (day + 1) * DAY <= settled:
+                to_save[day] = pyramid
+        if to_save:
+            self.save(device_id, version, to_save)
+        return partial
+
+    def get(self, service, session_id, schema_id, devices, device_id, start, end, max_points):
+        """
+        Трек ТС за [start, end) (секунды epoch) не больше чем из ~max_points корзин.
+        Возвращает (корзины, длина корзины в секундах - 0 для точек, неполный ли трек).
+        """
+        level = choose_level(end - start, max_points)
+        if level is None:
+            columns, _, partial = load_device_track(service, session_id, schema_id, devices.get(device_id), start, end)
+            return points_as_buckets(downsample_track(columns, max_points)), 0, partial
+
+        by_day, partial = self.day_buckets(service, session_id, schema_id, devices, device_id,
+                                           int(start // DAY), int((end - 1) // DAY), level)
+        buckets = select_buckets(concat_buckets([by_day[day] for day in sorted(by_day)]), start, end, level)
+        # Уровень дает от max_points до ~10*max_points корзин - объединяем до ~max_points
+        factor = max(1, -(-int(end - start) // (level * max_points)))
+        bucket = level * factor
+        if factor > 1:
+            buckets = merge_buckets(buckets, bucket)
+        return buckets, bucket, partial
+
+
+def buckets_payload(buckets, precision=2):
+    """Колонки корзин для JSON"""
+    payload = {field: buckets[field].tolist() for field in INT_FIELDS}
+    payload.update({field: np.round(buckets[field], precision).tolist() for field in VALUE_FIELDS})
+    return payload
+
+
+track_pyramid = TrackPyramid()
@@ -1,3 +1,1281 @@
-from django.test import TestCase
+import gc
+import json
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-# Create your tests here.
+import httpx
+import msgpack
+import numpy as np
+import requests
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from .views.analytics import BATCH_MAX_DEVICES, build_track_columns, build_track_points, consumption_cache_key
+from .services.track import (
+    TrackColumns, TrackFetchResult, encode_track_response, iter_track_columns, iter_track_response,
+)
+from .services.calibration import compile_tables
+from .services.track_formats import (
+    encode_columnar_json, encode_msgpack, encode_track_payload, negotiate_track_format,
+)
+from .services.downsampling import downsample_track
+from .services.autograph import AutoGraphError, AutoGraphService
+from .services.autograph_async import AsyncAutoGraphService
+from .services.telemetry_store import TelemetryStore
+from .services.device_registry import DeviceRegistry
+from .services.session_manager import LOGIN_LOCK_STRIPES, SessionManager
+from .utils.cache import cache_result, cache_result_stats, get_stale_while_revalidate
+from .utils.tiered_cache import TieredCache
+from .services.online_poller import FleetPoller
+from .services.online_store import online_store
+from .views.vehicles import build_snapshot_response
+from .views.async_views import online_events
+from .utils.http import conditional_response
+from .models import FuelEvent, Vehicle
+from unittest import mock
+from .services import fuel_events
+from .services.fuel_events import analyze_track, detect_fuel_events, replace_fuel_events, update_fuel_events
+from .services.consumption import haversine_km
+from .services.track import autograph_to_epoch
+from .services import track_pyramid as track_pyramid_module
+from .services.track_pyramid import (
+    BATCH_DAYS, LEVELS, TrackPyramid, aggregate_points, build_pyramid, day_batches,
+)
+
+TESTDATA = Path(__file__).resolve().parent / 'testdata'
+
+
+class TempCacheMixin:
+    """Кэш Django - во временном файле на каждый класс тестов, а не в backend/cache.sqlite3"""
+
+    @classmethod
+    def setUpClass(cls):
+        tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(tmp.cleanup)
+        cache_settings = override_settings(CACHES={'default': {
+            'BACKEND': 'api.utils.tiered_cache.TieredCache',
+            'LOCATION': str(Path(tmp.name) / 'cache.sqlite3'),
+        }})
+        cache_settings.enable()
+        cls.addClassCleanup(cache_settings.disable)
+        super().setUpClass()
+
+
+class TrackPipelineGoldenTest(TempCacheMixin, SimpleTestCase):
+    """Колоночный конвейер трека должен выдавать то же, что и прежний поточечный."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(TESTDATA / 'track_golden.json', encoding='utf-8') as f:
+            cls.golden = json.load(f)
+
+    def build_columns(self):
+        return build_track_columns(
+            self.golden['raw_track'], self.golden['device_id'], self.golden['taring_tables']
+        )
+
+    def test_points_match_golden(self):
+        points = build_track_points(
+            self.golden['raw_track'], self.golden['device_id'], self.golden['taring_tables']
+        )
+        self.assertEqual(points, self.golden['points'])
+
+    def test_encoded_response_matches_golden(self):
+        body = json.loads(encode_track_response(self.build_columns(), device_id='dev-1'))
+        self.assertEqual(body['points'], self.golden['points'])
+        self.assertEqual(body['count'], len(self.golden['points']))
+        self.assertTrue(body['success'])
+
+    def test_streamed_response_matches_buffered(self):
+        calibrations = compile_tables(self.golden['device_id'], self.golden['taring_tables'])
+        segments = [s for s in self.golden['raw_track']['dev-1'] if isinstance(s, dict)]
+        chunks = iter_track_columns(segments, calibrations, chunk_size=7)
+        streamed = json.loads(b''.join(iter_track_response(chunks, device_id='dev-1')))
+        buffered = json.loads(encode_track_response(self.build_columns(), device_id='dev-1'))
+        self.assertEqual(streamed, buffered)
+        self.assertEqual(streamed['points'], self.golden['points'])
+
+    def test_stream_releases_processed_segments(self):
+        class Segment(dict):
+            pass
+
+        segments = [Segment(DT=list(range(i * 10, i * 10 + 10)), Speed=[1] * 10) for i in range(3)]
+        refs = [weakref.ref(segment) for segment in segments]
+        chunks = iter_track_columns(segments, {}, chunk_size=5)
+
+        for _ in range(3):
+            next(chunks)
+        self.assertEqual(len(segments), 1)
+        gc.collect()
+        self.assertIsNone(refs[0]())
+        self.assertIsNotNone(refs[2]())
+
+        self.assertEqual(sum(len(chunk) for chunk in chunks), 15)
+        gc.collect()
+        self.assertEqual([ref() for ref in refs], [None, None, None])
+
+    async def test_async_view_matches_golden(self):
+        device_id = self.golden['device_id']
+        vehicle = {'ID': device_id, 'Properties': [
+            {'Name': name, 'Value': {'items': table}} for name, table in self.golden['taring_tables'].items()
+        ]}
+        devices = mock.Mock(get={device_id: vehicle}.get, hashes={device_id: 'golden'})
+        result = TrackFetchResult(self.golden['raw_track'][device_id], [])
+        threads = []
+
+        def recording_encode(*args):
+            threads.append(threading.get_ident())
+            return encode_track_payload(*args)
+
+        params = {'session': 's', 'schema_id': '1', 'device_id': device_id,
+                  'from': '2026-01-17 00:00', 'to': '2026-01-18 00:00'}
+        with mock.patch('api.views.async_views.device_registry.aget', mock.AsyncMock(return_value=devices)), \
+                mock.patch('api.views.async_views.telemetry_store.aget_track',
+                           mock.AsyncMock(return_value=result)) as aget_track, \
+                mock.patch('api.views.async_views.encode_track_payload', side_effect=recording_encode):
+            response = await AsyncClient().get('/api/async/analytics/track/', params)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(json.loads(response.content)['points'], self.golden['points'])
+
+            # Из кэша - тот же ответ; кодирование и в этом случае не на event loop
+            cached = await AsyncClient().get('/api/async/analytics/track/', {**params, 'max_points': 10})
+            self.assertEqual(aget_track.await_count, 1)
+            cached = json.loads(cached.content)
+            self.assertEqual(cached['source_count'], len(self.golden['points']))
+            self.assertLessEqual(cached['count'], 10)
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+class TrackFormatsTest(TempCacheMixin, SimpleTestCase):
+    """Колоночный JSON и MessagePack раскодируются в те же точки, что и обычный JSON"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(TESTDATA / 'track_golden.json', encoding='utf-8') as f:
+            cls.golden = json.load(f)
+
+    def build_columns(self):
+        return build_track_columns(
+            self.golden['raw_track'], self.golden['device_id'], self.golden['taring_tables']
+        )
+
+    @staticmethod
+    def as_points(t, s, f, lat, lng, has_coords):
+        points = []
+        for i in range(len(t)):
+            point = {'t': t[i], 's': s[i]}
+            if has_coords[i]:
+                point.update(lat=lat[i], lng=lng[i])
+            point['f'] = f[i]
+            points.append(point)
+        return points
+
+    def test_columnar_round_trip(self):
+        data = json.loads(encode_columnar_json(self.build_columns(), device_id='dev-1'))
+        self.assertEqual(data['count'], len(self.golden['points']))
+        points = self.as_points(data['t'], data['s'], data['f'], data['lat'], data['lng'],
+                                [lat is not None for lat in data['lat']])
+        self.assertEqual(points, self.golden['points'])
+
+    def test_msgpack_round_trip(self):
+        data = msgpack.unpackb(encode_msgpack(self.build_columns(), device_id='dev-1'), raw=False)
+        self.assertEqual(data['device_id'], 'dev-1')
+        columns = {
+            name: np.frombuffer(data[name]['data'], dtype=data[name]['dtype']).tolist()
+            for name in ('t', 's', 'f', 'lat', 'lng', 'has_coords')
+        }
+        self.assertEqual(self.as_points(**columns), self.golden['points'])
+
+    def test_negotiate_track_format(self):
+        factory = RequestFactory()
+        cases = [
+            ({'format': 'msgpack'}, {'HTTP_ACCEPT': 'application/json'}, 'msgpack'),
+            ({'format': 'xml'}, {}, None),
+            ({}, {'HTTP_ACCEPT': 'application/msgpack'}, 'msgpack'),
+            ({}, {'HTTP_ACCEPT': 'application/vnd.tk.columnar+json, application/json;q=0.5'}, 'columnar'),
+            ({}, {'HTTP_ACCEPT': 'text/html'}, 'json'),
+            ({}, {}, 'json'),
+        ]
+        for params, headers, expected in cases:
+            with self.subTest(params=params, headers=headers):
+                request = factory.get('/api/async/analytics/track/', params, **headers)
+                self.assertEqual(negotiate_track_format(request), expected)
+
+
+class DownsampleTrackTest(TempCacheMixin, SimpleTestCase):
+
+    def make_columns(self, n=50000):
+        fuel = np.full(n, 300.0)
+        # Короткий слив посреди трека, который нельзя потерять
+        fuel[n // 2:n // 2 + 4] = [250.0, 180.0, 120.0, 140.0]
+        speed = np.tile(np.array([0, 30, 60, 90]), n // 4)
+        return TrackColumns(
+            t=np.arange(n) * 10, s=speed, lat=np.zeros(n), lng=np.zeros(n),
+            f=fuel, has_coords=np.ones(n, dtype=bool),
+        )
+
+    def test_respects_budget_and_keeps_extremes(self):
+        columns = self.make_columns()
+        result = downsample_track(columns, 500)
+        self.assertLessEqual(len(result), 500)
+        self.assertEqual(result.f.min(), 120.0)
+        self.assertEqual(result.s.max(), 90)
+        self.assertEqual(result.t[0], columns.t[0])
+        self.assertEqual(result.t[-1], columns.t[-1])
+
+    def test_short_track_untouched(self):
+        columns = self.make_columns(n=400)
+        self.assertIs(downsample_track(columns, 500), columns)
+
+
+class TelemetryStoreTest(TempCacheMixin, SimpleTestCase):
+    """Повторный запрос трека докачивает из AutoGRAPH только недостающее"""
+
+    class FakeService(AutoGraphService):
+        def __init__(self, start):
+            super().__init__({'TRACK_CHUNK_RETRIES': 0})
+            self.start = start
+            self.calls = []
+            self.broken = set()
+
+        def fetch_track(self, session_id, schema_id, device_id, start_dt, end_dt):
+            self.calls.append((start_dt, end_dt))
+            if start_dt in self.broken:
+                raise AutoGraphError('boom')
+            lo, hi = autograph_to_epoch(start_dt), autograph_to_epoch(end_dt)
+            dt = list(range(max(lo, self.start), hi, 60))
+            return {device_id: [{'DT': dt, 'Speed': [t % 90 for t in dt]}]}
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = TelemetryStore(path=Path(tmp.name) / 'telemetry.sqlite3', settle_seconds=0)
+        self.service = self.FakeService(autograph_to_epoch('20260110-0000'))
+
+    def get(self, start_dt, end_dt):
+        self.result = self.store.get_track(self.service, 's', '1', '42', start_dt, end_dt)
+        return [t for segment in self.result.segments for t in segment['DT']]
+
+    def test_fetches_only_gaps(self):
+        first = self.get('20260110-0000', '20260111-0000')
+        self.assertEqual(len(first), 24 * 60)
+
+        self.service.calls.clear()
+        second = self.get('20260110-1200', '20260111-1200')
+        self.assertEqual(self.service.calls, [('20260111-0000', '20260111-1200')])
+        self.assertEqual(second, list(range(autograph_to_epoch('20260110-1200'),
+                                            autograph_to_epoch('20260111-1200'), 60)))
+
+        self.service.calls.clear()
+        self.get('20260110-0600', '20260111-0600')
+        self.assertEqual(self.service.calls, [])
+
+    def test_long_range_in_chunks_with_failed_chunk(self):
+        self.service.broken.add('20260112-0000')
+        points = self.get('20260110-0000', '20260114-0000')
+        self.assertEqual(len(self.service.calls), 4)
+        self.assertTrue(self.result.partial)
+        self.assertEqual(len(points), 3 * 24 * 60)
+        self.assertEqual(points, sorted(set(points)))
+
+        # Упавшая часть не отмечена скачанной и докачивается при следующем запросе
+        self.service.broken.clear()
+        self.service.calls.clear()
+        points = self.get('20260110-0000', '20260114-0000')
+        self.assertEqual(self.service.calls, [('20260112-0000', '20260113-0000')])
+        self.assertFalse(self.result.partial)
+        self.assertEqual(len(points), 4 * 24 * 60)
+
+    def test_iter_track_matches_get_track(self):
+        expected = self.get('20260110-0000', '20260113-0000')
+        self.service.calls.clear()
+        result = self.store.iter_track(self.service, 's', '1', '42', '20260110-0000', '20260113-0000')
+        self.assertEqual(self.service.calls, [])
+        self.assertEqual([t for segment in result.segments for t in segment['DT']], expected)
+
+    def test_concurrent_save_of_same_gap_keeps_points_once(self):
+        start, end = autograph_to_epoch('20260110-0000'), autograph_to_epoch('20260111-0000')
+        segments = self.service.fetch_track('s', '1', '42', '20260110-0000', '20260111-0000')['42']
+        # Оба запроса увидели один и тот же пробел и сохраняют его
+        self.store.save('42', start, end, segments)
+        self.store.save('42', start - 3600, end, segments)
+        points = [t for segment in self.store.load('42', start, end) for t in segment['DT']]
+        self.assertEqual(points, list(range(start, end, 60)))
+        self.assertEqual(self.store.covered_ranges('42', start - 3600, end), [(start - 3600, end)])
+
+
+class LegacyAnalyticsTest(TempCacheMixin, SimpleTestCase):
+    """Старый /api/analytics/ качает длинный период по частям; упавшая часть не роняет ответ"""
+
+    def test_long_period_in_chunks(self):
+        service = TelemetryStoreTest.FakeService(autograph_to_epoch('20260110-0000'))
+        service.broken.add('20260112-0000')
+        with mock.patch('api.views.legacy.AutoGraphService', return_value=service):
+            response = Client().get('/api/analytics/', {
+                'session': 's', 'schema_id': '1', 'device_id': '42',
+                'from': '2026-01-10 00:00', 'to': '2026-01-14 00:00',
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(service.calls), 4)
+        timestamps = [ts for ts, _ in response.json()['track']]
+        self.assertEqual(len(timestamps), 3 * 24 * 60)
+        self.assertEqual(timestamps, sorted(set(timestamps)))
+
+    def test_stream_holds_one_chunk_at_a_time(self):
+        class Segment(dict):
+            pass
+
+        refs, alive = [], []
+
+        class Service(TelemetryStoreTest.FakeService):
+            def fetch_track(service, session_id, schema_id, device_id, start_dt, end_dt):
+                # К запросу следующей части сегменты предыдущей уже отпущены
+                gc.collect()
+                alive.append(sum(ref() is not None for ref in refs))
+                raw = super().fetch_track(session_id, schema_id, device_id, start_dt, end_dt)
+                segment = Segment(raw[device_id][0])
+                refs.append(weakref.ref(segment))
+                return {device_id: [segment]}
+
+        params = {'session': 's', 'schema_id': '1', 'device_id': '42',
+                  'from': '2026-01-10 00:00', 'to': '2026-01-14 00:00'}
+        service = Service(autograph_to_epoch('20260110-0000'))
+        with mock.patch('api.views.legacy.AutoGraphService', return_value=service):
+            expected = Client().get('/api/analytics/', params).json()
+            alive.clear()
+            response = Client().get('/api/analytics/', {**params, 'stream': '1'})
+            self.assertEqual(alive, [])
+            body = b''.join(response.streaming_content)
+        self.assertEqual(alive, [0, 0, 0, 0])
+        self.assertEqual(json.loads(body), expected)
+        self.assertEqual(len(expected['track']), 4 * 24 * 60)
+
+
+class AutoGraphRequestTest(TempCacheMixin, SimpleTestCase):
+    """_request повторяет запрос при сетевых ошибках и 429/5xx, но не при 4xx"""
+
+    class FakeAdapter(requests.adapters.BaseAdapter):
+        def __init__(self, outcomes):
+            super().__init__()
+            self.outcomes = list(outcomes)
+            self.calls = 0
+
+        def send(self, request, **kwargs):
+            self.calls += 1
+            outcome = self.outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            response = requests.Response()
+            response.status_code = outcome
+            response._content = b'[]'
+            response.request, response.url = request, request.url
+            return response
+
+        def close(self):
+            pass
+
+    def request(self, outcomes, retry=True):
+        service = AutoGraphService({'BASE_URL': f'http://autograph.test/request-{time.time()}',
+                                    'MAX_RETRIES': 2, 'BACKOFF_FACTOR': 0})
+        self.adapter = self.FakeAdapter(outcomes)
+        service.session.mount('http://autograph.test/', self.adapter)
+        before = dict(AutoGraphService.stats)
+        try:
+            return service._request('EnumSchemas', {'session': 's'}, retry=retry)
+        finally:
+            self.stats = {key: AutoGraphService.stats[key] - before[key] for key in before}
+
+    def test_retries_server_error_and_connection_error(self):
+        response = self.request([503, requests.ConnectionError('reset'), 200])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.adapter.calls, 3)
+        self.assertEqual(self.stats, {'requests': 3, 'retries': 2, 'failures': 0})
+
+    def test_client_error_is_not_retried(self):
+        response = self.request([404, 200])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.adapter.calls, 1)
+        self.assertEqual(self.stats, {'requests': 1, 'retries': 0, 'failures': 0})
+
+    def test_gives_up_after_max_retries(self):
+        self.assertEqual(self.request([502, 502, 502]).status_code, 502)
+        self.assertEqual(self.stats, {'requests': 3, 'retries': 2, 'failures': 0})
+
+        with self.assertRaises(requests.ConnectionError):
+            self.request([requests.ConnectionError('down')] * 3)
+        self.assertEqual(self.stats, {'requests': 3, 'retries': 2, 'failures': 1})
+
+    def test_no_retry_when_disabled(self):
+        self.assertEqual(self.request([503, 200], retry=False).status_code, 503)
+        self.assertEqual(self.adapter.calls, 1)
+
+
+class AsyncAutoGraphServiceTest(TempCacheMixin, SimpleTestCase):
+    """Асинхронный клиент: повторы на 5xx и нарезка трека на части через httpx"""
+
+    class MockedService(AsyncAutoGraphService):
+        def __init__(self, handler, **config):
+            super().__init__({'BASE_URL': f'http://autograph.test/{id(handler)}', 'BACKOFF_FACTOR': 0, **config})
+            self.mocked_client = httpx.AsyncClient(base_url=self.base_url, transport=httpx.MockTransport(handler))
+
+        @property
+        def client(self):
+            return self.mocked_client
+
+    async def test_retries_server_errors(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            if len(calls) == 1:
+                return httpx.Response(503)
+            return httpx.Response(200, json=[{'ID': '1', 'Name': 'Schema'}])
+
+        service = self.MockedService(handler)
+        self.assertEqual(await service.get_schemas('s'), [{'ID': '1', 'Name': 'Schema'}])
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(calls[0].endswith('/EnumSchemas'))
+
+    async def test_track_range_isolates_failed_chunk(self):
+        def handler(request):
+            params = request.url.params
+            if params['SD'] == '20260111-0000':
+                return httpx.Response(500)
+            lo, hi = autograph_to_epoch(params['SD']), autograph_to_epoch(params['ED'])
+            dt = list(range(lo, hi, 3600))
+            return httpx.Response(200, json={params['ID']: [{'DT': dt, 'Speed': [10] * len(dt)}]})
+
+        service = self.MockedService(handler, MAX_RETRIES=0, TRACK_CHUNK_RETRIES=0)
+        result = await service.fetch_track_range('s', '1', '42', '20260110-0000', '20260113-0000')
+        self.assertEqual(result.failed, [(autograph_to_epoch('20260111-0000'), autograph_to_epoch('20260112-0000'))])
+        self.assertTrue(result.partial)
+        points = [t for segment in result.segments for t in segment['DT']]
+        self.assertEqual(len(points), 2 * 24)
+        self.assertEqual(points, sorted(points))
+
+
+class TrackConcurrencyTest(TempCacheMixin, SimpleTestCase):
+    """Вложенные пулы (ТС x части трека) не превышают общий лимит GetTrack"""
+
+    class SlowService(AutoGraphService):
+        def __init__(self):
+            super().__init__({'BASE_URL': f'http://autograph.test/slots-{time.time()}',
+                              'TRACK_CONCURRENCY': 2, 'TRACK_WORKERS': 4})
+            self.lock = threading.Lock()
+            self.active = self.peak = 0
+
+        def _request(self, endpoint, params, retry=True):
+            with self.lock:
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            time.sleep(0.02)
+            with self.lock:
+                self.active -= 1
+            return mock.Mock(status_code=200, json=lambda: {params['ID']: []})
+
+    def test_nested_pools_share_slots(self):
+        service = self.SlowService()
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            results = list(pool.map(
+                lambda device_id: service.fetch_track_range('s', '1', device_id, '20260110-0000', '20260114-0000'),
+                ['1', '2', '3'],
+            ))
+        self.assertTrue(all(not result.failed for result in results))
+        self.assertEqual(service.peak, 2)
+
+
+class BatchTrackApiTest(TempCacheMixin, SimpleTestCase):
+    """Пакетные треки: ошибка одного ТС не роняет ответ, число ТС ограничено"""
+
+    def setUp(self):
+        index = {'1': {'ID': 1}, '2': {'ID': 2}}
+        devices = mock.Mock(get=index.get)
+        patcher = mock.patch('api.views.analytics.device_registry.get', return_value=devices)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def load(session_id, schema_id, devices, device_id, from_formatted, to_formatted):
+        if device_id == '2':
+            raise AutoGraphError('GetTrack returned 500')
+        segments = [{'DT': [1768640000, 1768640060, 1768640120], 'Speed': [0, 30, 60]}]
+        return build_track_columns(segments, device_id, {}), True
+
+    def test_device_errors_are_isolated(self):
+        with mock.patch('api.views.analytics.load_track_columns', side_effect=self.load):
+            response = Client().post('/api/analytics/tracks/', {
+                'session': 's', 'schema_id': '1', 'device_ids': ['1', '2', '3'],
+                'from': '2026-01-17 00:00', 'to': '2026-01-18 00:00',
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        devices = response.json()['devices']
+        self.assertEqual(list(devices), ['1', '2', '3'])
+        self.assertEqual(devices['1']['count'], 3)
+        self.assertTrue(devices['1']['partial'])
+        self.assertEqual([point['s'] for point in devices['1']['points']], [0, 30, 60])
+        self.assertEqual(devices['2'], {'success': False, 'error': 'Failed to fetch track data: GetTrack returned 500'})
+        self.assertFalse(devices['3']['success'])
+        self.assertIn('not found', devices['3']['error'])
+
+    def test_device_limit(self):
+        response = Client().get('/api/analytics/tracks/', {
+            'session': 's', 'schema_id': '1', 'device_ids': ','.join(map(str, range(BATCH_MAX_DEVICES + 1))),
+            'from': '2026-01-17 00:00', 'to': '2026-01-18 00:00',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('device_ids', response.json()['details'])
+
+    def test_body_types_validated(self):
+        response = Client().post('/api/analytics/tracks/', {
+            'session': 's', 'schema_id': '1', 'device_ids': 7, 'from': 20260117, 'to': ['2026-01-18 00:00'],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['details']), {'device_ids', 'from', 'to'})
+
+    def test_registry_failure(self):
+        error = AutoGraphError('EnumDevices returned 500')
+        with mock.patch('api.views.analytics.device_registry.get', side_effect=error):
+            response = Client().post('/api/analytics/tracks/', {
+                'session': 's', 'schema_id': '1', 'device_ids': ['1'],
+                'from': '2026-01-17 00:00', 'to': '2026-01-18 00:00',
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('EnumDevices returned 500', response.json()['error'])
+
+
+class ConsumptionApiTest(TempCacheMixin, TestCase):
+    """Расход по парку: проверка параметров, итоги ТС кэшируются по хэшу ТС и нормам"""
+
+    PERIOD = {'from': '2026-01-17 00:00', 'to': '2026-01-18 00:00'}
+
+    def setUp(self):
+        self.vehicle = Vehicle.objects.create(device_id='d1', name='Truck 1',
+                                              expected_consumption_idle=3.0, expected_consumption_move=30.0)
+        index = {'d1': {'ID': 'd1', 'Name': 'Truck 1'}, 'd2': {'ID': 'd2', 'Name': 'Truck 2'}}
+        self.devices = mock.Mock(index=index, get=index.get, hashes={'d1': 'h1', 'd2': 'h2'})
+        patcher = mock.patch('api.views.analytics.device_registry.get', return_value=self.devices)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def analyze(columns, ignition, rates):
+        return [], {'mileage_km': 100.0, 'fuel_actual': 30.0, 'fuel_expected': rates[1],
+                    'deviation_percent': 0.0, 'fuel_start': 50.0}
+
+    def request(self, **params):
+        return Client().get('/api/analytics/consumption/', {'session': 's', 'schema_id': '1', **self.PERIOD, **params})
+
+    def test_validation(self):
+        response = Client().get('/api/analytics/consumption/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['details']), {'session', 'schema_id', 'from', 'to'})
+
+        response = self.request(**{'from': '2026-01-18 00:00', 'to': '2026-01-17 00:00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('from', response.json()['details'])
+
+        response = self.request(device_ids=','.join(map(str, range(BATCH_MAX_DEVICES + 1))))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('device_ids', response.json()['details'])
+
+    def test_fleet_totals_cached_per_hash_and_rates(self):
+        with mock.patch('api.views.analytics.load_device_track', return_value=(None, None, False)) as loader, \
+                mock.patch('api.views.analytics.analyze_track', side_effect=self.analyze):
+            data = self.request().json()
+            self.assertEqual(loader.call_count, 2)
+            self.assertEqual(data['devices']['d1']['rates'], {'idle_l_per_hour': 3.0, 'move_l_per_100km': 30.0})
+            # У ТС без записи Vehicle - нормы по умолчанию
+            self.assertEqual(data['devices']['d2']['rates'], {'idle_l_per_hour': 2.0, 'move_l_per_100km': 25.0})
+            # Сумма по парку без уровней топлива; отклонение - от суммы норм
+            self.assertEqual(data['totals'], {'mileage_km': 200.0, 'fuel_actual': 60.0,
+                                              'fuel_expected': 55.0, 'deviation_percent': 9.09})
+            self.assertIsNotNone(cache.get(consumption_cache_key('1', 'd1', 'h1', '20260117-0000', '20260118-0000',
+                                                                 (3.0, 30.0))))
+
+            self.assertEqual(self.request().json(), data)
+            self.assertEqual(loader.call_count, 2)
+
+            # Новые нормы одного ТС и новые тарировки другого - пересчет только их
+            Vehicle.objects.filter(pk=self.vehicle.pk).update(expected_consumption_move=35.0)
+            data = self.request(device_ids='d1').json()
+            self.assertEqual(loader.call_count, 3)
+            self.assertEqual(data['totals']['fuel_expected'], 35.0)
+
+            self.devices.hashes['d2'] = 'h2-retared'
+            self.request(device_ids='d2')
+            self.assertEqual(loader.call_count, 4)
+            self.request()
+            self.assertEqual(loader.call_count, 4)
+
+
+class DeviceRegistryTest(TempCacheMixin, SimpleTestCase):
+    """ТС схемы общие для сессий; хэш меняется только у изменившегося ТС"""
+
+    class FakeService:
+        def __init__(self):
+            self.devices = [
+                {'ID': 1, 'Properties': [{'Name': 'LLS 1', 'Value': {'items': [{'inputVal': 0, 'outputVal': 0}]}}]},
+                {'ID': 2, 'Properties': []},
+            ]
+            self.enum_calls = 0
+
+        def get_vehicles_by_schema(self, session_id, schema_id):
+            self.enum_calls += 1
+            return self.devices if session_id != 'stranger' else []
+
+        def get_schemas(self, session_id):
+            return [{'ID': 'S1'}] if session_id != 'stranger' else []
+
+    def test_shared_between_sessions_and_precise_hashes(self):
+        service = self.FakeService()
+        registry = DeviceRegistry()
+
+        first = registry.get('a', 'S1', service)
+        self.assertEqual(first.get('1')['ID'], 1)
+        self.assertIs(registry.get('b', 'S1', service), first)
+        self.assertEqual(service.enum_calls, 1)
+
+        # Сессия без доступа к схеме не получает чужой кэш
+        self.assertFalse(registry.get('stranger', 'S1', service))
+
+        service.devices = [service.devices[0], {'ID': 2, 'Properties': [{'Name': 'VehicleRegNumber', 'Value': 'A1'}]}]
+        second = registry.refresh('a', 'S1', service)
+        self.assertEqual(second.hashes['1'], first.hashes['1'])
+        self.assertNotEqual(second.hashes['2'], first.hashes['2'])
+
+    async def test_async_store_runs_off_event_loop(self):
+        fake = self.FakeService()
+        service = mock.Mock(get_schemas=mock.AsyncMock(side_effect=fake.get_schemas),
+                            get_vehicles_by_schema=mock.AsyncMock(side_effect=fake.get_vehicles_by_schema))
+        registry = DeviceRegistry()
+        store, threads = registry.store, []
+
+        def recording_store(*args):
+            threads.append(threading.get_ident())
+            return store(*args)
+
+        registry.store = recording_store
+        devices = await registry.aget('a', 'S1', service)
+        self.assertEqual(devices.get('1')['ID'], 1)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+
+class SessionManagerTest(TempCacheMixin, SimpleTestCase):
+    """Один Login на учетную запись и повторный вход при истекшей сессии"""
+
+    class FakeService:
+        def __init__(self):
+            self.logins = 0
+            self.lock = threading.Lock()
+            self.valid = set()
+
+        def get_session_token(self, user, password):
+            time.sleep(0.05)
+            with self.lock:
+                self.logins += 1
+                token = f'token-{self.logins}'
+            self.valid.add(token)
+            return token
+
+        def get_schemas(self, session_id):
+            return [{'ID': 'S1'}] if session_id in self.valid else []
+
+    def test_concurrent_logins_collapse(self):
+        service = self.FakeService()
+        manager = SessionManager(ttl=60, refresh_before=0)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            tokens = list(pool.map(lambda _: manager.get_token('user', 'pass', service), range(8)))
+        self.assertEqual(set(tokens), {'token-1'})
+        self.assertEqual(service.logins, 1)
+
+    def test_expired_session_retried_once(self):
+        service = self.FakeService()
+        manager = SessionManager(ttl=60, refresh_before=0)
+        manager.get_token('user', 'pass', service)
+        service.valid.clear()
+
+        token, schemas = manager.with_session('user', 'pass', service.get_schemas, service)
+        self.assertEqual(token, 'token-2')
+        self.assertEqual(schemas, [{'ID': 'S1'}])
+
+    def test_expired_session_detected_past_schema_cache(self):
+        valid, logins = set(), []
+
+        class Service(AutoGraphService):
+            def get_session_token(service, user, password):
+                logins.append(user)
+                token = f'cached-schemas-token-{len(logins)}'
+                valid.add(token)
+                return token
+
+            def _request(service, endpoint, params, retry=True):
+                schemas = [{'ID': 'S1'}] if params['session'] in valid else []
+                return mock.Mock(raise_for_status=lambda: None, json=lambda: schemas)
+
+        service = Service()
+        manager = SessionManager(ttl=60, refresh_before=0)
+        token = manager.get_token('user', 'pass', service)
+        self.assertEqual(service.get_schemas(token), [{'ID': 'S1'}])
+        valid.clear()
+        # Кэш процесса еще отдает схемы истекшей сессии, проверка идет мимо него
+        self.assertEqual(service.get_schemas(token), [{'ID': 'S1'}])
+        new_token, schemas = manager.with_session('user', 'pass', service.fetch_schemas, service)
+        self.assertEqual(new_token, 'cached-schemas-token-2')
+        self.assertEqual(schemas, [{'ID': 'S1'}])
+
+    def test_login_locks_do_not_grow(self):
+        manager = SessionManager(ttl=60, refresh_before=0)
+        service = mock.Mock(get_session_token=lambda user, password: None)
+        for i in range(500):
+            manager.get_token('user', f'wrong-{i}', service)
+        self.assertEqual(len(manager._locks), LOGIN_LOCK_STRIPES)
+
+
+class SingleFlightTest(TempCacheMixin, SimpleTestCase):
+    """Одинаковые одновременные запросы к AutoGRAPH выполняются один раз"""
+
+    class FakeResponse:
+        status_code = 200
+
+        def __init__(self, params):
+            self.params = params
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {device_id: {'Speed': 0} for device_id in self.params['IDs'].split(',')}
+
+    def test_identical_calls_share_one_request(self):
+        requests_made = []
+
+        class Service(AutoGraphService):
+            def _request(service, endpoint, params, retry=True):
+                requests_made.append(endpoint)
+                time.sleep(0.1)
+                return self.FakeResponse(params)
+
+        service = Service()
+        device_ids = ['1,2,3', '3,2,1', '2,1,3,1'] * 3
+        with ThreadPoolExecutor(max_workers=len(device_ids)) as pool:
+            results = list(pool.map(lambda ids: service.get_online_info('s', 'S1', ids), device_ids))
+
+        self.assertEqual(requests_made, ['GetOnlineInfo'])
+        self.assertTrue(all(result is results[0] for result in results))
+
+
+class StaleWhileRevalidateTest(TempCacheMixin, SimpleTestCase):
+    """Устаревшие данные отдаются сразу, обновление в фоне - одно"""
+
+    def test_single_background_refresh(self):
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'version': len(calls)}
+
+        key = 'test:swr'
+        self.addCleanup(lambda: cache.delete(key))
+        self.assertEqual(get_stale_while_revalidate(key, fetch, fresh=0.2, max_stale=60), {'version': 1})
+        self.assertEqual(get_stale_while_revalidate(key, fetch, fresh=0.2, max_stale=60), {'version': 1})
+
+        time.sleep(0.25)
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lambda _: get_stale_while_revalidate(key, fetch, 0.2, 60), range(10)))
+        self.assertEqual(results, [{'version': 1}] * 10)
+
+        time.sleep(0.2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(get_stale_while_revalidate(key, fetch, fresh=0.2, max_stale=60), {'version': 2})
+
+
+class FleetPollerTest(TempCacheMixin, SimpleTestCase):
+    """Опросчик пишет снимки пачками; версия ТС меняется только при изменениях"""
+
+    class FakeService(AutoGraphService):
+        def __init__(self):
+            super().__init__()
+            self.batches = []
+            self.speed = {str(i): 0 for i in range(5)}
+
+        def get_schemas(self, session_id):
+            return [{'ID': 'POLL'}]
+
+        def get_vehicles_by_schema(self, session_id, schema_id):
+            return [{'ID': int(device_id), 'Properties': []} for device_id in self.speed]
+
+        def get_online_info(self, session_id, schema_id, device_ids):
+            self.batches.append(device_ids)
+            return {
+                device_id: {'Speed': self.speed[device_id], 'Final': {'FDT': '1.02:00:00', 'DIgnition': True}}
+                for device_id in device_ids.split(',')
+            }
+
+    def test_poll_writes_normalized_snapshot(self):
+        self.addCleanup(lambda: cache.delete_many(['online:snapshot:POLL', 'online:head:POLL', 'online:watched:POLL',
+                                                   'online:watched-schemas']))
+        service = self.FakeService()
+        poller = FleetPoller(service=service, batch_size=2)
+
+        online_store.watch('POLL', 'session')
+        poller.poll_once()
+        snapshot = online_store.get('POLL')
+        self.assertEqual(service.batches, ['0,1', '2,3', '4'])
+        self.assertEqual(snapshot['vehicles']['3']['moto_hours'], 26)
+        self.assertTrue(snapshot['vehicles']['3']['ignition'])
+
+        service.speed['3'] = 40
+        poller.poll_once()
+        updated = online_store.get('POLL')
+        self.assertEqual(updated['version'], snapshot['version'] + 1)
+        self.assertEqual(updated['versions']['3'], updated['version'])
+        self.assertEqual(updated['versions']['0'], snapshot['version'])
+
+        # since: только ТС, изменившиеся после версии клиента
+        delta = build_snapshot_response(updated, '0,1,2,3,4', since=snapshot['version'])
+        self.assertEqual(list(delta['online_data']), ['3'])
+        self.assertEqual(delta['since'], snapshot['version'])
+        full = build_snapshot_response(updated, '0,1,2,3,4', since=updated['version'] + 10)
+        self.assertEqual(len(full['online_data']), 5)
+        self.assertNotIn('since', full)
+
+
+class OnlineWatchTest(TempCacheMixin, SimpleTestCase):
+    """Отметки просмотра из многих потоков не теряются; истекшие схемы уходят из индекса"""
+
+    def test_concurrent_watch(self):
+        schemas = [f'W{i}' for i in range(20)]
+        keys = [f'online:watched:{schema_id}' for schema_id in schemas] + ['online:watched-schemas']
+        cache.delete_many(keys)
+        self.addCleanup(lambda: cache.delete_many(keys))
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            list(pool.map(lambda schema_id: online_store.watch(schema_id, f'session-{schema_id}'), schemas))
+        self.assertEqual(online_store.watched(), {schema_id: f'session-{schema_id}' for schema_id in schemas})
+
+        cache.set('online:watched:W0', ('session-W0', time.time() - 1))
+        self.assertNotIn('W0', online_store.watched())
+        self.assertNotIn('W0', cache.get('online:watched-schemas'))
+        online_store.watch('W0', 'again')
+        self.assertEqual(online_store.watched()['W0'], 'again')
+
+    def test_only_sessions_with_access_are_watched(self):
+        keys = ['online:watched:WA', 'online:watched-schemas']
+        self.addCleanup(lambda: cache.delete_many(keys))
+        params = {'schema_id': 'WA', 'device_ids': '1'}
+        has_access = lambda service, session_id, schema_id: session_id == 'good'
+        with mock.patch('api.views.vehicles.device_registry.has_access', side_effect=has_access), \
+                mock.patch('api.views.vehicles.service.get_online_info', return_value={}):
+            Client().get('/api/vehicles/online/', {**params, 'session_id': 'good'})
+            self.assertEqual(Client().get('/api/vehicles/online/', {**params, 'session_id': 'stranger'}).status_code, 200)
+        # Чужая сессия не подменяет сессию опроса схемы
+        self.assertEqual(online_store.watched().get('WA'), 'good')
+
+
+class OnlineSnapshotTest(TempCacheMixin, SimpleTestCase):
+    """Параллельные опросчики одной схемы не выпускают одну версию дважды"""
+
+    def test_concurrent_saves_get_distinct_versions(self):
+        schema_id = 'RACE'
+        keys = [f'online:snapshot:{schema_id}', f'online:head:{schema_id}']
+        self.addCleanup(lambda: cache.delete_many(keys))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            snapshots = list(pool.map(lambda i: online_store.save(schema_id, {'1': {'Speed': i}}), range(24)))
+        versions = sorted(snapshot['version'] for snapshot in snapshots)
+        self.assertEqual(versions, list(range(1, 25)))
+        self.assertEqual(online_store.head(schema_id)['version'], 24)
+
+
+class OnlineStreamTest(TempCacheMixin, SimpleTestCase):
+    """Поток онлайн-данных: снимок, дальше только изменения; без изменений снимок не читается"""
+
+    @staticmethod
+    def parse(event):
+        lines = dict(line.split(': ', 1) for line in event.strip().splitlines())
+        return lines['event'], json.loads(lines['data'])
+
+    async def test_snapshot_then_deltas(self):
+        schema_id = 'STREAM'
+        keys = [f'online:snapshot:{schema_id}', f'online:head:{schema_id}', f'online:watched:{schema_id}',
+                'online:watched-schemas']
+        self.addCleanup(lambda: cache.delete_many(keys))
+        vehicle = {'Speed': 0, 'fuel': 100, 'ignition': False}
+        await sync_to_async(online_store.save)(schema_id, {'1': vehicle, '2': vehicle, '3': vehicle})
+
+        with mock.patch('api.views.async_views.STREAM_CHECK_SECONDS', 0), \
+                mock.patch('api.views.async_views.STREAM_KEEPALIVE_SECONDS', 0), \
+                mock.patch('api.views.async_views.poll_if_stale') as poll, \
+                mock.patch.object(online_store, 'aget', wraps=online_store.aget) as aget:
+            events = online_events('session', schema_id, '1,2')
+            self.assertEqual(self.parse(await anext(events)), ('snapshot', {
+                'version': 1, 'online_data': {'1': vehicle, '2': vehicle},
+            }))
+            # Пока версия не менялась - только keep-alive и ни одного чтения снимка
+            for _ in range(3):
+                self.assertEqual(await anext(events), ': keepalive\n\n')
+            self.assertEqual(aget.call_count, 1)
+
+            await sync_to_async(online_store.save)(schema_id, {'1': {**vehicle, 'Speed': 40}, '3': vehicle})
+            self.assertEqual(self.parse(await anext(events)), ('delta', {
+                'version': 2, 'changes': {'1': {'Speed': 40}}, 'removed': ['2'],
+            }))
+            self.assertEqual(aget.call_count, 2)
+            await events.aclose()
+        poll.assert_not_called()
+
+
+class ConditionalResponseTest(TempCacheMixin, SimpleTestCase):
+    def test_same_content_gives_not_modified(self):
+        factory = RequestFactory()
+        data = {'vehicles': [{'ID': 1, 'Properties': []}], 'count': 1}
+        first = conditional_response(factory.get('/'), data, response_class=JsonResponse)
+        self.assertEqual(first.status_code, 200)
+
+        again = conditional_response(factory.get('/', HTTP_IF_NONE_MATCH=first['ETag']), dict(data), response_class=JsonResponse)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+
+        changed = conditional_response(factory.get('/', HTTP_IF_NONE_MATCH=first['ETag']), {**data, 'count': 2}, response_class=JsonResponse)
+        self.assertEqual(changed.status_code, 200)
+
+
+class FuelEventDetectionTest(TempCacheMixin, TestCase):
+    """Синтетические сутки поминутно: шум датчика, сбои ДУТ, волны в движении"""
+
+    def make_series(self):
+        rng = np.random.default_rng(7)
+        n = 1440
+        ts = 1.7e9 + np.arange(n) * 60.0
+        speed = np.where((np.arange(n) // 120) % 2 == 0, 60.0, 0.0)
+        fuel = 200 - np.cumsum(np.where(speed > 0, 0.2, 0.01)) + rng.normal(0, 1.0, n)
+        fuel[rng.integers(0, n, 10)] = 0                   # ошибка ДУТ
+        fuel[30:32] += 30                                  # волна в движении
+        fuel[370:] += np.clip(np.arange(n - 370) * 20, 0, 100)  # заправка на стоянке
+        fuel[500:] -= 40                                   # скачок в движении - не слив
+        fuel[620:] -= np.clip(np.arange(n - 620) * 8, 0, 40)    # слив на стоянке
+        return ts, speed, fuel
+
+    def test_refill_and_drain_on_stop(self):
+        ts, speed, fuel = self.make_series()
+        events = detect_fuel_events(ts, speed, fuel)
+        self.assertEqual([e.event_type for e in events], ['refill', 'drain'])
+        self.assertAlmostEqual(events[0].volume, 100, delta=3)
+        self.assertAlmostEqual(events[1].volume, 40, delta=3)
+        self.assertTrue(ts[370] <= events[0].timestamp <= ts[376])
+
+        # Зажигание выключено - скачок на 500-й точке тоже на стоянке
+        ignition = np.ones(len(ts), dtype=bool)
+        ignition[480:530] = False
+        self.assertEqual(len(detect_fuel_events(ts, speed, fuel, ignition)), 3)
+
+    def test_rerun_replaces_unconfirmed_events(self):
+        ts, speed, fuel = self.make_series()
+        vehicle = Vehicle.objects.create(name='Test', device_id='FE1')
+        events = detect_fuel_events(ts, speed, fuel)
+        replace_fuel_events(vehicle, ts[0], ts[-1] + 60, events)
+        FuelEvent.objects.filter(event_type='drain').update(is_confirmed=True)
+
+        replace_fuel_events(vehicle, ts[0], ts[-1] + 60, events)
+        self.assertEqual(FuelEvent.objects.filter(vehicle=vehicle).count(), 2)
+        self.assertTrue(FuelEvent.objects.get(event_type='drain').is_confirmed)
+
+    def test_incremental_update_matches_full_run(self):
+        ts, speed, fuel = self.make_series()
+        raw = np.round(fuel * 10).clip(0, 4000).astype(int)
+
+        class FakeService(AutoGraphService):
+            def get_schemas(self, session_id):
+                return [{'ID': 'FE'}]
+
+            def get_vehicles_by_schema(self, session_id, schema_id):
+                taring = {'items': [{'inputVal': 0, 'outputVal': 0}, {'inputVal': 4000, 'outputVal': 400}]}
+                return [{'ID': 'FE2', 'Name': 'Incremental', 'Properties': [{'Name': 'LLS1', 'Value': taring}]}]
+
+            def fetch_track(self, session_id, schema_id, device_id, start_dt, end_dt):
+                i0, i1 = np.searchsorted(ts, [autograph_to_epoch(start_dt), autograph_to_epoch(end_dt)])
+                return {device_id: [{'DT': ts[i0:i1].tolist(), 'Speed': speed[i0:i1].tolist(),
+                                     'LLS1': raw[i0:i1].tolist()}]}
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = TelemetryStore(path=Path(tmp.name) / 'telemetry.sqlite3', settle_seconds=0)
+        service = FakeService()
+        config = {'BACKFILL_SECONDS': 6 * 3600}
+        with mock.patch.object(fuel_events, 'telemetry_store', store):
+            # Данные приходят по часу, каждый прогон видит только новое с перекрытием
+            for hour in range(6, 25):
+                update_fuel_events('s', 'FE', service=service, config=config, now=ts[0] + hour * 3600)
+            again = update_fuel_events('s', 'FE', service=service, config=config, now=ts[0] + 24 * 3600)
+
+        events = FuelEvent.objects.filter(vehicle__device_id='FE2').order_by('timestamp')
+        # Скачок на 40 л в движении - не слив, но перерасход относительно нормы
+        self.assertEqual([e.event_type for e in events], ['refill', 'overrun', 'drain'])
+        self.assertEqual(again['vehicles'], 0)
+        vehicle = Vehicle.objects.get(device_id='FE2')
+        self.assertIn('fuel', vehicle.events_state)
+
+
+class ConsumptionTest(TempCacheMixin, SimpleTestCase):
+    """Час движения 60 км/ч с расходом 30 л/ч, затем час холостого хода по норме"""
+
+    def test_overrun_on_moving_segment(self):
+        self.assertAlmostEqual(float(haversine_km(55.0, 60.0, 56.0, 60.0)), 111.19, places=1)
+
+        n = 121
+        t = 1.7e9 + np.arange(n) * 60.0
+        moving = np.arange(n) < 60
+        speed = np.where(moving, 60.0, 0.0)
+        lat = 55.0 + np.cumsum(np.where(moving, 1 / 111.195, 0.0))
+        lng = np.full(n, 60.0)
+        fuel = 200 - np.cumsum(np.where(moving, 0.5, 2 / 60))
+        columns = TrackColumns(t=t, s=speed, lat=lat, lng=lng, f=fuel, has_coords=np.ones(n, dtype=bool))
+
+        steps, totals = analyze_track(columns, rates=(2.0, 25.0))
+        self.assertAlmostEqual(totals['mileage_km'], 60, delta=1)
+        self.assertAlmostEqual(totals['fuel_expected_move'], 15, delta=0.5)
+        self.assertAlmostEqual(totals['fuel_actual_move'], 30, delta=1)
+        self.assertAlmostEqual(totals['fuel_actual_idle'], totals['fuel_expected_idle'], delta=0.3)
+        self.assertEqual([step.event_type for step in steps], ['overrun'])
+        self.assertAlmostEqual(steps[0].volume, 15, delta=1)
+
+
+class DayStatsTest(TempCacheMixin, TestCase):
+    """Двое суток: по часу движения 60 км/ч в каждые; отчет - сумма суточных строк"""
+
+    def test_daily_rollup_and_report(self):
+        from datetime import date
+        from .models import VehicleDayStats
+        from .services.reports import daily_stats, fleet_report
+
+        n = 2 * 1440
+        t = 1767225600.0 + np.arange(n) * 60.0  # 2026-01-01 00:00 UTC
+        minute = np.arange(n) % 1440
+        moving = (minute >= 600) & (minute < 660)
+        speed = np.where(moving, 60.0, 0.0)
+        lat = 55.0 + np.cumsum(np.where(moving, 1 / 111.195, 0.0))
+        fuel = 300 - np.cumsum(np.where(moving, 0.25, 0.0))
+        columns = TrackColumns(t=t, s=speed, lat=lat, lng=np.full(n, 60.0), f=fuel, has_coords=np.ones(n, dtype=bool))
+
+        stats = daily_stats(columns, np.zeros(n, dtype=bool), (2.0, 25.0))
+        self.assertEqual(sorted(stats), [date(2026, 1, 1), date(2026, 1, 2)])
+        for row in stats.values():
+            self.assertEqual(row['points'], 1440)
+            self.assertAlmostEqual(row['mileage_km'], 60, delta=1)
+            # Плюс по интервалу разгона и торможения
+            self.assertEqual(row['engine_seconds'], 3660)
+            self.assertEqual(row['max_speed'], 60.0)
+
+        vehicle = Vehicle.objects.create(device_id='d1', name='Truck')
+        VehicleDayStats.objects.bulk_create(
+            VehicleDayStats(vehicle=vehicle, day=day, is_complete=True, **row) for day, row in stats.items()
+        )
+        report = fleet_report({'d1': vehicle}, date(2026, 1, 1), date(2026, 1, 2))
+        self.assertEqual(len(report), 1)
+        self.assertAlmostEqual(report[0]['distance'], 120, delta=2)
+        self.assertEqual(report[0]['engine_hours'], 2.0)
+        self.assertEqual(report[0]['moving_hours'], 2.0)
+        self.assertAlmostEqual(report[0]['fuel_consumed'], 30, delta=1)
+        self.assertEqual(report[0]['fuel_start'], stats[date(2026, 1, 1)]['fuel_start'])
+        self.assertEqual(report[0]['fuel_end'], stats[date(2026, 1, 2)]['fuel_end'])
+
+
+class TrackPyramidTest(TempCacheMixin, SimpleTestCase):
+    """Уровни, собранные друг из друга, совпадают с агрегатами по точкам; сутки читаются из хранилища"""
+
+    def make_columns(self, start, n):
+        t = start + np.arange(n) * 7.0
+        speed = (np.arange(n) % 90).astype(np.float64)
+        fuel = 400 - np.arange(n) * 0.001
+        return TrackColumns(t=t, s=speed, lat=np.zeros(n), lng=np.zeros(n), f=fuel, has_coords=np.zeros(n, dtype=bool))
+
+    def test_levels_match_direct_aggregation(self):
+        columns = self.make_columns(1767225600.0, 30000)
+        pyramid = build_pyramid(columns.t, columns.s, columns.f)
+        for level in LEVELS:
+            direct = aggregate_points(columns.t, columns.s, columns.f, level)
+            for field, values in pyramid[level].items():
+                np.testing.assert_allclose(values, direct[field], err_msg=f'{level} {field}')
+
+    def test_served_from_coarsest_level_and_stored(self):
+        day = 1767225600  # 2026-01-01 00:00 UTC
+        columns = self.make_columns(day, 2 * 86400 // 7)
+        devices = mock.Mock(hashes={'d1': 'v1'}, get=lambda device_id: {'ID': device_id})
+
+        def load(service, session_id, schema_id, device, start, end):
+            mask = (columns.t >= start) & (columns.t < end)
+            return columns.take(mask), None, False
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(track_pyramid_module, 'load_device_track', side_effect=load) as loader:
+            pyramid = TrackPyramid(Path(tmp) / 'levels.sqlite3')
+            buckets, bucket, partial = pyramid.get(None, 's', 'schema', devices, 'd1', day, day + 2 * 86400, 100)
+            self.assertEqual(bucket, 1800)  # уровень 10 мин, по 3 корзины
+            self.assertEqual(len(buckets['t']), 96)
+            self.assertEqual(buckets['n'].sum(), len(columns))
+            self.assertEqual(buckets['s_max'].max(), 89)
+            self.assertFalse(partial)
+
+            again, _, _ = pyramid.get(None, 's', 'schema', devices, 'd1', day + 3600, day + 86400, 100)
+            self.assertEqual(loader.call_count, 1)
+            self.assertEqual(again['t'][0], day + 3600)
+
+            points, bucket, _ = pyramid.get(None, 's', 'schema', devices, 'd1', day, day + 600, 100)
+            self.assertEqual(bucket, 0)
+            self.assertLessEqual(len(points['t']), 100)
+
+    def test_missing_days_loaded_in_batches(self):
+        day = 1767225600  # 2026-01-01 00:00 UTC
+        columns = self.make_columns(day, 7 * 86400 // 7)
+        devices = mock.Mock(hashes={'d1': 'v1'}, get=lambda device_id: {'ID': device_id})
+        spans = []
+
+        def load(service, session_id, schema_id, device, start, end):
+            spans.append((start, end))
+            mask = (columns.t >= start) & (columns.t < end)
+            return columns.take(mask), None, False
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(track_pyramid_module, 'load_device_track', side_effect=load):
+            pyramid = TrackPyramid(Path(tmp) / 'levels.sqlite3')
+            # Четвертые сутки уже посчитаны - отрезки до и после них грузятся отдельно
+            pyramid.get(None, 's', 'schema', devices, 'd1', day + 3 * 86400, day + 4 * 86400, 100)
+            spans.clear()
+            buckets, _, partial = pyramid.get(None, 's', 'schema', devices, 'd1', day, day + 7 * 86400, 100)
+
+        self.assertEqual(spans, [(day, day + 3 * 86400), (day + 4 * 86400, day + 7 * 86400)])
+        self.assertTrue(all(end - start <= BATCH_DAYS * 86400 for start, end in spans))
+        self.assertEqual(buckets['n'].sum(), len(columns))
+        self.assertFalse(partial)
+        self.assertEqual(day_batches([1, 2, 3, 4, 5, 7, 8]), [[1, 2, 3], [4, 5], [7, 8]])
+
+
+class FuelEventApiTest(TempCacheMixin, TestCase):
+    """Курсор проходит все события ровно один раз, даже с одинаковым временем"""
+
+    def setUp(self):
+        from datetime import datetime, timedelta, timezone
+        base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.vehicles = [Vehicle.objects.create(device_id=f'd{i}', name=f'Truck {i}') for i in range(3)]
+        FuelEvent.objects.bulk_create(
+            FuelEvent(vehicle=vehicle, event_type=('drain', 'refill')[i % 2],
+                      timestamp=base + timedelta(minutes=i // 2), volume=10.0)
+            for vehicle in self.vehicles for i in range(90)
+        )
+        index = {'d0': {'ID': 'd0'}, 'd1': {'ID': 'd1'}}
+        devices = mock.Mock(index=index, get=index.get)
+        patcher = mock.patch('api.views.events.device_registry.get', return_value=devices)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_keyset_pages_and_bulk_confirm(self):
+        client = Client()
+        seen, cursor = [], ''
+        while True:
+            response = client.get('/api/fuel-events/', {'session': 's', 'schema_id': '1', 'limit': 70, 'cursor': cursor})
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            seen += [event['id'] for event in data['events']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        # Только ТС схемы (d0, d1), без повторов и пропусков
+        expected = FuelEvent.objects.filter(vehicle__device_id__in=['d0', 'd1']).order_by('-timestamp', '-id')
+        self.assertEqual(seen, list(expected.values_list('id', flat=True)))
+
+        response = client.get('/api/fuel-events/', {'session': 's', 'schema_id': '1', 'type': 'refill',
+                                                     'device_ids': 'd1', 'from': '2026-01-01 00:10'})
+        self.assertEqual(response.json()['count'], 35)
+
+        response = client.post('/api/fuel-events/confirm/', {
+            'session': 's', 'schema_id': '1', 'ids': seen[:10] + [FuelEvent.objects.filter(vehicle__device_id='d2').first().id],
+            'confirmed': True,
+        }, content_type='application/json')
+        self.assertEqual(response.json()['updated'], 10)
+        response = client.get('/api/fuel-events/', {'session': 's', 'schema_id': '1', 'confirmed': 1})
+        self.assertEqual(sorted(event['id'] for event in response.json()['events']), sorted(seen[:10]))
+
+
+class TieredCacheTest(TempCacheMixin, SimpleTestCase):
+    """Два экземпляра на одном файле - как два процесса"""
+
+    def make_cache(self, path, **options):
+        return TieredCache(str(path), {'OPTIONS': {'SYNC_INTERVAL': 0, **options}})
+
+    def test_shared_tags_and_local_lru(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            first = self.make_cache(Path(tmp) / 'cache.sqlite3')
+            second = self.make_cache(Path(tmp) / 'cache.sqlite3')
+
+            first.set('track:1:a', [1], 60, tags=['kind:track', 'device:1'])
+            first.set('track:2:a', [2], 60, tags=['kind:track', 'device:2'])
+            first.set('online:1', {'v': 1}, 60, tags=['kind:online'])
+            self.assertEqual(second.get('track:1:a'), [1])
+
+            # Перезапись в одном процессе видна в другом, несмотря на его LRU
+            first.set('track:1:a', [10], 60, tags=['kind:track', 'device:1'])
+            self.assertEqual(second.get('track:1:a'), [10])
+
+            self.assertEqual(second.invalidate_tags(['device:1']), 1)
+            self.assertIsNone(first.get('track:1:a'))
+            self.assertEqual(first.get('track:2:a'), [2])
+            self.assertEqual(first.delete_pattern('track:*'), 1)
+            self.assertIsNone(second.get('track:2:a'))
+            self.assertEqual(second.get('online:1'), {'v': 1})
+
+            self.assertTrue(first.add('lock', 1, 60))
+            self.assertFalse(second.add('lock', 1, 60))
+
+            small = self.make_cache(Path(tmp) / 'cache.sqlite3', LOCAL_MAX_ENTRIES=2)
+            for i in range(5):
+                small.set(f'k{i}', i, 60)
+            self.assertEqual(list(small._local.entries), [small.make_key('k3'), small.make_key('k4')])
+            self.assertEqual(small.get('k0'), 0)
+
+
+class CacheResultTest(TempCacheMixin, SimpleTestCase):
+    """Канонические ключи, отрицательный кэш, бюджет памяти и single-flight"""
+
+    def test_keys_negative_budget_and_single_flight(self):
+        calls = []
+
+        @cache_result(timeout=60, negative_timeout=60, max_bytes=4096)
+        def fetch(session_id, params=None, size=10):
+            calls.append(session_id)
+            time.sleep(0.05)
+            return 'x' * size if session_id != 'empty' else []
+
+        self.assertEqual(fetch('a', {'x': 1, 'y': 2}), 'x' * 10)
+        self.assertEqual(fetch('a', params={'y': 2, 'x': 1}, size=10), 'x' * 10)
+        self.assertEqual(fetch('empty'), [])
+        self.assertEqual(fetch('empty'), [])
+        self.assertEqual(calls, ['a', 'empty'])
+
+        # Одновременные промахи - один вызов
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda _: fetch('b'), range(8)))
+        self.assertEqual(results, ['x' * 10] * 8)
+        self.assertEqual(calls.count('b'), 1)
+
+        # Бюджет 4 КБ: значения по ~1 КБ вытесняют самые старые
+        for i in range(6):
+            fetch(f'big{i}', size=1000)
+        stats = fetch.cache.snapshot()
+        self.assertLessEqual(stats['bytes'], 4096)
+        self.assertGreater(stats['evictions'], 0)
+        self.assertEqual(stats['negative_hits'], 1)
+        self.assertEqual(stats['misses'], len(calls))
+        self.assertIsNotNone(stats['load_avg_ms'])
+        self.assertIn('api.tests.CacheResultTest.test_keys_negative_budget_and_single_flight.<locals>.fetch',
+                      cache_result_stats())
@@ -8,11 +8,21 @@ from django.urls import path
 from .views.auth import LoginView, SchemaListView
 from .views.vehicles import VehicleListView, VehicleOnlineView
 # Убираем VehicleDetailView пока его нет
-from .views.analytics import AnalyticsTrackView
+from .views.analytics import (
+    AnalyticsTrackView, AnalyticsTrackLevelsView, AnalyticsBatchTrackView, AnalyticsConsumptionView,
+)
+from .views.reports import ReportListView
+from .views.events import FuelEventListView, FuelEventConfirmView
 
 # Импортируем старые views для обратной совместимости
 from .views.legacy import AutoGraphInitView, AutoGraphAnalyticsView
 
+# Асинхронные варианты (для запуска через ASGI)
+from .views.async_views import (
+    AsyncVehicleListView, AsyncVehicleOnlineView, AsyncAnalyticsTrackView,
+    AsyncAutoGraphInitView, AsyncAutoGraphAnalyticsView, VehicleOnlineStreamView,
+)
+
 urlpatterns = [
     # Новые endpoints (рекомендуемые)
     path('auth/login/', LoginView.as_view(), name='auth_login'),
@@ -20,8 +30,22 @@ urlpatterns = [
     path('vehicles/', VehicleListView.as_view(), name='vehicles_list'),
     path('vehicles/online/', VehicleOnlineView.as_view(), name='vehicles_online'),
     path('analytics/track/', AnalyticsTrackView.as_view(), name='analytics_track'),
+    path('analytics/track/levels/', AnalyticsTrackLevelsView.as_view(), name='analytics_track_levels'),
+    path('analytics/tracks/', AnalyticsBatchTrackView.as_view(), name='analytics_tracks_batch'),
+    path('analytics/consumption/', AnalyticsConsumptionView.as_view(), name='analytics_consumption'),
+    path('reports/', ReportListView.as_view(), name='reports'),
+    path('fuel-events/', FuelEventListView.as_view(), name='fuel_events'),
+    path('fuel-events/confirm/', FuelEventConfirmView.as_view(), name='fuel_events_confirm'),
 
     # Старые endpoints (для обратной совместимости)
     path('init-data/', AutoGraphInitView.as_view(), name='init_data'),
     path('analytics/', AutoGraphAnalyticsView.as_view(), name='analytics'),
+
+    # Асинхронные endpoints (ASGI)
+    path('async/vehicles/', AsyncVehicleListView.as_view(), name='async_vehicles_list'),
+    path('async/vehicles/online/', AsyncVehicleOnlineView.as_view(), name='async_vehicles_online'),
+    path('async/vehicles/online/stream/', VehicleOnlineStreamView.as_view(), name='async_vehicles_online_stream'),
+    path('async/analytics/track/', AsyncAnalyticsTrackView.as_view(), name='async_analytics_track'),
+    path('async/init-data/', AsyncAutoGraphInitView.as_view(), name='async_init_data'),
+    path('async/analytics/', AsyncAutoGraphAnalyticsView.as_view(), name='async_analytics'),
 ]
\ No newline at end of file
@@ -1,41 +1,241 @@
 """
 Утилиты для кэширования.
-Использует встроенный Django кэш (LocMemCache по умолчанию).
+Использует Django кэш (по умолчанию - двухуровневый TieredCache, см. tiered_cache.py).
+Теги записей: вид данных, схема, ТС (cache_tags); бэкенд без тегов их игнорирует.
+cache_result - отдельный кэш результатов функций в памяти процесса.
 """
 from django.core.cache import cache
+from collections import OrderedDict
 from functools import wraps
-import hashlib
+import asyncio
+import inspect
+import logging
+import pickle
+import threading
+import time
 
+from ..services.single_flight import single_flight
 
-def cache_result(timeout=300):
+logger = logging.getLogger(__name__)
+
+
+# Бюджет памяти одной функции под cache_result по умолчанию
+CACHE_RESULT_MAX_BYTES = 16 * 1024 * 1024
+
+_MISSING = object()
+
+# Кэши всех функций под cache_result по имени функции (для статистики)
+result_caches = {}
+
+
+class UncacheableArgument(TypeError):
+    """Аргумент, для которого нет устойчивого ключа кэша"""
+
+
+def canonical_value(value):
+    """
+    Устойчивое хэшируемое представление аргумента без сериализации:
+    словари - по отсортированным ключам, множества - отсортированные,
+    списки и кортежи - кортежи. Объект может задать свою часть ключа
+    методом cache_scope() (например, сервис - адрес апстрима).
+    """
+    if value is None or isinstance(value, (str, int, float, bool, bytes)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical_value(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), canonical_value(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((canonical_value(item) for item in value), key=repr))
+    scope = getattr(value, 'cache_scope', None)
+    if callable(scope):
+        return type(value).__qualname__, canonical_value(scope())
+    raise UncacheableArgument(type(value).__name__)
+
+
+class ResultCache:
+    """
+    Результаты одной функции в памяти процесса: LRU в пределах max_bytes.
+    Значения хранятся в pickle: размер известен точно, вызывающий получает копию.
+    """
+
+    def __init__(self, name, timeout, negative_timeout, max_bytes):
+        self.name = name
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # key -> (pickle, истекает, отрицательный)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {
+            'hits': 0, 'negative_hits': 0, 'misses': 0, 'errors': 0,
+            'evictions': 0, 'oversize': 0, 'bypass': 0,
+            'load_seconds': 0.0, 'load_max_seconds': 0.0,
+        }
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _MISSING
+            blob, expires, negative = entry
+            if expires <= time.monotonic():
+                self._pop(key)
+                return _MISSING
+            self.entries.move_to_end(key)
+            self.stats['negative_hits' if negative else 'hits'] += 1
+        return pickle.loads(blob)
+
+    def put(self, key, value, negative, load_seconds):
+        timeout = self.negative_timeout if negative else self.timeout
+        with self.lock:
+            self.stats['misses'] += 1
+            self.stats['load_seconds'] += load_seconds
+            self.stats['load_max_seconds'] = max(self.stats['load_max_seconds'], load_seconds)
+        if not timeout:
+            return
+        try:
+            blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            self.count('bypass')
+            return
+        with self.lock:
+            # Одно значение не может занять больше четверти бюджета
+            if len(blob) > self.max_bytes // 4:
+                self.stats['oversize'] += 1
+                return
+            self._pop(key)
+            self.entries[key] = (blob, time.monotonic() + timeout, negative)
+            self.size += len(blob)
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def snapshot(self):
+        """Счетчики и заполненность для мониторинга"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update(entries=len(self.entries), bytes=self.size, max_bytes=self.max_bytes)
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['negative_hits']) / lookups, 3) if lookups else None
+        stats['load_avg_ms'] = round(stats['load_seconds'] / stats['misses'] * 1000, 1) if stats['misses'] else None
+        return stats
+
+
+def cache_result_stats():
+    """{имя функции: счетчики} по всем функциям под cache_result"""
+    return {name: store.snapshot() for name, store in result_caches.items()}
+
+
+def cache_result(timeout=300, negative_timeout=None, max_bytes=CACHE_RESULT_MAX_BYTES, is_negative=None):
     """
-    Декоратор для кэширования результатов функций.
+    Декоратор для кэширования результатов функций в памяти процесса.
+
+    - ключ - имя функции и канонические значения аргументов (canonical_value)
+      после привязки к сигнатуре: f(a, b=1) и f(a, 1) - один ключ;
+      с аргументом без устойчивого ключа функция вызывается без кэша;
+    - отрицательный результат (по умолчанию - пустой: None, [], {}, '')
+      кэшируется на negative_timeout секунд (None - не кэшируется),
+      чтобы пустой ответ апстрима не запрашивался на каждый вызов;
+    - у каждой функции свой бюджет max_bytes, сверх него вытесняются
+      давно не читанные записи;
+    - одновременные промахи с одним ключом выполняют функцию один раз
+      (single_flight), ожидающие получают тот же объект - менять его нельзя;
+    - исключения не кэшируются;
+    - счетчики: func.cache.snapshot() или cache_result_stats().
 
     Пример использования:
-    @cache_result(timeout=60)
+    @cache_result(timeout=60, negative_timeout=10)
     def get_vehicles(session_id, schema_id):
         # ...
     """
+    is_negative = is_negative or (lambda result: not result)
 
     def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            # Создаем уникальный ключ кэша
-            cache_key = f"{func.__module__}.{func.__name__}:{hashlib.md5(str(args).encode() + str(kwargs).encode()).hexdigest()}"
+        name = f"{func.__module__}.{func.__qualname__}"
+        signature = inspect.signature(func)
+        store = result_caches[name] = ResultCache(name, timeout, negative_timeout, max_bytes)
 
-            # Проверяем кэш
-            cached = cache.get(cache_key)
-            if cached is not None:
-                return cached
+        def make_key(args, kwargs):
+            try:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                return (name,) + tuple(canonical_value(value) for value in bound.arguments.values())
+            except UncacheableArgument as e:
+                logger.debug(f"{name}: argument {e} is not cacheable, calling without cache")
+                store.count('bypass')
+                return None
 
-            # Выполняем функцию
-            result = func(*args, **kwargs)
+        def remember(key, started, result):
+            store.put(key, result, is_negative(result), time.perf_counter() - started)
+            return result
 
-            # Сохраняем в кэш
-            cache.set(cache_key, result, timeout)
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                key = make_key(args, kwargs)
+                if key is None:
+                    return await func(*args, **kwargs)
+                value = store.get(key)
+                if value is not _MISSING:
+                    return value
 
-            return result
+                async def load():
+                    value = store.get(key)
+                    if value is not _MISSING:
+                        return value
+                    started = time.perf_counter()
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception:
+                        store.count('errors')
+                        raise
+                    return remember(key, started, result)
+
+                return await single_flight.ado(key, load)
+
+            async_wrapper.cache = store
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            if key is None:
+                return func(*args, **kwargs)
+            value = store.get(key)
+            if value is not _MISSING:
+                return value
+
+            def load():
+                # Пока ждали очереди, результат мог положить предыдущий вызов
+                value = store.get(key)
+                if value is not _MISSING:
+                    return value
+                started = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception:
+                    store.count('errors')
+                    raise
+                return remember(key, started, result)
 
+            return single_flight.do(key, load)
+
+        wrapper.cache = store
         return wrapper
 
     return decorator
@@ -47,9 +247,139 @@ def get_cache_key(prefix, *args):
     return f"{':'.join(parts)}"
 
 
+def cache_tags(kind=None, schema_id=None, device_id=None):
+    """Теги записи: 'kind:track', 'schema:123', 'device:456'"""
+    tags = []
+    if kind:
+        tags.append(f'kind:{kind}')
+    if schema_id is not None:
+        tags.append(f'schema:{schema_id}')
+    if device_id is not None:
+        tags.append(f'device:{device_id}')
+    return tags
+
+
+def _supports_tags():
+    return getattr(cache, 'supports_tags', False)
+
+
+def set_tagged(cache_key, value, timeout, tags=()):
+    """cache.set с тегами"""
+    if tags and _supports_tags():
+        cache.set(cache_key, value, timeout, tags=tags)
+    else:
+        cache.set(cache_key, value, timeout)
+
+
+async def aset_tagged(cache_key, value, timeout, tags=()):
+    if tags and _supports_tags():
+        await cache.aset(cache_key, value, timeout, tags=tags)
+    else:
+        await cache.aset(cache_key, value, timeout)
+
+
+def get_fresh(cache_key, default=None):
+    """
+    Чтение последнего записанного значения - для изменений под блокировкой в кэше.
+    У TieredCache обычный get может отдать копию из LRU процесса на SYNC_INTERVAL старше.
+    """
+    if hasattr(cache, 'get_fresh'):
+        return cache.get_fresh(cache_key, default)
+    return cache.get(cache_key, default)
+
+
+def invalidate_tags(*tags):
+    """
+    Удаление записей с любым из тегов (во всех процессах).
+    Бэкенд без тегов может сбросить только весь кэш.
+    """
+    if not tags:
+        return
+    if _supports_tags():
+        count = cache.invalidate_tags(tags)
+        logger.info(f"Cache invalidated by tags {list(tags)}: {count} entries")
+    else:
+        cache.clear()
+
+
+def _swr_lookup(entry, fresh):
+    """(значение, нужно ли обновить в фоне); None - записи нет или она за жестким пределом"""
+    if entry is None:
+        return None, False
+    return entry['value'], time.time() - entry['stored_at'] >= fresh
+
+
+def _swr_store(cache_key, value, max_stale, tags=()):
+    if value is not None:
+        set_tagged(cache_key, {'value': value, 'stored_at': time.time()}, max_stale, tags)
+
+
+async def _aswr_store(cache_key, value, max_stale, tags=()):
+    if value is not None:
+        await aset_tagged(cache_key, {'value': value, 'stored_at': time.time()}, max_stale, tags)
+
+
+def get_stale_while_revalidate(cache_key, fetch, fresh=30, max_stale=300, tags=()):
+    """
+    Кэш stale-while-revalidate.
+    - моложе fresh секунд - отдаем из кэша;
+    - от fresh до max_stale - отдаем из кэша и запускаем ровно одно фоновое
+      обновление (блокировка через cache.add, поэтому одно и на несколько процессов);
+    - старше max_stale (запись истекла) - ждем fetch().
+    fetch() возвращает None, если кэшировать нечего (ошибка/пустой ответ).
+    tags - теги записи (cache_tags).
+    """
+    value, refresh = _swr_lookup(cache.get(cache_key), fresh)
+    if value is None:
+        value = fetch()
+        _swr_store(cache_key, value, max_stale, tags)
+        return value
+
+    if refresh and cache.add(f'{cache_key}:refreshing', 1, timeout=max_stale):
+        def run():
+            try:
+                _swr_store(cache_key, fetch(), max_stale, tags)
+            except Exception as e:
+                logger.error(f"Background refresh of {cache_key} failed: {e}")
+            finally:
+                cache.delete(f'{cache_key}:refreshing')
+
+        threading.Thread(target=run, name=f'swr-{cache_key}', daemon=True).start()
+    return value
+
+
+# Фоновые задачи обновления; ссылки держим, чтобы задачи не собрал GC
+_swr_tasks = set()
+
+
+async def aget_stale_while_revalidate(cache_key, fetch, fresh=30, max_stale=300, tags=()):
+    """Асинхронный вариант: fetch - корутинная функция, обновление - задача в event loop"""
+    value, refresh = _swr_lookup(await cache.aget(cache_key), fresh)
+    if value is None:
+        value = await fetch()
+        await _aswr_store(cache_key, value, max_stale, tags)
+        return value
+
+    if refresh and await cache.aadd(f'{cache_key}:refreshing', 1, timeout=max_stale):
+        async def run():
+            try:
+                await _aswr_store(cache_key, await fetch(), max_stale, tags)
+            except Exception as e:
+                logger.error(f"Background refresh of {cache_key} failed: {e}")
+            finally:
+                await cache.adelete(f'{cache_key}:refreshing')
+
+        task = asyncio.ensure_future(run())
+        _swr_tasks.add(task)
+        task.add_done_callback(_swr_tasks.discard)
+    return value
+
+
 def clear_cache_pattern(pattern):
     """
-    Очистка кэша по паттерну.
-    Внимание: для LocMemCache очищает весь кэш!
+    Очистка кэша по шаблону ключа (glob: 'track:123:*').
+    Бэкенд без delete_pattern (например, LocMemCache) очищает весь кэш.
     """
+    if hasattr(cache, 'delete_pattern'):
+        return cache.delete_pattern(pattern)
     cache.clear()
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""
+Условные GET-запросы (ETag / If-None-Match).
+
+ETag - хэш содержимого ответа: повторный опрос без изменений получает 304
+без тела. Cache-Control: no-cache заставляет браузер перепроверять ответ
+каждый раз, If-None-Match он подставляет сам.
+"""
+import hashlib
+import json
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+
+def content_etag(data):
+    """ETag по содержимому ответа (не зависит от порядка ключей)"""
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str, separators=(',', ':'))
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def conditional_response(request, data, etag=None, response_class=Response):
+    """
+    Ответ с ETag; 304 Not Modified, если у клиента та же версия.
+    response_class - Response (DRF) или JsonResponse для обычных views.
+    """
+    etag = etag or content_etag(data)
+    response = get_conditional_response(request, etag=etag) or response_class(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
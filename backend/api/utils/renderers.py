@@ -0,0 +1,45 @@
+"""
+DRF-рендереры для ответов с треком.
+View отдает {'columns': TrackColumns, ...}, рендерер выбирается
+content negotiation (?format= или Accept) и кодирует колонки сам.
+Обычные dict (ошибки) рендерятся как обычно.
+"""
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from ..services.track_formats import (
+    COLUMNAR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, encode_track_payload, is_track_payload,
+)
+
+
+class TrackJSONRenderer(JSONRenderer):
+    """Список точек (прежний формат)"""
+    track_format = 'json'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if is_track_payload(data):
+            return encode_track_payload(data, self.track_format)[0]
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class TrackColumnarRenderer(TrackJSONRenderer):
+    """Параллельные массивы в JSON"""
+    media_type = COLUMNAR_MEDIA_TYPE
+    format = 'columnar'
+    track_format = 'columnar'
+
+
+class TrackMsgpackRenderer(BaseRenderer):
+    """MessagePack с типизированными массивами"""
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if is_track_payload(data):
+            return encode_track_payload(data, 'msgpack')[0]
+        return msgpack.packb(data, use_bin_type=True)
+
+
+TRACK_RENDERERS = [TrackJSONRenderer, TrackColumnarRenderer, TrackMsgpackRenderer]
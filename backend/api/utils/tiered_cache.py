@@ -0,0 +1,374 @@
+"""
+Двухуровневый кэш Django: LRU в памяти процесса перед общим кэшем в SQLite.
+
+- Первый уровень - ограниченный по числу записей и байтам LRU в процессе:
+  горячие треки и снимки не ходят даже в SQLite.
+- Второй уровень - файл SQLite, общий для всех процессов (воркеры gunicorn/uvicorn,
+  поллер онлайн-данных, management-команды): процесс не начинает с холодного кэша.
+- Записи несут теги (вид данных, схема, ТС); invalidate_tags удаляет только
+  записи с этими тегами, delete_pattern - по шаблону ключа (glob).
+
+Записи, измененные или удаленные другим процессом, попадают в журнал
+cache_changes; процесс просматривает его не чаще раза в SYNC_INTERVAL секунд
+и выкидывает эти ключи из своего LRU. Журнал хранится CHANGES_TTL секунд:
+процесс, отставший сильнее, сбрасывает свой LRU целиком.
+Кроме того, запись живет в памяти не дольше LOCAL_TIMEOUT секунд.
+
+Значения хранятся в pickle и в памяти тоже: get всегда отдает копию,
+как LocMemCache.
+
+CACHES = {'default': {
+    'BACKEND': 'api.utils.tiered_cache.TieredCache',
+    'LOCATION': '/path/to/cache.sqlite3',
+    'OPTIONS': {'LOCAL_MAX_ENTRIES': 1000, 'LOCAL_MAX_BYTES': 64 * 1024 * 1024},
+}}
+"""
+import fnmatch
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+DEFAULT_OPTIONS = {
+    'LOCAL_MAX_ENTRIES': 1000,
+    'LOCAL_MAX_BYTES': 64 * 1024 * 1024,
+    'LOCAL_TIMEOUT': 60,            # Дольше запись в памяти процесса не живет
+    'SYNC_INTERVAL': 0.5,           # Как часто смотреть журнал изменений других процессов
+    'CHANGES_TTL': 300,             # Сколько хранится журнал изменений
+    'CULL_INTERVAL': 60,            # Как часто удалять истекшие записи из SQLite
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    tags TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS cache_tags (
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (tag, key)
+);
+CREATE INDEX IF NOT EXISTS cache_tags_key ON cache_tags (key);
+CREATE TABLE IF NOT EXISTS cache_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    key TEXT,
+    at REAL NOT NULL
+);
+"""
+
+# Запись в журнале без ключа - сброс всего кэша
+CLEAR_ALL = None
+
+
+class LocalLRU:
+    """LRU в памяти процесса: key -> (pickle, истекает, теги), с индексом по тегам."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.by_tag = {}
+        self.size = 0
+
+    def get(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            self.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, blob, expires, tags=()):
+        self.pop(key)
+        # Слишком большое значение не вытесняет из памяти все остальное
+        if len(blob) > self.max_bytes // 4:
+            return
+        self.entries[key] = (blob, expires, tuple(tags))
+        self.size += len(blob)
+        for tag in tags:
+            self.by_tag.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self.pop(next(iter(self.entries)))
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry[0])
+        for tag in entry[2]:
+            keys = self.by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_tag[tag]
+
+    def pop_tag(self, tag):
+        for key in list(self.by_tag.get(tag, ())):
+            self.pop(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.by_tag.clear()
+        self.size = 0
+
+
+class TieredCache(BaseCache):
+    """Бэкенд кэша Django: LocalLRU + SQLite. Поддерживает теги (supports_tags)."""
+
+    supports_tags = True
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = {**DEFAULT_OPTIONS, **params.get('OPTIONS', {})}
+        self.path = location
+        self.local_timeout = options['LOCAL_TIMEOUT']
+        self.sync_interval = options['SYNC_INTERVAL']
+        self.changes_ttl = options['CHANGES_TTL']
+        self.cull_interval = options['CULL_INTERVAL']
+        self.origin = f'{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+        self._local = LocalLRU(options['LOCAL_MAX_ENTRIES'], options['LOCAL_MAX_BYTES'])
+        self._lock = threading.RLock()
+        self._connections = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._last_change = 0
+        self._synced_at = 0.0
+        self._culled_at = time.monotonic()
+
+    # --- SQLite ---
+
+    def _connect(self):
+        conn = getattr(self._connections, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            if not self._initialized:
+                with self._init_lock:
+                    if not self._initialized:
+                        conn.execute('PRAGMA journal_mode=WAL')
+                        conn.executescript(SCHEMA)
+                        # Изменения, сделанные до запуска процесса, его LRU не касаются
+                        self._last_change = conn.execute(
+                            'SELECT COALESCE(MAX(id), 0) FROM cache_changes'
+                        ).fetchone()[0]
+                        self._initialized = True
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._connections.conn = conn
+        return conn
+
+    def _write(self, func):
+        """func(conn, now) в транзакции записи"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(conn, time.time())
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def _log_changes(self, conn, keys, now):
+        conn.executemany(
+            'INSERT INTO cache_changes (origin, key, at) VALUES (?, ?, ?)',
+            [(self.origin, key, now) for key in keys],
+        )
+
+    def _store(self, conn, key, blob, expires, tags, now):
+        conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, expires, tags) VALUES (?, ?, ?, ?)',
+                     (key, blob, expires, '\n'.join(tags)))
+        conn.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+        conn.executemany('INSERT INTO cache_tags (tag, key) VALUES (?, ?)', [(tag, key) for tag in tags])
+        self._log_changes(conn, [key], now)
+
+    def _remove(self, conn, keys, now):
+        conn.executemany('DELETE FROM cache_entries WHERE key = ?', [(key,) for key in keys])
+        conn.executemany('DELETE FROM cache_tags WHERE key = ?', [(key,) for key in keys])
+        self._log_changes(conn, keys, now)
+
+    # --- согласование с другими процессами ---
+
+    def _sync(self):
+        """Выкинуть из LRU ключи, измененные другими процессами с прошлой проверки"""
+        now = time.monotonic()
+        if now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        conn = self._connect()
+        rows = conn.execute(
+            'SELECT id, origin, key FROM cache_changes WHERE id > ? ORDER BY id', (self._last_change,)
+        ).fetchall()
+        oldest = conn.execute('SELECT MIN(id) FROM cache_changes').fetchone()[0]
+        with self._lock:
+            if oldest is not None and oldest > self._last_change + 1:
+                # Часть журнала уже удалена - что изменилось, неизвестно
+                self._local.clear()
+            else:
+                for _, origin, key in rows:
+                    if origin == self.origin:
+                        continue
+                    if key is CLEAR_ALL:
+                        self._local.clear()
+                    else:
+                        self._local.pop(key)
+            if rows:
+                self._last_change = rows[-1][0]
+
+        if now - self._culled_at >= self.cull_interval:
+            self._culled_at = now
+            self._cull()
+
+    def _cull(self):
+        def cull(conn, now):
+            expired = [key for (key,) in conn.execute(
+                'SELECT key FROM cache_entries WHERE expires IS NOT NULL AND expires <= ?', (now,)
+            )]
+            conn.executemany('DELETE FROM cache_entries WHERE key = ?', [(key,) for key in expired])
+            conn.executemany('DELETE FROM cache_tags WHERE key = ?', [(key,) for key in expired])
+            conn.execute('DELETE FROM cache_changes WHERE at < ?', (now - self.changes_ttl,))
+        self._write(cull)
+
+    def _local_expires(self, expires):
+        local = time.time() + self.local_timeout
+        return local if expires is None else min(expires, local)
+
+    # --- API BaseCache ---
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._sync()
+        now = time.time()
+        with self._lock:
+            blob = self._local.get(key, now)
+        if blob is None:
+            row = self._connect().execute(
+                'SELECT value, expires, tags FROM cache_entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                return default
+            blob, expires, tags = row
+            with self._lock:
+                self._local.put(key, blob, self._local_expires(expires), tags.split('\n') if tags else ())
+        return pickle.loads(blob)
+
+    def get_fresh(self, key, default=None, version=None):
+        """get мимо LRU процесса: значение из SQLite, даже если журнал еще не просмотрен"""
+        with self._lock:
+            self._local.pop(self.make_and_validate_key(key, version=version))
+        return self.get(key, default, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=()):
+        key = self.make_and_validate_key(key, version=version)
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self.get_backend_timeout(timeout)
+        self._write(lambda conn, now: self._store(conn, key, blob, expires, tags, now))
+        with self._lock:
+            self._local.put(key, blob, self._local_expires(expires), tags)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=()):
+        """Атомарно для всех процессов: решает общая запись в SQLite"""
+        key = self.make_and_validate_key(key, version=version)
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self.get_backend_timeout(timeout)
+
+        def add(conn, now):
+            row = conn.execute('SELECT expires FROM cache_entries WHERE key = ?', (key,)).fetchone()
+            if row is not None and (row[0] is None or row[0] > now):
+                return False
+            self._store(conn, key, blob, expires, tags, now)
+            return True
+
+        added = self._write(add)
+        if added:
+            with self._lock:
+                self._local.put(key, blob, self._local_expires(expires), tags)
+        return added
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=()):
+        return await sync_to_async(self.set, thread_sensitive=True)(key, value, timeout, version, tags)
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=()):
+        return await sync_to_async(self.add, thread_sensitive=True)(key, value, timeout, version, tags)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        expires = self.get_backend_timeout(timeout)
+
+        def touch(conn, now):
+            cursor = conn.execute(
+                'UPDATE cache_entries SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (expires, key, now),
+            )
+            self._log_changes(conn, [key], now)
+            return cursor.rowcount > 0
+
+        with self._lock:
+            self._local.pop(key)
+        return self._write(touch)
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+
+        def delete(conn, now):
+            existed = conn.execute('SELECT 1 FROM cache_entries WHERE key = ?', (key,)).fetchone() is not None
+            self._remove(conn, [key], now)
+            return existed
+
+        with self._lock:
+            self._local.pop(key)
+        return self._write(delete)
+
+    def clear(self):
+        def clear(conn, now):
+            conn.execute('DELETE FROM cache_entries')
+            conn.execute('DELETE FROM cache_tags')
+            self._log_changes(conn, [CLEAR_ALL], now)
+
+        self._write(clear)
+        with self._lock:
+            self._local.clear()
+
+    # --- теги и шаблоны ---
+
+    def invalidate_tags(self, tags):
+        """Удаление всех записей хотя бы с одним из тегов; возвращает их число"""
+        tags = list(tags)
+
+        def invalidate(conn, now):
+            keys = set()
+            for tag in tags:
+                keys.update(key for (key,) in conn.execute('SELECT key FROM cache_tags WHERE tag = ?', (tag,)))
+            self._remove(conn, sorted(keys), now)
+            return len(keys)
+
+        count = self._write(invalidate)
+        with self._lock:
+            for tag in tags:
+                self._local.pop_tag(tag)
+        return count
+
+    def delete_pattern(self, pattern, version=None):
+        """Удаление записей, ключ которых подходит под glob-шаблон ('track:42:*')"""
+        pattern = self.make_key(pattern, version=version)
+
+        def delete(conn, now):
+            keys = [key for (key,) in conn.execute('SELECT key FROM cache_entries WHERE key GLOB ?', (pattern,))]
+            self._remove(conn, keys, now)
+            return len(keys)
+
+        count = self._write(delete)
+        with self._lock:
+            for key in [key for key in self._local.entries if fnmatch.fnmatchcase(key, pattern)]:
+                self._local.pop(key)
+        return count
@@ -4,8 +4,16 @@
 # Экспортируем все views для удобного импорта
 from .auth import LoginView, SchemaListView
 from .vehicles import VehicleListView, VehicleOnlineView
-from .analytics import AnalyticsTrackView
+from .analytics import (
+    AnalyticsTrackView, AnalyticsTrackLevelsView, AnalyticsBatchTrackView, AnalyticsConsumptionView,
+)
+from .reports import ReportListView
+from .events import FuelEventListView, FuelEventConfirmView
 from .legacy import AutoGraphInitView, AutoGraphAnalyticsView
+from .async_views import (
+    AsyncVehicleListView, AsyncVehicleOnlineView, AsyncAnalyticsTrackView,
+    AsyncAutoGraphInitView, AsyncAutoGraphAnalyticsView, VehicleOnlineStreamView,
+)
 
 __all__ = [
     'LoginView',
@@ -13,6 +21,18 @@ __all__ = [
     'VehicleListView',
     'VehicleOnlineView',
     'AnalyticsTrackView',
+    'AnalyticsTrackLevelsView',
+    'AnalyticsBatchTrackView',
+    'AnalyticsConsumptionView',
+    'ReportListView',
+    'FuelEventListView',
+    'FuelEventConfirmView',
     'AutoGraphInitView',
     'AutoGraphAnalyticsView',
+    'AsyncVehicleListView',
+    'AsyncVehicleOnlineView',
+    'AsyncAnalyticsTrackView',
+    'AsyncAutoGraphInitView',
+    'AsyncAutoGraphAnalyticsView',
+    'VehicleOnlineStreamView',
 ]
\ No newline at end of file
@@ -2,26 +2,132 @@
 Views для аналитики и графиков.
 """
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.core.cache import cache
+from django.http import StreamingHttpResponse
 
 from ..services.autograph import AutoGraphService
-from ..utils.cache import get_cache_key
+from ..services.calibration import compile_tables, extract_taring_tables
+from ..services.track import (
+    TrackColumns, autograph_to_epoch, extract_segments, iter_track_columns, iter_track_response,
+)
+from ..services.downsampling import downsample_track
+from ..services.telemetry_store import telemetry_store
+from ..services.device_registry import device_registry
+from ..services.fuel_events import analyze_track, load_device_track, vehicle_rates
+from ..services.track_pyramid import buckets_payload, track_pyramid
+from ..models import Vehicle
+from ..utils.cache import cache_tags, get_cache_key, set_tagged
+from ..utils.renderers import TRACK_RENDERERS
 
 logger = logging.getLogger(__name__)
 service = AutoGraphService()
 
+# Меньше этого LTTB не имеет смысла: скорость и топливо делят бюджет пополам
+MIN_MAX_POINTS = 10
+
+# Ограничение на число ТС в одном пакетном запросе треков
+BATCH_MAX_DEVICES = 500
+
+# Корзин в ответе уровней трека: по умолчанию и максимум
+LEVELS_DEFAULT_POINTS = 1000
+LEVELS_MAX_POINTS = 20000
+
+
+def format_autograph_date(date_str):
+    """
+    Форматирование даты для AutoGRAPH API: YYYYMMDD-HHMM.
+    Пример: "2026-01-17 09:56:50" -> "20260117-0956"
+    """
+    cleaned = date_str.replace('-', '').replace(':', '').replace(' ', '')
+    return f"{cleaned[:8]}-{cleaned[8:12]}"
+
+
+def parse_max_points(value):
+    """Разбор параметра max_points: None - без прореживания"""
+    if value in (None, ''):
+        return None
+    max_points = int(value)
+    if max_points < MIN_MAX_POINTS:
+        raise ValueError(f'max_points must be at least {MIN_MAX_POINTS}')
+    return max_points
+
+
+def build_track_columns(raw_track, device_id, taring_tables):
+    """Преобразование сырого трека в колонки для графиков"""
+    track_segments = extract_segments(raw_track, device_id)
+    logger.info(f"Track segments count: {len(track_segments)}")
+
+    # Таблицы тарировок компилируются один раз на датчик
+    calibrations = compile_tables(device_id, taring_tables)
+    return TrackColumns.from_segments(track_segments, calibrations)
+
+
+def track_cache_key(schema_id, device_id, vehicle_hash, from_formatted, to_formatted):
+    """
+    Ключ кэша трека. Общий для всех сессий схемы (доступ проверяет реестр ТС),
+    включает хэш Properties ТС - смена тарировок дает новый ключ.
+    """
+    return get_cache_key('track', schema_id, device_id, vehicle_hash, from_formatted, to_formatted)
+
+
+def load_track_columns(session_id, schema_id, devices, device_id, from_formatted, to_formatted):
+    """
+    Колонки трека одного ТС: из кэша либо из хранилища + AutoGRAPH.
+    devices - SchemaDevices из реестра. Возвращает (columns, partial);
+    неполный трек не кэшируется.
+    """
+    vehicle = devices.get(device_id)
+    cache_key = track_cache_key(schema_id, device_id, devices.hashes[device_id], from_formatted, to_formatted)
+    columns = cache.get(cache_key)
+    if columns is not None:
+        return columns, False
+
+    result = telemetry_store.get_track(service, session_id, schema_id, device_id, from_formatted, to_formatted)
+    columns = build_track_columns(result.segments, device_id, extract_taring_tables(vehicle))
+    if not result.partial:
+        set_tagged(cache_key, columns, 600, cache_tags('track', schema_id, device_id))
+    return columns, result.partial
+
+
+def parse_device_ids(value):
+    """Список ID из 'id1,id2,...' или списка; дубликаты убираются"""
+    if isinstance(value, str):
+        value = value.split(',')
+    ids = [str(item).strip() for item in (value or [])]
+    return list(dict.fromkeys(item for item in ids if item))
+
+
+def build_track_points(raw_track, device_id, taring_tables):
+    """Преобразование сырого трека в список точек для графиков"""
+    return build_track_columns(raw_track, device_id, taring_tables).to_points()
+
 
 @method_decorator(csrf_exempt, name='dispatch')
 class AnalyticsTrackView(APIView):
     """
     Получение данных трека для построения графиков.
     GET /api/analytics/track/?session=<session>&schema_id=<schema_id>&device_id=<device_id>&from=<date>&to=<date>
+
+    Необязательный max_points=<N> прореживает трек (LTTB) для графиков.
+    Кэшируется полный трек, прореживание делается на каждый запрос.
+
+    Формат ответа (?format= или Accept): json (список точек), columnar
+    (параллельные массивы), msgpack (типизированные массивы).
+
+    stream=1 отдает json по частям, не собирая трек целиком в памяти
+    (без max_points; потоковый ответ не кэшируется).
+
+    Длинный период качается из AutoGRAPH частями параллельно; если часть
+    получить не удалось, в ответе partial=true и трек не кэшируется.
     """
+    renderer_classes = TRACK_RENDERERS
 
     def get(self, request):
         # Получаем параметры напрямую
@@ -44,12 +150,21 @@ class AnalyticsTrackView(APIView):
         if not date_to:
             errors['to'] = ['This field is required.']
 
+        try:
+            max_points = parse_max_points(request.GET.get('max_points'))
+        except ValueError:
+            errors['max_points'] = [f'A valid integer >= {MIN_MAX_POINTS} is required.']
+
         if errors:
             return Response({
                 'error': 'Invalid parameters',
                 'details': errors
             }, status=status.HTTP_400_BAD_REQUEST)
 
+        # Потоковый режим только для списка точек и без прореживания
+        stream = (request.GET.get('stream') in ('1', 'true') and not max_points
+                  and request.accepted_renderer.format == 'json')
+
         if date_from >= date_to:
             return Response({
                 'error': 'Invalid parameters',
@@ -58,13 +173,8 @@ class AnalyticsTrackView(APIView):
 
         # Форматируем даты для AutoGRAPH API: YYYYMMDD-HHMM
         try:
-            # Пример: "2026-01-17 09:56:50" -> "20260117-0956"
-            from_clean = date_from.replace('-', '').replace(':', '').replace(' ', '')
-            to_clean = date_to.replace('-', '').replace(':', '').replace(' ', '')
-
-            # Формат: YYYYMMDD-HHMM
-            from_formatted = f"{from_clean[:8]}-{from_clean[8:12]}"
-            to_formatted = f"{to_clean[:8]}-{to_clean[8:12]}"
+            from_formatted = format_autograph_date(date_from)
+            to_formatted = format_autograph_date(date_to)
 
             logger.info(f"Formatted dates: from={from_formatted}, to={to_formatted}")
 
@@ -74,32 +184,10 @@ class AnalyticsTrackView(APIView):
                 'error': f'Invalid date format: {str(e)}'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Ключ для кэша
-        cache_key = get_cache_key('track', session_id, schema_id, device_id, from_formatted, to_formatted)
-        cached_data = cache.get(cache_key)
-
-        if cached_data:
-            logger.debug(f"Returning cached track data for device {device_id}")
-            return Response(cached_data)
-
         try:
-            # 1. Получаем свойства транспортного средства для тарировок ДУТ
-            vehicles_response = service.get_vehicles_by_schema(session_id, schema_id)
-
-            # Определяем структуру ответа
-            if isinstance(vehicles_response, dict):
-                vehicles = vehicles_response.get('Items', [])
-            elif isinstance(vehicles_response, list):
-                vehicles = vehicles_response
-            else:
-                vehicles = []
-
-            # Ищем нужное транспортное средство
-            vehicle = None
-            for v in vehicles:
-                if str(v.get('ID')) == device_id:
-                    vehicle = v
-                    break
+            # 1. Свойства транспортного средства (тарировки ДУТ) из реестра ТС схемы
+            devices = device_registry.get(session_id, schema_id, service)
+            vehicle = devices.get(device_id)
 
             if not vehicle:
                 return Response({
@@ -107,28 +195,43 @@ class AnalyticsTrackView(APIView):
                     'message': f"Device with ID {device_id} not found"
                 }, status=status.HTTP_404_NOT_FOUND)
 
+            # Ключ для кэша
+            cache_key = track_cache_key(schema_id, device_id, devices.hashes[device_id],
+                                        from_formatted, to_formatted)
+            columns = cache.get(cache_key)
+
+            if columns is not None:
+                logger.debug(f"Returning cached track data for device {device_id}")
+                if stream:
+                    return self.stream_response(columns.iter_chunks(), device_id, date_from, date_to)
+                return self.track_response(columns, device_id, date_from, date_to, max_points)
+
             # 2. Извлекаем таблицы тарировок ДУТ
-            taring_tables = {}
-            for prop in vehicle.get('Properties', []):
-                name = prop.get('Name', '')
-                if 'LLS' in name and isinstance(prop.get('Value'), dict):
-                    table = prop['Value'].get('items', [])
-                    if table:
-                        taring_tables[name] = table
-
-            # 3. Получаем данные трека
-            raw_track = service.get_track_data(
+            taring_tables = extract_taring_tables(vehicle)
+
+            # 3. Получаем данные трека: из локального хранилища + докачка недостающего
+            if stream:
+                # Сохраненные сутки читаются по одним и отпускаются после отправки;
+                # ссылок на сегменты у view не остается
+                result = telemetry_store.iter_track(
+                    service, session_id, schema_id, device_id, from_formatted, to_formatted
+                )
+                chunks = iter_track_columns(result.segments, compile_tables(device_id, taring_tables))
+                partial = result.partial
+                del result
+                return self.stream_response(chunks, device_id, date_from, date_to, partial)
+
+            result = telemetry_store.get_track(
+                service,
                 session_id,
                 schema_id,
                 device_id,
                 from_formatted,
                 to_formatted
             )
+            raw_track = result.segments
 
-            # 4. Обрабатываем данные трека
-            points = []
-
-            logger.info(f"Track data received, type: {type(raw_track)}")
+            logger.info(f"Track segments received: {len(raw_track)}, partial: {result.partial}")
 
             if not raw_track:
                 return Response({
@@ -136,71 +239,19 @@ class AnalyticsTrackView(APIView):
                     'points': [],
                     'count': 0,
                     'message': 'No track data available',
-                    'device_id': device_id
+                    'device_id': device_id,
+                    'partial': result.partial,
                 })
 
-            # Структура ответа может быть разной
-            if isinstance(raw_track, dict):
-                # Формат: {device_id: [segments]}
-                track_segments = raw_track.get(device_id, [])
-            elif isinstance(raw_track, list):
-                # Формат: [segments]
-                track_segments = raw_track
-            else:
-                track_segments = []
-
-            logger.info(f"Track segments count: {len(track_segments)}")
-
-            for segment in track_segments:
-                if not isinstance(segment, dict):
-                    continue
-
-                dt_array = segment.get('DT', [])
-                speed_array = segment.get('Speed', [])
-
-                # Создаем точки для каждой записи в массивах
-                for i in range(min(len(dt_array), len(speed_array))):
-                    point = {
-                        't': dt_array[i],
-                        's': speed_array[i],
-                    }
-
-                    # Добавляем координаты если есть
-                    lat_array = segment.get('Lat', [])
-                    lng_array = segment.get('Lng', [])
-                    if i < len(lat_array) and i < len(lng_array):
-                        point['lat'] = lat_array[i]
-                        point['lng'] = lng_array[i]
-
-                    # Расчет топлива
-                    fuel_val = 0.0
-                    for sensor_name, table in taring_tables.items():
-                        sensor_array = segment.get(sensor_name)
-                        if sensor_array and i < len(sensor_array):
-                            raw_value = sensor_array[i]
-                            if raw_value is not None:
-                                fuel_val += service.interpolate_fuel(raw_value, table)
-
-                    point['f'] = round(fuel_val, 1) if fuel_val > 0 else 0.0
-
-                    points.append(point)
-
-            # 5. Формируем ответ
-            response_data = {
-                'success': True,
-                'points': points,
-                'count': len(points),
-                'device_id': device_id,
-                'period': {
-                    'from': date_from,
-                    'to': date_to
-                }
-            }
+            # 4. Обрабатываем данные трека
+            columns = build_track_columns(raw_track, device_id, taring_tables)
 
-            # 6. Кэшируем на 10 минут
-            cache.set(cache_key, response_data, timeout=600)
+            # 5. Кэшируем колонки на 10 минут (компактнее списка точек);
+            # неполный трек не кэшируем, чтобы следующий запрос докачал пропуски
+            if not result.partial:
+                set_tagged(cache_key, columns, 600, cache_tags('track', schema_id, device_id))
 
-            return Response(response_data)
+            return self.track_response(columns, device_id, date_from, date_to, max_points, result.partial)
 
         except Exception as e:
             logger.error(f"Error fetching track data for device {device_id}: {e}")
@@ -209,4 +260,337 @@ class AnalyticsTrackView(APIView):
 
             return Response({
                 'error': f'Failed to fetch track data: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    def track_payload(columns, device_id, date_from, date_to, max_points=None, partial=False):
+        """
+        Данные ответа с треком; точки кодирует выбранный рендерер.
+        partial=True - часть периода не удалось получить из AutoGRAPH.
+        """
+        payload = {
+            'columns': columns,
+            'device_id': device_id,
+            'period': {'from': date_from, 'to': date_to},
+        }
+        if partial:
+            payload['partial'] = True
+        if max_points and len(columns) > max_points:
+            payload['source_count'] = len(columns)
+            payload['columns'] = downsample_track(columns, max_points)
+        return payload
+
+    def track_response(self, *args, **kwargs):
+        return Response(self.track_payload(*args, **kwargs))
+
+    @staticmethod
+    def stream_response(chunks, device_id, date_from, date_to, partial=False):
+        """Потоковый json-ответ: тот же формат, что и у обычного"""
+        fields = {'device_id': device_id, 'period': {'from': date_from, 'to': date_to}}
+        if partial:
+            fields['partial'] = True
+        return StreamingHttpResponse(iter_track_response(chunks, **fields), content_type='application/json')
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AnalyticsTrackLevelsView(APIView):
+    """
+    Трек для масштабируемого графика: корзины min/max/среднее скорости и топлива.
+    GET /api/analytics/track/levels/?session=<session>&schema_id=<schema_id>&device_id=<device_id>&from=<date>&to=<date>[&max_points=<N>]
+
+    Период любой длины отдается не больше чем ~max_points корзинами (по умолчанию
+    LEVELS_DEFAULT_POINTS) из пирамиды агрегатов по суткам (services.track_pyramid).
+    bucket в ответе - длина корзины в секундах; 0 - короткий период, корзины - сами точки.
+    t - начало корзины (секунды epoch), n - число точек в ней.
+    """
+
+    def get(self, request):
+        session_id = request.GET.get('session')
+        schema_id = request.GET.get('schema_id')
+        device_id = request.GET.get('device_id')
+        date_from = request.GET.get('from')
+        date_to = request.GET.get('to')
+
+        errors = {}
+        if not session_id:
+            errors['session'] = ['This field is required.']
+        if not schema_id:
+            errors['schema_id'] = ['This field is required.']
+        if not device_id:
+            errors['device_id'] = ['This field is required.']
+        if not date_from:
+            errors['from'] = ['This field is required.']
+        if not date_to:
+            errors['to'] = ['This field is required.']
+
+        try:
+            max_points = parse_max_points(request.GET.get('max_points')) or LEVELS_DEFAULT_POINTS
+            if max_points > LEVELS_MAX_POINTS:
+                raise ValueError(f'max_points must be at most {LEVELS_MAX_POINTS}')
+        except ValueError:
+            errors['max_points'] = [f'A valid integer from {MIN_MAX_POINTS} to {LEVELS_MAX_POINTS} is required.']
+
+        if not errors and date_from >= date_to:
+            errors['from'] = ['Начальная дата должна быть раньше конечной']
+
+        if errors:
+            return Response({
+                'error': 'Invalid parameters',
+                'details': errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            start = autograph_to_epoch(format_autograph_date(date_from))
+            end = autograph_to_epoch(format_autograph_date(date_to))
+        except ValueError as e:
+            return Response({
+                'error': f'Invalid date format: {str(e)}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            devices = device_registry.get(session_id, schema_id, service)
+            if devices.get(device_id) is None:
+                return Response({
+                    'error': True,
+                    'message': f"Device with ID {device_id} not found"
+                }, status=status.HTTP_404_NOT_FOUND)
+
+            buckets, bucket, partial = track_pyramid.get(service, session_id, schema_id, devices, device_id,
+                                                         start, end, max_points)
+        except Exception as e:
+            logger.error(f"Error fetching track levels for device {device_id}: {e}")
+            return Response({
+                'error': f'Failed to fetch track data: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        response = {
+            'success': True,
+            'device_id': device_id,
+            'period': {'from': date_from, 'to': date_to},
+            'bucket': bucket,
+            'count': len(buckets['t']),
+            'columns': buckets_payload(buckets),
+        }
+        if partial:
+            response['partial'] = True
+        return Response(response)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AnalyticsBatchTrackView(APIView):
+    """
+    Треки сразу нескольких ТС за один период.
+    GET  /api/analytics/tracks/?session=<session>&schema_id=<schema_id>&device_ids=<id1,id2,...>&from=<date>&to=<date>
+    POST /api/analytics/tracks/ с теми же полями в JSON (device_ids - список)
+
+    summary=1 - вместо точек только сводка по каждому ТС;
+    max_points=<N> - прореживание каждого трека (LTTB).
+
+    Метаданные ТС берутся из реестра один раз на запрос, треки загружаются параллельно,
+    не больше BATCH_TRACK_WORKERS ТС одновременно; сами GetTrack ограничены общим
+    на процесс TRACK_CONCURRENCY (AutoGraphService.track_slots). Ошибка по одному ТС
+    не роняет весь ответ: она попадает в его запись в devices.
+    """
+
+    def get(self, request):
+        return self.batch_response(request.GET)
+
+    def post(self, request):
+        return self.batch_response(request.data)
+
+    def batch_response(self, params):
+        session_id = params.get('session')
+        schema_id = params.get('schema_id')
+        date_from = params.get('from')
+        date_to = params.get('to')
+        summary_only = str(params.get('summary')).lower() in ('1', 'true')
+
+        errors = {}
+        if not session_id:
+            errors['session'] = ['This field is required.']
+        if not schema_id:
+            errors['schema_id'] = ['This field is required.']
+        # Тело POST - произвольный JSON: типы проверяются, как и наличие
+        try:
+            device_ids = parse_device_ids(params.get('device_ids'))
+            if not device_ids:
+                errors['device_ids'] = ['This field is required.']
+            elif len(device_ids) > BATCH_MAX_DEVICES:
+                errors['device_ids'] = [f'No more than {BATCH_MAX_DEVICES} devices per request.']
+        except TypeError:
+            errors['device_ids'] = ['A list of device IDs is required.']
+        for field, value in (('from', date_from), ('to', date_to)):
+            if not value:
+                errors[field] = ['This field is required.']
+            elif not isinstance(value, str):
+                errors[field] = ['Invalid date format, expected YYYY-MM-DD HH:MM.']
+
+        try:
+            max_points = parse_max_points(params.get('max_points'))
+        except (TypeError, ValueError):
+            errors['max_points'] = [f'A valid integer >= {MIN_MAX_POINTS} is required.']
+
+        if not errors and date_from >= date_to:
+            errors['from'] = ['Начальная дата должна быть раньше конечной']
+
+        if errors:
+            return Response({
+                'error': 'Invalid parameters',
+                'details': errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            from_formatted = format_autograph_date(date_from)
+            to_formatted = format_autograph_date(date_to)
+
+            # Свойства ТС (тарировки) - один раз на весь пакет из реестра ТС схемы
+            devices = device_registry.get(session_id, schema_id, service)
+        except Exception as e:
+            logger.error(f"❌ Error preparing batch tracks for schema {schema_id}: {e}")
+            return Response({
+                'error': f'Failed to fetch track data: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        def load(device_id):
+            if devices.get(device_id) is None:
+                return {'success': False, 'error': f'Device with ID {device_id} not found'}
+            try:
+                columns, partial = load_track_columns(session_id, schema_id, devices, device_id,
+                                                      from_formatted, to_formatted)
+            except Exception as e:
+                logger.error(f"Error fetching track data for device {device_id}: {e}")
+                return {'success': False, 'error': f'Failed to fetch track data: {str(e)}'}
+
+            entry = {'success': True, 'count': len(columns), 'partial': partial}
+            if summary_only:
+                entry['summary'] = columns.summary()
+            else:
+                payload = AnalyticsTrackView.track_payload(columns, device_id, date_from, date_to, max_points)
+                entry['points'] = payload['columns'].to_points()
+                if 'source_count' in payload:
+                    entry['source_count'] = payload['source_count']
+            return entry
+
+        workers = min(service.config['BATCH_TRACK_WORKERS'], len(device_ids))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = dict(zip(device_ids, pool.map(load, device_ids)))
+
+        return Response({
+            'success': True,
+            'period': {'from': date_from, 'to': date_to},
+            'count': len(results),
+            'devices': results,
+        })
+
+
+def consumption_cache_key(schema_id, device_id, vehicle_hash, from_formatted, to_formatted, rates):
+    """Ключ кэша итогов расхода: смена тарировок или норм ТС дает новый ключ"""
+    return get_cache_key('consumption', schema_id, device_id, vehicle_hash, from_formatted, to_formatted, *rates)
+
+
+def fleet_totals(results):
+    """Сумма итогов расхода по парку"""
+    totals = {}
+    for entry in results.values():
+        for key, value in (entry.get('totals') or {}).items():
+            if key not in ('deviation_percent', 'fuel_start', 'fuel_end') and value is not None:
+                totals[key] = round(totals.get(key, 0) + value, 2)
+    expected = totals.get('fuel_expected')
+    totals['deviation_percent'] = (
+        round((totals['fuel_actual'] - expected) / expected * 100, 2) if expected else None
+    )
+    return totals
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AnalyticsConsumptionView(APIView):
+    """
+    Расход топлива против норм ТС по парку за период.
+    GET /api/analytics/consumption/?session=<session>&schema_id=<schema_id>&from=<date>&to=<date>[&device_ids=<id1,id2,...>]
+
+    Без device_ids - все ТС схемы. Нормы берутся из Vehicle (у ТС без записи - значения
+    по умолчанию). По каждому ТС: пробег, часы движения и холостого хода, фактический
+    и нормативный расход, перерасход, заправки и сливы; в totals - сумма по парку.
+    Итоги полного трека кэшируются; события в базу пишут detect/update_fuel_events.
+    """
+
+    def get(self, request):
+        session_id = request.GET.get('session')
+        schema_id = request.GET.get('schema_id')
+        device_ids = parse_device_ids(request.GET.get('device_ids'))
+        date_from = request.GET.get('from')
+        date_to = request.GET.get('to')
+
+        errors = {}
+        if not session_id:
+            errors['session'] = ['This field is required.']
+        if not schema_id:
+            errors['schema_id'] = ['This field is required.']
+        if len(device_ids) > BATCH_MAX_DEVICES:
+            errors['device_ids'] = [f'No more than {BATCH_MAX_DEVICES} devices per request.']
+        if not date_from:
+            errors['from'] = ['This field is required.']
+        if not date_to:
+            errors['to'] = ['This field is required.']
+        if not errors and date_from >= date_to:
+            errors['from'] = ['Начальная дата должна быть раньше конечной']
+
+        if errors:
+            return Response({
+                'error': 'Invalid parameters',
+                'details': errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            from_formatted = format_autograph_date(date_from)
+            to_formatted = format_autograph_date(date_to)
+            start, end = autograph_to_epoch(from_formatted), autograph_to_epoch(to_formatted)
+        except ValueError as e:
+            return Response({
+                'error': f'Invalid date format: {str(e)}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        devices = device_registry.get(session_id, schema_id, service)
+        device_ids = device_ids or list(devices.index)[:BATCH_MAX_DEVICES]
+        vehicles = {v.device_id: v for v in Vehicle.objects.filter(device_id__in=device_ids)}
+        default_rates = vehicle_rates(Vehicle())
+
+        def load(device_id):
+            device = devices.get(device_id)
+            if device is None:
+                return {'success': False, 'error': f'Device with ID {device_id} not found'}
+            rates = vehicle_rates(vehicles[device_id]) if device_id in vehicles else default_rates
+            cache_key = consumption_cache_key(schema_id, device_id, devices.hashes[device_id],
+                                              from_formatted, to_formatted, rates)
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return entry
+            try:
+                columns, ignition, partial = load_device_track(service, session_id, schema_id, device, start, end)
+                _, totals = analyze_track(columns, ignition, rates)
+            except Exception as e:
+                logger.error(f"Error calculating consumption for device {device_id}: {e}")
+                return {'success': False, 'error': f'Failed to calculate consumption: {str(e)}'}
+
+            entry = {
+                'success': True,
+                'name': device.get('Name', ''),
+                'rates': {'idle_l_per_hour': rates[0], 'move_l_per_100km': rates[1]},
+                'partial': partial,
+                'totals': totals,
+            }
+            if not partial:
+                set_tagged(cache_key, entry, 600, cache_tags('consumption', schema_id, device_id))
+            return entry
+
+        workers = max(1, min(service.config['BATCH_TRACK_WORKERS'], len(device_ids)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = dict(zip(device_ids, pool.map(load, device_ids)))
+
+        return Response({
+            'success': True,
+            'period': {'from': date_from, 'to': date_to},
+            'count': len(results),
+            'devices': results,
+            'totals': fleet_totals(results),
+        })
@@ -0,0 +1,425 @@
+"""
+Асинхронные варианты endpoints для запуска через ASGI (core/asgi.py).
+Логика обработки общая с синхронными views, отличается только транспорт.
+"""
+import asyncio
+import json
+import logging
+import time
+import traceback
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from django.core.cache import cache
+
+from ..services.autograph_async import AsyncAutoGraphService
+from ..services.telemetry_store import telemetry_store
+from ..services.device_registry import device_registry
+from ..services.session_manager import session_manager
+from ..services.online_store import online_store, field_deltas, WATCH_TTL
+from ..services.online_poller import poll_if_stale, poller_config
+from ..utils.cache import aget_stale_while_revalidate, aset_tagged, cache_tags, get_cache_key
+from ..utils.http import conditional_response
+from ..services.track_formats import negotiate_track_format, encode_track_payload
+from .vehicles import (
+    build_vehicles_response, build_online_response, build_snapshot_response, parse_since, vehicles_etag,
+    ONLINE_FRESH_SECONDS, ONLINE_MAX_STALE_SECONDS,
+)
+from .analytics import (
+    format_autograph_date, track_cache_key, extract_taring_tables, build_track_columns,
+    parse_max_points, AnalyticsTrackView, MIN_MAX_POINTS,
+)
+from .legacy import (
+    clean_date_string, build_props, build_online, build_online_from_snapshot, format_track, legacy_track_response,
+)
+
+logger = logging.getLogger(__name__)
+service = AsyncAutoGraphService()
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncVehicleListView(View):
+    """
+    Асинхронное получение списка транспортных средств.
+    GET /api/async/vehicles/?session_id=<session_id>&schema_id=<schema_id>
+    """
+
+    async def get(self, request):
+        session_id = request.GET.get('session_id')
+        schema_id = request.GET.get('schema_id')
+
+        if not session_id or not schema_id:
+            return JsonResponse({
+                'error': 'session_id and schema_id parameters are required'
+            }, status=400)
+
+        try:
+            devices = await device_registry.aget(session_id, schema_id, service)
+
+            if not devices:
+                return JsonResponse({
+                    'success': True,
+                    'vehicles': [],
+                    'count': 0
+                })
+
+            response_data = devices.memo('vehicles', lambda: build_vehicles_response(devices.devices, schema_id))
+
+            return conditional_response(request, response_data, vehicles_etag(devices, response_data), JsonResponse)
+
+        except Exception as e:
+            logger.error(f"Error fetching vehicles: {e}")
+            return JsonResponse({
+                'error': f'Failed to fetch vehicles: {str(e)}'
+            }, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncVehicleOnlineView(View):
+    """
+    Асинхронное получение онлайн-данных транспортных средств.
+    GET /api/async/vehicles/online/?session_id=<session_id>&schema_id=<schema_id>&device_ids=<id1,id2,...>[&since=<version>]
+    """
+
+    async def get(self, request):
+        session_id = request.GET.get('session_id')
+        schema_id = request.GET.get('schema_id')
+        device_ids = request.GET.get('device_ids')
+
+        if not all([session_id, schema_id, device_ids]):
+            return JsonResponse({
+                'error': 'session_id, schema_id and device_ids parameters are required'
+            }, status=400)
+
+        try:
+            since = parse_since(request.GET.get('since'))
+        except ValueError:
+            return JsonResponse({'error': 'since must be a non-negative integer'}, status=400)
+
+        # Сессия становится сессией опроса схемы только после проверки доступа
+        if await device_registry.ahas_access(service, session_id, schema_id):
+            await sync_to_async(online_store.watch)(schema_id, session_id)
+            snapshot = await online_store.aget(schema_id, max_age=ONLINE_MAX_STALE_SECONDS)
+            if snapshot:
+                return conditional_response(request, build_snapshot_response(snapshot, device_ids, since),
+                                            response_class=JsonResponse)
+
+        cache_key = get_cache_key('online', session_id, schema_id, device_ids)
+
+        async def fetch():
+            raw_online = await service.get_online_info(session_id, schema_id, device_ids)
+            return build_online_response(raw_online) if raw_online else None
+
+        try:
+            response_data = await aget_stale_while_revalidate(
+                cache_key, fetch, ONLINE_FRESH_SECONDS, ONLINE_MAX_STALE_SECONDS, tags=cache_tags('online', schema_id)
+            )
+
+            if not response_data:
+                return JsonResponse({
+                    'success': True,
+                    'online_data': {}
+                })
+
+            return conditional_response(request, response_data, response_class=JsonResponse)
+
+        except Exception as e:
+            logger.error(f"Error fetching online data: {e}")
+            return JsonResponse({
+                'error': f'Failed to fetch online data: {str(e)}'
+            }, status=500)
+
+
+# Как часто поток событий проверяет снимок и шлет keep-alive
+STREAM_CHECK_SECONDS = 2
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+def sse_event(event, data, event_id=None):
+    """Одно событие Server-Sent Events"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+async def online_events(session_id, schema_id, device_ids=None):
+    """
+    Поток событий онлайн-данных: snapshot (полное состояние) при подписке,
+    затем delta - только изменившиеся поля изменившихся ТС.
+    Каждый шаг читает только заголовок снимка; сам снимок загружается,
+    когда сменилась версия.
+    """
+    wanted = set(device_ids.split(',')) if device_ids else None
+    state, version = None, None
+    last_sent = time.monotonic()
+    last_watch = None
+    stale_after = poller_config()['INTERVAL'] * 2
+
+    while True:
+        if last_watch is None or time.monotonic() - last_watch >= WATCH_TTL / 4:
+            await sync_to_async(online_store.watch)(schema_id, session_id)
+            last_watch = time.monotonic()
+
+        head = await online_store.ahead(schema_id, max_age=stale_after)
+        if head is None:
+            # Без запущенного опросчика снимок обновляет один из подписчиков
+            await sync_to_async(poll_if_stale, thread_sensitive=False)(schema_id, session_id)
+            head = await online_store.ahead(schema_id)
+
+        snapshot = None
+        if head is not None and head['version'] != version:
+            snapshot = await online_store.aget(schema_id)
+
+        if snapshot is not None and snapshot['version'] != version:
+            current = {
+                device_id: data for device_id, data in snapshot['vehicles'].items()
+                if wanted is None or device_id in wanted
+            }
+            if state is None:
+                yield sse_event('snapshot', {'version': snapshot['version'], 'online_data': current},
+                                snapshot['version'])
+                last_sent = time.monotonic()
+            else:
+                changes, removed = field_deltas(state, current)
+                if changes or removed:
+                    yield sse_event('delta', {'version': snapshot['version'], 'changes': changes,
+                                              'removed': removed}, snapshot['version'])
+                    last_sent = time.monotonic()
+            state, version = current, snapshot['version']
+
+        if time.monotonic() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+            yield ': keepalive\n\n'
+            last_sent = time.monotonic()
+
+        await asyncio.sleep(STREAM_CHECK_SECONDS)
+
+
+class VehicleOnlineStreamView(View):
+    """
+    Подписка на онлайн-данные (Server-Sent Events, только через ASGI).
+    GET /api/async/vehicles/online/stream/?session_id=<session_id>&schema_id=<schema_id>[&device_ids=<id1,id2,...>]
+
+    Сразу приходит event: snapshot с полным состоянием, дальше - event: delta
+    {'version', 'changes': {device_id: {изменившиеся поля}}, 'removed': [...]}.
+    Пока парк стоит, клиенту уходят только keep-alive комментарии.
+    """
+
+    async def get(self, request):
+        session_id = request.GET.get('session_id')
+        schema_id = request.GET.get('schema_id')
+        device_ids = request.GET.get('device_ids')
+
+        if not session_id or not schema_id:
+            return JsonResponse({
+                'error': 'session_id and schema_id parameters are required'
+            }, status=400)
+
+        # Под WSGI бесконечный поток вычитывался бы целиком и вешал воркер
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({'error': 'Online stream requires the ASGI server'}, status=501)
+
+        if not await device_registry.ahas_access(service, session_id, schema_id):
+            return JsonResponse({'error': 'Schema is not available for this session'}, status=403)
+
+        response = StreamingHttpResponse(online_events(session_id, schema_id, device_ids),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Отключаем буферизацию в nginx, иначе события приходят пачками
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAnalyticsTrackView(View):
+    """
+    Асинхронное получение данных трека для построения графиков.
+    GET /api/async/analytics/track/?session=<session>&schema_id=<schema_id>&device_id=<device_id>&from=<date>&to=<date>
+    """
+
+    async def get(self, request):
+        session_id = request.GET.get('session')
+        schema_id = request.GET.get('schema_id')
+        device_id = request.GET.get('device_id')
+        date_from = request.GET.get('from')
+        date_to = request.GET.get('to')
+
+        errors = {}
+        for field, value in (('session', session_id), ('schema_id', schema_id), ('device_id', device_id),
+                             ('from', date_from), ('to', date_to)):
+            if not value:
+                errors[field] = ['This field is required.']
+
+        try:
+            max_points = parse_max_points(request.GET.get('max_points'))
+        except ValueError:
+            errors['max_points'] = [f'A valid integer >= {MIN_MAX_POINTS} is required.']
+
+        if errors:
+            return JsonResponse({
+                'error': 'Invalid parameters',
+                'details': errors
+            }, status=400)
+
+        track_format = negotiate_track_format(request)
+        if track_format is None:
+            return JsonResponse({'error': 'Unsupported format'}, status=406)
+
+        if date_from >= date_to:
+            return JsonResponse({
+                'error': 'Invalid parameters',
+                'details': {'from': ['Начальная дата должна быть раньше конечной']}
+            }, status=400)
+
+        from_formatted = format_autograph_date(date_from)
+        to_formatted = format_autograph_date(date_to)
+
+        try:
+            devices = await device_registry.aget(session_id, schema_id, service)
+            vehicle = devices.get(device_id)
+
+            if not vehicle:
+                return JsonResponse({
+                    'error': True,
+                    'message': f"Device with ID {device_id} not found"
+                }, status=404)
+
+            cache_key = track_cache_key(schema_id, device_id, devices.hashes[device_id],
+                                        from_formatted, to_formatted)
+            columns = await cache.aget(cache_key)
+
+            if columns is not None:
+                return await self.track_response(columns, track_format, device_id, date_from, date_to, max_points)
+
+            taring_tables = extract_taring_tables(vehicle)
+
+            result = await telemetry_store.aget_track(
+                service,
+                session_id,
+                schema_id,
+                device_id,
+                from_formatted,
+                to_formatted
+            )
+            raw_track = result.segments
+
+            if not raw_track:
+                return JsonResponse({
+                    'success': True,
+                    'points': [],
+                    'count': 0,
+                    'message': 'No track data available',
+                    'device_id': device_id,
+                    'partial': result.partial,
+                })
+
+            # Обработка трека занимает CPU, уводим ее с event loop
+            columns = await sync_to_async(build_track_columns, thread_sensitive=False)(
+                raw_track, device_id, taring_tables
+            )
+            if not result.partial:
+                await aset_tagged(cache_key, columns, 600, cache_tags('track', schema_id, device_id))
+
+            return await self.track_response(columns, track_format, device_id, date_from, date_to, max_points,
+                                             result.partial)
+
+        except Exception as e:
+            logger.error(f"Error fetching track data for device {device_id}: {e}")
+            logger.error(traceback.format_exc())
+            return JsonResponse({
+                'error': f'Failed to fetch track data: {str(e)}'
+            }, status=500)
+
+    @staticmethod
+    def encode_track(columns, track_format, *args):
+        payload = AnalyticsTrackView.track_payload(columns, *args)
+        return encode_track_payload(payload, track_format)
+
+    async def track_response(self, columns, track_format, *args):
+        # Прореживание (LTTB) и кодирование месячного трека тоже занимают CPU - в пуле потоков
+        body, media_type = await sync_to_async(self.encode_track, thread_sensitive=False)(
+            columns, track_format, *args
+        )
+        return HttpResponse(body, content_type=media_type)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAutoGraphInitView(View):
+    """Асинхронный вариант /api/init-data/"""
+
+    async def post(self, request):
+        try:
+            body = json.loads(request.body)
+            username = body.get('username')
+            password = body.get('password')
+
+            sid, schemas = await session_manager.awith_session(username, password, service.fetch_schemas)
+            if not sid:
+                return JsonResponse({'error': 'Auth failed'}, status=401)
+
+            if not schemas:
+                return JsonResponse({'error': 'No schemas found'}, status=404)
+            device_registry.remember_schemas(sid, schemas)
+
+            sch_id = schemas[0].get('ID')
+            items = (await device_registry.aget(sid, sch_id, service)).devices
+
+            if not items:
+                return JsonResponse({
+                    "session_id": sid, "schema_id": sch_id,
+                    "vehicles": [], "online": {}, "props": {}
+                })
+
+            props_dict = build_props(items)
+
+            await sync_to_async(online_store.watch)(sch_id, sid)
+            snapshot = await online_store.aget(sch_id, max_age=ONLINE_MAX_STALE_SECONDS)
+            if snapshot:
+                online_dict = build_online_from_snapshot(snapshot['vehicles'], props_dict)
+            else:
+                ids_str = ",".join([str(d['ID']) for d in items])
+                online_raw = await service.get_online_info(sid, sch_id, ids_str)
+                online_dict = build_online(online_raw, props_dict, service)
+
+            return JsonResponse({
+                "session_id": sid, "schema_id": sch_id,
+                "vehicles": items, "online": online_dict, "props": props_dict
+            })
+        except Exception as e:
+            logger.error(f"Init Error: {traceback.format_exc()}")
+            return JsonResponse({'error': str(e)}, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAutoGraphAnalyticsView(View):
+    """Асинхронный вариант /api/analytics/"""
+
+    async def get(self, request):
+        try:
+            sid = request.GET.get('session_id') or request.GET.get('session')
+            sch = request.GET.get('schema_id')
+            did = request.GET.get('device_id')
+            raw_from = request.GET.get('from')
+            raw_to = request.GET.get('to')
+
+            if not all([sid, sch, did, raw_from, raw_to]):
+                return JsonResponse({'error': 'Missing params'}, status=400)
+
+            track_format = negotiate_track_format(request)
+            if track_format is None:
+                return JsonResponse({'error': 'Unsupported format'}, status=406)
+
+            sd = clean_date_string(raw_from)
+            ed = clean_date_string(raw_to)
+
+            raw_track = await service.get_track_data(sid, sch, did, sd, ed)
+            formatted_track = format_track(raw_track, did)
+
+            return legacy_track_response(formatted_track, did, track_format)
+        except Exception as e:
+            logger.error(f"Analytics Error: {traceback.format_exc()}")
+            return JsonResponse({'error': str(e)}, status=500)
@@ -10,6 +10,8 @@ from django.utils.decorators import method_decorator
 from django.http import JsonResponse
 
 from ..services.autograph import AutoGraphService
+from ..services.device_registry import device_registry
+from ..services.session_manager import session_manager
 from ..serializers import LoginSerializer
 
 logger = logging.getLogger(__name__)
@@ -36,8 +38,8 @@ class LoginView(APIView):
         password = serializer.validated_data['password']
 
         try:
-            # Получаем session_id из AutoGRAPH
-            session_id = service.get_session_token(username, password)
+            # session_id из кэша сессий (Login к AutoGRAPH только при необходимости)
+            session_id = session_manager.get_token(username, password, service)
 
             if not session_id:
                 return Response({
@@ -75,6 +77,7 @@ class SchemaListView(APIView):
         try:
             # Получаем схемы из AutoGRAPH
             schemas = service.get_schemas(session_id)
+            device_registry.remember_schemas(session_id, schemas)
 
             # Простой ответ
             return JsonResponse({
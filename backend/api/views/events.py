@@ -0,0 +1,217 @@
+"""
+Views для событий топлива (сливы, заправки, перерасходы).
+"""
+import base64
+import logging
+from datetime import datetime, timezone
+
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from django.db.models import Q
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+
+from ..models import FuelEvent
+from ..services.autograph import AutoGraphService
+from ..services.device_registry import device_registry
+from ..services.track import autograph_to_epoch
+from .analytics import BATCH_MAX_DEVICES, format_autograph_date, parse_device_ids
+
+logger = logging.getLogger(__name__)
+service = AutoGraphService()
+
+EVENTS_DEFAULT_LIMIT = 100
+EVENTS_MAX_LIMIT = 1000
+# Идентификаторов в одной массовой операции
+BULK_MAX_IDS = 5000
+
+EVENT_TYPES = {value for value, _ in FuelEvent.EVENT_TYPES}
+
+
+def encode_cursor(event):
+    """Курсор - (время, id) последнего события страницы"""
+    raw = f"{event.timestamp.isoformat()}|{event.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+    timestamp, event_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(timestamp), int(event_id)
+
+
+def parse_period_bound(value):
+    """'2026-01-17 09:56' -> datetime UTC (та же шкала, что у треков)"""
+    return datetime.fromtimestamp(autograph_to_epoch(format_autograph_date(value)), tz=timezone.utc)
+
+
+def parse_flag(value):
+    """'1'/'true' -> True, '0'/'false' -> False, пусто -> None"""
+    if value in (None, ''):
+        return None
+    value = str(value).lower()
+    if value in ('1', 'true'):
+        return True
+    if value in ('0', 'false'):
+        return False
+    raise ValueError(value)
+
+
+def event_payload(event):
+    return {
+        'id': event.id,
+        'device_id': event.vehicle.device_id,
+        'vehicle': event.vehicle.name,
+        'event_type': event.event_type,
+        'timestamp': event.timestamp.isoformat(),
+        'volume': event.volume,
+        'is_confirmed': event.is_confirmed,
+    }
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FuelEventListView(APIView):
+    """
+    События топлива ТС схемы, от новых к старым.
+    GET /api/fuel-events/?session=<session>&schema_id=<schema_id>[&device_ids=<id1,...>][&type=drain,refill]
+        [&from=<date>&to=<date>][&confirmed=0|1][&limit=<N>][&cursor=<next_cursor>]
+
+    Постраничный вывод по курсору (keyset): следующая страница - события
+    строго раньше (timestamp, id) последнего события текущей, поэтому время
+    ответа не зависит от номера страницы и размера таблицы.
+    """
+
+    def get(self, request):
+        session_id = request.GET.get('session')
+        schema_id = request.GET.get('schema_id')
+        device_ids = parse_device_ids(request.GET.get('device_ids'))
+        event_types = parse_device_ids(request.GET.get('type'))
+        date_from = request.GET.get('from')
+        date_to = request.GET.get('to')
+
+        errors = {}
+        if not session_id:
+            errors['session'] = ['This field is required.']
+        if not schema_id:
+            errors['schema_id'] = ['This field is required.']
+        if len(device_ids) > BATCH_MAX_DEVICES:
+            errors['device_ids'] = [f'No more than {BATCH_MAX_DEVICES} devices per request.']
+        if set(event_types) - EVENT_TYPES:
+            errors['type'] = [f'Allowed values: {", ".join(sorted(EVENT_TYPES))}.']
+
+        start = end = cursor = confirmed = None
+        try:
+            start = parse_period_bound(date_from) if date_from else None
+            end = parse_period_bound(date_to) if date_to else None
+        except ValueError:
+            errors['from'] = ['Invalid date format, expected YYYY-MM-DD HH:MM.']
+        if start and end and start >= end:
+            errors['from'] = ['Начальная дата должна быть раньше конечной']
+        try:
+            confirmed = parse_flag(request.GET.get('confirmed'))
+        except ValueError:
+            errors['confirmed'] = ['Expected 0 or 1.']
+        try:
+            limit = int(request.GET.get('limit') or EVENTS_DEFAULT_LIMIT)
+            if not 1 <= limit <= EVENTS_MAX_LIMIT:
+                raise ValueError(limit)
+        except ValueError:
+            errors['limit'] = [f'A valid integer from 1 to {EVENTS_MAX_LIMIT} is required.']
+        try:
+            cursor = decode_cursor(request.GET['cursor']) if request.GET.get('cursor') else None
+        except (ValueError, UnicodeDecodeError):
+            errors['cursor'] = ['Invalid cursor.']
+
+        if errors:
+            return Response({
+                'error': 'Invalid parameters',
+                'details': errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Доступны только ТС схемы, которые видит сессия
+        devices = device_registry.get(session_id, schema_id, service)
+        allowed = [device_id for device_id in (device_ids or list(devices.index)) if devices.get(device_id)]
+
+        events = FuelEvent.objects.select_related('vehicle').filter(vehicle__device_id__in=allowed)
+        if event_types:
+            events = events.filter(event_type__in=event_types)
+        if start:
+            events = events.filter(timestamp__gte=start)
+        if end:
+            events = events.filter(timestamp__lt=end)
+        if confirmed is not None:
+            events = events.filter(is_confirmed=confirmed)
+        if cursor:
+            timestamp, event_id = cursor
+            events = events.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=event_id))
+
+        # Лишнее событие показывает, есть ли следующая страница
+        page = list(events.order_by('-timestamp', '-id')[:limit + 1])
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        page = page[:limit]
+
+        return Response({
+            'success': True,
+            'count': len(page),
+            'events': [event_payload(event) for event in page],
+            'next_cursor': next_cursor,
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FuelEventConfirmView(APIView):
+    """
+    Массовое подтверждение (или снятие подтверждения) событий.
+    POST /api/fuel-events/confirm/ {"session", "schema_id", "ids": [...], "confirmed": true|false}
+
+    Одним UPDATE; события ТС вне схемы пропускаются. В ответе - сколько изменено.
+    Подтвержденные события детектор при пересчете не трогает.
+    """
+
+    def post(self, request):
+        session_id = request.data.get('session')
+        schema_id = request.data.get('schema_id')
+        ids = request.data.get('ids')
+        confirmed = request.data.get('confirmed', True)
+
+        errors = {}
+        if not session_id:
+            errors['session'] = ['This field is required.']
+        if not schema_id:
+            errors['schema_id'] = ['This field is required.']
+        try:
+            ids = list(dict.fromkeys(int(event_id) for event_id in ids))
+            if not ids:
+                raise ValueError
+            if len(ids) > BULK_MAX_IDS:
+                errors['ids'] = [f'No more than {BULK_MAX_IDS} events per request.']
+        except (TypeError, ValueError):
+            errors['ids'] = ['A non-empty list of event IDs is required.']
+        try:
+            confirmed = confirmed if isinstance(confirmed, bool) else parse_flag(confirmed)
+            if confirmed is None:
+                raise ValueError
+        except ValueError:
+            errors['confirmed'] = ['Expected true or false.']
+
+        if errors:
+            return Response({
+                'error': 'Invalid parameters',
+                'details': errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        devices = device_registry.get(session_id, schema_id, service)
+        updated = (
+            FuelEvent.objects
+            .filter(id__in=ids, vehicle__device_id__in=list(devices.index))
+            .exclude(is_confirmed=confirmed)
+            .update(is_confirmed=confirmed)
+        )
+        logger.info(f"Fuel events {'confirmed' if confirmed else 'unconfirmed'}: {updated} of {len(ids)}")
+
+        return Response({
+            'success': True,
+            'updated': updated,
+            'confirmed': confirmed,
+        })
@@ -2,14 +2,176 @@ import json
 import traceback
 import logging
 import re
-from django.http import JsonResponse
+import msgpack
+import numpy as np
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from ..services.autograph import AutoGraphService
+from ..services.device_registry import device_registry
+from ..services.session_manager import session_manager
+from ..services.online_store import online_store
+from .vehicles import ONLINE_MAX_STALE_SECONDS
+from ..services.track import STREAM_CHUNK_POINTS
+from ..services.track_formats import TRACK_FORMATS, negotiate_track_format
 
 logger = logging.getLogger(__name__)
 
+
+def clean_date_string(dt_str):
+    """Очистка даты для API АвтоГРАФ"""
+    digits = re.sub(r'\D', '', dt_str)
+    if len(digits) >= 12:
+        return f"{digits[:8]}-{digits[8:12]}"
+    return digits
+
+
+def build_props(items):
+    """Госномер и суммарный объем баков по ДУТ для каждого ТС"""
+    props_dict = {}
+    for dev in items:
+        v_id = str(dev['ID'])
+        reg_num, total_max_f = "—", 0.0
+        for prop in dev.get('Properties', []):
+            if prop.get('Name') == 'VehicleRegNumber':
+                reg_num = prop.get('Value', '—')
+            if prop.get('Name') and 'LLS' in prop.get('Name'):
+                val = prop.get('Value')
+                if isinstance(val, dict):
+                    taring = val.get('items', [])
+                    if taring:
+                        vals = [i.get('outputVal') for i in taring if i.get('outputVal') is not None]
+                        if vals:
+                            total_max_f += float(max(vals))
+        props_dict[v_id] = {'RegNumber': reg_num, 'MaxFuel': total_max_f}
+    return props_dict
+
+
+def build_online(online_raw, props_dict, service):
+    """Нормализация ответа GetOnlineInfo для старого фронтенда"""
+    online_dict = {}
+    if isinstance(online_raw, dict):
+        for v_id, item in online_raw.items():
+            if not isinstance(item, dict): continue
+            final = item.get('Final', {})
+
+            raw_spd = item.get('Speed', 0)
+            speed = round(abs(float(raw_spd))) if raw_spd is not None else 0
+
+            fuel_l = final.get('TankMainFuelLevel', 0)
+            fuel_val = float(fuel_l) if fuel_l is not None else 0.0
+            max_f = props_dict.get(v_id, {}).get('MaxFuel', 0)
+
+            f_percent = 0
+            if max_f > 0:
+                f_percent = round(min(100, (fuel_val / max_f) * 100))
+
+            online_dict[v_id] = {
+                'Address': item.get('Address') or 'Координаты не определены',
+                'Speed': speed,
+                'LastData': item.get('DT'),
+                'Moto': service.parse_moto_hours(final.get('FDT', '0')),
+                'Ignition': final.get('DIgnition') or False,
+                'Fuel': round(fuel_val),
+                'FuelPercent': f_percent
+            }
+    return online_dict
+
+
+def build_online_from_snapshot(vehicles, props_dict):
+    """То же, что build_online, но из нормализованного снимка опросчика"""
+    online_dict = {}
+    for v_id, item in vehicles.items():
+        raw_spd = item.get('Speed', 0)
+        speed = round(abs(float(raw_spd))) if raw_spd is not None else 0
+
+        fuel_l = item.get('fuel', 0)
+        fuel_val = float(fuel_l) if fuel_l is not None else 0.0
+        max_f = props_dict.get(v_id, {}).get('MaxFuel', 0)
+
+        f_percent = 0
+        if max_f > 0:
+            f_percent = round(min(100, (fuel_val / max_f) * 100))
+
+        online_dict[v_id] = {
+            'Address': item.get('Address') or 'Координаты не определены',
+            'Speed': speed,
+            'LastData': item.get('DT'),
+            'Moto': item.get('moto_hours', 0),
+            'Ignition': item.get('ignition') or False,
+            'Fuel': round(fuel_val),
+            'FuelPercent': f_percent
+        }
+    return online_dict
+
+
+def iter_track_pairs(raw_track, did):
+    """Трек парами [timestamp_ms, speed] для старого графика"""
+    if isinstance(raw_track, dict):
+        t_data = raw_track.get(did) or raw_track.get(str(did))
+        # Один сегмент или список сегментов (трек, скачанный по частям)
+        for segment in ([t_data] if isinstance(t_data, dict) else t_data or []):
+            if not isinstance(segment, dict) or 'DT' not in segment:
+                continue
+            timestamps = segment.get('DT', [])
+            speeds = segment.get('Speed', [])
+            # Сохраняем логику извлечения топлива для будущих графиков
+            fuels = segment.get('TankMainFuelLevel', [0] * len(timestamps))
+
+            for i in range(len(timestamps)):
+                try:
+                    ts = int(timestamps[i]) * 1000
+                    val_speed = round(abs(float(speeds[i])))
+                    # Формируем структуру, которая не потеряет данные
+                    yield [ts, val_speed]
+                except:
+                    continue
+
+
+def format_track(raw_track, did):
+    """Трек в виде пар [timestamp_ms, speed] для старого графика"""
+    return list(iter_track_pairs(raw_track, did))
+
+
+def iter_legacy_track_json(pairs, did, chunk_size=STREAM_CHUNK_POINTS):
+    """Потоковый JSON старого формата, байт в байт как у JsonResponse"""
+    yield b'{"track": ['
+    chunk, first = [], True
+    for ts, speed in pairs:
+        chunk.append(f'[{ts}, {speed}]')
+        if len(chunk) >= chunk_size:
+            yield (('' if first else ', ') + ', '.join(chunk)).encode()
+            chunk, first = [], False
+    if chunk:
+        yield (('' if first else ', ') + ', '.join(chunk)).encode()
+    yield f'], "device_id": {json.dumps(did)}}}'.encode()
+
+
+def legacy_track_response(formatted_track, did, track_format):
+    """
+    Ответ старого /api/analytics/ в выбранном формате:
+    json - пары [ts, speed], columnar - массивы t/s, msgpack - типизированные t/s.
+    """
+    if track_format == 'json':
+        return JsonResponse({"track": formatted_track, "device_id": did})
+
+    pairs = np.array(formatted_track, dtype=np.int64).reshape(-1, 2)
+    media_type = TRACK_FORMATS[track_format][0]
+    if track_format == 'columnar':
+        body = json.dumps({
+            "format": "columnar", "device_id": did, "count": len(pairs),
+            "t": pairs[:, 0].tolist(), "s": pairs[:, 1].tolist(),
+        })
+    else:
+        body = msgpack.packb({
+            "format": "msgpack", "device_id": did, "count": len(pairs),
+            "t": {"dtype": "<i8", "data": pairs[:, 0].astype('<i8').tobytes()},
+            "s": {"dtype": "<i8", "data": pairs[:, 1].astype('<i8').tobytes()},
+        }, use_bin_type=True)
+    return HttpResponse(body, content_type=media_type)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class AutoGraphInitView(View):
     def post(self, request):
@@ -19,16 +181,17 @@ class AutoGraphInitView(View):
             username = body.get('username')
             password = body.get('password')
 
-            sid = service.get_session_token(username, password)
+            # Сессия из кэша; если EnumSchemas (мимо кэша процесса) ничего не вернул, вход повторится один раз
+            sid, schemas = session_manager.with_session(username, password, service.fetch_schemas, service)
             if not sid:
                 return JsonResponse({'error': 'Auth failed'}, status=401)
 
-            schemas = service.get_schemas(sid)
             if not schemas:
                 return JsonResponse({'error': 'No schemas found'}, status=404)
+            device_registry.remember_schemas(sid, schemas)
 
             sch_id = schemas[0].get('ID')
-            items = service.get_vehicles_by_schema(sid, sch_id)
+            items = device_registry.get(sid, sch_id, service).devices
 
             if not items:
                 return JsonResponse({
@@ -36,52 +199,17 @@ class AutoGraphInitView(View):
                     "vehicles": [], "online": {}, "props": {}
                 })
 
-            ids_str = ",".join([str(d['ID']) for d in items])
-            online_raw = service.get_online_info(sid, sch_id, ids_str)
-
-            props_dict = {}
-            for dev in items:
-                v_id = str(dev['ID'])
-                reg_num, total_max_f = "—", 0.0
-                for prop in dev.get('Properties', []):
-                    if prop.get('Name') == 'VehicleRegNumber':
-                        reg_num = prop.get('Value', '—')
-                    if prop.get('Name') and 'LLS' in prop.get('Name'):
-                        val = prop.get('Value')
-                        if isinstance(val, dict):
-                            taring = val.get('items', [])
-                            if taring:
-                                vals = [i.get('outputVal') for i in taring if i.get('outputVal') is not None]
-                                if vals:
-                                    total_max_f += float(max(vals))
-                props_dict[v_id] = {'RegNumber': reg_num, 'MaxFuel': total_max_f}
-
-            online_dict = {}
-            if isinstance(online_raw, dict):
-                for v_id, item in online_raw.items():
-                    if not isinstance(item, dict): continue
-                    final = item.get('Final', {})
-
-                    raw_spd = item.get('Speed', 0)
-                    speed = round(abs(float(raw_spd))) if raw_spd is not None else 0
-
-                    fuel_l = final.get('TankMainFuelLevel', 0)
-                    fuel_val = float(fuel_l) if fuel_l is not None else 0.0
-                    max_f = props_dict.get(v_id, {}).get('MaxFuel', 0)
-
-                    f_percent = 0
-                    if max_f > 0:
-                        f_percent = round(min(100, (fuel_val / max_f) * 100))
-
-                    online_dict[v_id] = {
-                        'Address': item.get('Address') or 'Координаты не определены',
-                        'Speed': speed,
-                        'LastData': item.get('DT'),
-                        'Moto': service.parse_moto_hours(final.get('FDT', '0')),
-                        'Ignition': final.get('DIgnition') or False,
-                        'Fuel': round(fuel_val),
-                        'FuelPercent': f_percent
-                    }
+            props_dict = build_props(items)
+
+            # Онлайн-данные из снимка опросчика, иначе - прямой запрос
+            online_store.watch(sch_id, sid)
+            snapshot = online_store.get(sch_id, max_age=ONLINE_MAX_STALE_SECONDS)
+            if snapshot:
+                online_dict = build_online_from_snapshot(snapshot['vehicles'], props_dict)
+            else:
+                ids_str = ",".join([str(d['ID']) for d in items])
+                online_raw = service.get_online_info(sid, sch_id, ids_str)
+                online_dict = build_online(online_raw, props_dict, service)
 
             return JsonResponse({
                 "session_id": sid, "schema_id": sch_id,
@@ -107,37 +235,25 @@ class AutoGraphAnalyticsView(View):
             if not all([sid, sch, did, raw_from, raw_to]):
                 return JsonResponse({'error': 'Missing params'}, status=400)
 
-            # Очистка даты для API АвтоГРАФ
-            def clean_date_string(dt_str):
-                digits = re.sub(r'\D', '', dt_str)
-                if len(digits) >= 12:
-                    return f"{digits[:8]}-{digits[8:12]}"
-                return digits
+            track_format = negotiate_track_format(request)
+            if track_format is None:
+                return JsonResponse({'error': 'Unsupported format'}, status=406)
 
             sd = clean_date_string(raw_from)
             ed = clean_date_string(raw_to)
 
+            if request.GET.get('stream') in ('1', 'true') and track_format == 'json':
+                # Части трека запрашиваются по ходу отправки ответа: в памяти одна часть
+                segments = service.iter_track_range(sid, sch, did, sd, ed)
+                return StreamingHttpResponse(
+                    iter_legacy_track_json(iter_track_pairs({did: segments}, did), did),
+                    content_type='application/json',
+                )
+
             raw_track = service.get_track_data(sid, sch, did, sd, ed)
+            formatted_track = format_track(raw_track, did)
 
-            formatted_track = []
-            if isinstance(raw_track, dict):
-                t_data = raw_track.get(did) or raw_track.get(str(did))
-                if t_data and 'DT' in t_data:
-                    timestamps = t_data.get('DT', [])
-                    speeds = t_data.get('Speed', [])
-                    # Сохраняем логику извлечения топлива для будущих графиков
-                    fuels = t_data.get('TankMainFuelLevel', [0] * len(timestamps))
-
-                    for i in range(len(timestamps)):
-                        try:
-                            ts = int(timestamps[i]) * 1000
-                            val_speed = round(abs(float(speeds[i])))
-                            # Формируем структуру, которая не потеряет данные
-                            formatted_track.append([ts, val_speed])
-                        except:
-                            continue
-
-            return JsonResponse({"track": formatted_track, "device_id": did})
+            return legacy_track_response(formatted_track, did, track_format)
         except Exception as e:
             logger.error(f"Analytics Error: {traceback.format_exc()}")
             return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""
+Views для отчетов по парку.
+"""
+import logging
+from datetime import date
+
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+
+from ..services.autograph import AutoGraphService
+from ..services.device_registry import device_registry
+from ..services.fuel_events import ensure_vehicles
+from ..services.reports import fleet_report, refresh_day_stats
+from .analytics import BATCH_MAX_DEVICES, parse_device_ids
+
+logger = logging.getLogger(__name__)
+service = AutoGraphService()
+
+# Больше дней за раз не считаем: первый расход по году - уже минуты
+REPORT_MAX_DAYS = 366
+
+
+def parse_report_day(value):
+    """'2026-01-17' или '2026-01-17 23:59' -> date"""
+    return date.fromisoformat(value.strip()[:10])
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ReportListView(APIView):
+    """
+    Сводный отчет по парку за период.
+    GET /api/reports/?session=<session>&schema_id=<schema_id>&from=<date>&to=<date>[&device_ids=<id1,id2,...>]
+
+    Период - целые сутки (UTC) от дня from до дня to включительно. Отчет
+    собирается из суточных итогов в базе; недостающие дни досчитываются
+    по трекам один раз (refresh=0 - только то, что уже посчитано).
+    """
+
+    def get(self, request):
+        session_id = request.GET.get('session')
+        schema_id = request.GET.get('schema_id')
+        device_ids = parse_device_ids(request.GET.get('device_ids'))
+        date_from = request.GET.get('from')
+        date_to = request.GET.get('to')
+        refresh = request.GET.get('refresh') not in ('0', 'false')
+
+        errors = {}
+        if not session_id:
+            errors['session'] = ['This field is required.']
+        if not schema_id:
+            errors['schema_id'] = ['This field is required.']
+        if len(device_ids) > BATCH_MAX_DEVICES:
+            errors['device_ids'] = [f'No more than {BATCH_MAX_DEVICES} devices per request.']
+        first = last = None
+        try:
+            first = parse_report_day(date_from) if date_from else None
+            last = parse_report_day(date_to) if date_to else None
+        except ValueError:
+            errors['from'] = ['Invalid date format, expected YYYY-MM-DD.']
+        if not date_from:
+            errors['from'] = ['This field is required.']
+        if not date_to:
+            errors['to'] = ['This field is required.']
+        if first and last:
+            if first > last:
+                errors['from'] = ['Начальная дата должна быть раньше конечной']
+            elif (last - first).days >= REPORT_MAX_DAYS:
+                errors['to'] = [f'No more than {REPORT_MAX_DAYS} days per report.']
+
+        if errors:
+            return Response({
+                'error': 'Invalid parameters',
+                'details': errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            devices = device_registry.get(session_id, schema_id, service)
+            if not devices:
+                return Response({
+                    'error': 'Schema is not available for this session'
+                }, status=status.HTTP_403_FORBIDDEN)
+
+            device_ids = [device_id for device_id in (device_ids or list(devices.index)) if devices.get(device_id)]
+            computed = {'vehicles': 0, 'days': 0, 'partial': []}
+            if refresh:
+                computed = refresh_day_stats(session_id, schema_id, first, last, device_ids, service)
+            report = fleet_report(ensure_vehicles(devices, device_ids), first, last)
+
+        except Exception as e:
+            logger.error(f"Error building report: {e}")
+            return Response({
+                'error': f'Failed to build report: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            'success': True,
+            'period': {'from': first.isoformat(), 'to': last.isoformat()},
+            'count': len(report),
+            'vehicles': report,
+            'computed_days': computed['days'],
+            'partial': computed['partial'],
+        })
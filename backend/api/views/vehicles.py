@@ -7,14 +7,20 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from django.core.cache import cache
 
 from ..services.autograph import AutoGraphService
-from ..utils.cache import get_cache_key
+from ..services.device_registry import device_registry
+from ..services.online_store import online_store, normalize_online_info
+from ..utils.cache import cache_tags, get_cache_key, get_stale_while_revalidate
+from ..utils.http import content_etag, conditional_response
 
 logger = logging.getLogger(__name__)
 service = AutoGraphService()
 
+# Онлайн-данные: до 30 с отдаются как есть, до 5 мин - с обновлением в фоне
+ONLINE_FRESH_SECONDS = 30
+ONLINE_MAX_STALE_SECONDS = 300
+
 
 def extract_vehicle_info(vehicle):
     """Извлечение информации из данных транспортного средства"""
@@ -54,11 +60,61 @@ def extract_vehicle_info(vehicle):
     }
 
 
+def parse_since(value):
+    """Параметр since (версия снимка онлайн-данных); ValueError - не число"""
+    if value in (None, ''):
+        return None
+    since = int(value)
+    if since < 0:
+        raise ValueError(value)
+    return since
+
+
+def vehicles_etag(devices, response_data):
+    """ETag списка ТС считается один раз на версию реестра"""
+    return devices.memo('vehicles_etag', lambda: content_etag(response_data))
+
+
+def build_vehicles_response(response_data, schema_id):
+    """Формирование ответа со списком ТС из сырого ответа EnumDevices"""
+    # Определяем структуру ответа
+    if isinstance(response_data, dict):
+        # Новый формат: {ID: "...", Groups: [...], Items: [...]}
+        vehicles = response_data.get('Items', [])
+        groups = response_data.get('Groups', [])
+    elif isinstance(response_data, list):
+        # Старый формат: просто список
+        vehicles = response_data
+        groups = []
+    else:
+        vehicles = []
+        groups = []
+
+    # Обрабатываем каждое транспортное средство
+    processed_vehicles = []
+    for vehicle in vehicles:
+        if isinstance(vehicle, dict):
+            vehicle_info = extract_vehicle_info(vehicle)
+            if vehicle_info:
+                processed_vehicles.append(vehicle_info)
+
+    # Формируем ответ
+    return {
+        'success': True,
+        'vehicles': processed_vehicles,
+        'groups': groups,
+        'count': len(processed_vehicles),
+        'schema_id': schema_id
+    }
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class VehicleListView(APIView):
     """
     Получение списка транспортных средств.
     GET /api/vehicles/?session_id=<session_id>&schema_id=<schema_id>
+
+    Ответ с ETag: при If-None-Match без изменений - 304 без тела.
     """
 
     def get(self, request):
@@ -70,60 +126,22 @@ class VehicleListView(APIView):
                 'error': 'session_id and schema_id parameters are required'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Ключ для кэша
-        cache_key = get_cache_key('vehicles', session_id, schema_id)
-        cached_data = cache.get(cache_key)
-
-        if cached_data:
-            logger.debug(f"Returning cached vehicles for schema {schema_id}")
-            return Response(cached_data)
-
         try:
-            # Получаем транспортные средства из AutoGRAPH
-            response_data = service.get_vehicles_by_schema(session_id, schema_id)
+            # ТС схемы из общего реестра (EnumDevices только при промахе/устаревании)
+            devices = device_registry.get(session_id, schema_id, service)
 
             # Проверяем структуру ответа
-            if not response_data:
+            if not devices:
                 return Response({
                     'success': True,
                     'vehicles': [],
                     'count': 0
                 })
 
-            # Определяем структуру ответа
-            if isinstance(response_data, dict):
-                # Новый формат: {ID: "...", Groups: [...], Items: [...]}
-                vehicles = response_data.get('Items', [])
-                groups = response_data.get('Groups', [])
-            elif isinstance(response_data, list):
-                # Старый формат: просто список
-                vehicles = response_data
-                groups = []
-            else:
-                vehicles = []
-                groups = []
-
-            # Обрабатываем каждое транспортное средство
-            processed_vehicles = []
-            for vehicle in vehicles:
-                if isinstance(vehicle, dict):
-                    vehicle_info = extract_vehicle_info(vehicle)
-                    if vehicle_info:
-                        processed_vehicles.append(vehicle_info)
-
-            # Формируем ответ
-            response_data = {
-                'success': True,
-                'vehicles': processed_vehicles,
-                'groups': groups,
-                'count': len(processed_vehicles),
-                'schema_id': schema_id
-            }
-
-            # Кэшируем на 5 минут
-            cache.set(cache_key, response_data, timeout=300)
-
-            return Response(response_data)
+            # Ответ собирается один раз на версию списка ТС
+            response_data = devices.memo('vehicles', lambda: build_vehicles_response(devices.devices, schema_id))
+
+            return conditional_response(request, response_data, vehicles_etag(devices, response_data))
 
         except Exception as e:
             logger.error(f"Error fetching vehicles: {e}")
@@ -134,11 +152,52 @@ class VehicleListView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def build_online_response(raw_online):
+    """Формирование ответа с онлайн-данными из сырого ответа GetOnlineInfo"""
+    processed_online = normalize_online_info(raw_online, service.parse_moto_hours)
+
+    # Формируем ответ
+    return {
+        'success': True,
+        'online_data': processed_online,
+        'count': len(processed_online)
+    }
+
+
+def build_snapshot_response(snapshot, device_ids, since=None):
+    """
+    Ответ с онлайн-данными из снимка опросчика (только запрошенные ТС).
+    since - версия, которая уже есть у клиента: отдаются только ТС, изменившиеся
+    после нее (в ответе 'since'). Версия из будущего (снимок пересоздан) - полный ответ.
+    """
+    vehicles = snapshot['vehicles']
+    versions = snapshot['versions']
+    if since is not None and since > snapshot['version']:
+        since = None
+    processed_online = {
+        device_id: vehicles[device_id]
+        for device_id in device_ids.split(',')
+        if device_id in vehicles and (since is None or versions.get(device_id, snapshot['version']) > since)
+    }
+    response_data = {
+        'success': True,
+        'online_data': processed_online,
+        'count': len(processed_online),
+        'version': snapshot['version'],
+    }
+    if since is not None:
+        response_data['since'] = since
+    return response_data
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class VehicleOnlineView(APIView):
     """
     Получение онлайн-данных транспортных средств.
-    GET /api/vehicles/online/?session_id=<session_id>&schema_id=<schema_id>&device_ids=<id1,id2,...>
+    GET /api/vehicles/online/?session_id=<session_id>&schema_id=<schema_id>&device_ids=<id1,id2,...>[&since=<version>]
+
+    since - версия из прошлого ответа: вернутся только изменившиеся после нее ТС.
+    Ответ с ETag: при If-None-Match без изменений - 304 без тела.
     """
 
     def get(self, request):
@@ -151,69 +210,40 @@ class VehicleOnlineView(APIView):
                 'error': 'session_id, schema_id and device_ids parameters are required'
             }, status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            since = parse_since(request.GET.get('since'))
+        except ValueError:
+            return Response({'error': 'since must be a non-negative integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Снимок фонового опросчика, если он работает. Опрашивать схему от имени
+        # сессии можно только после проверки доступа: чужая или неверная сессия
+        # сломала бы опрос для всех подписчиков
+        if device_registry.has_access(service, session_id, schema_id):
+            online_store.watch(schema_id, session_id)
+            snapshot = online_store.get(schema_id, max_age=ONLINE_MAX_STALE_SECONDS)
+            if snapshot:
+                return conditional_response(request, build_snapshot_response(snapshot, device_ids, since))
+
         # Ключ для кэша (короткое время)
         cache_key = get_cache_key('online', session_id, schema_id, device_ids)
-        cached_data = cache.get(cache_key)
 
-        if cached_data:
-            return Response(cached_data)
+        def fetch():
+            raw_online = service.get_online_info(session_id, schema_id, device_ids)
+            return build_online_response(raw_online) if raw_online else None
 
         try:
-            # Получаем онлайн-данные
-            raw_online = service.get_online_info(session_id, schema_id, device_ids)
+            # Свежие данные - из кэша, устаревшие - из кэша с обновлением в фоне
+            response_data = get_stale_while_revalidate(cache_key, fetch, ONLINE_FRESH_SECONDS, ONLINE_MAX_STALE_SECONDS,
+                                                       tags=cache_tags('online', schema_id))
 
-            if not raw_online:
+            if not response_data:
                 return Response({
                     'success': True,
                     'online_data': {}
                 })
 
-            # Обрабатываем данные для каждого устройства
-            processed_online = {}
-            for device_id, data in raw_online.items():
-                try:
-                    if not isinstance(data, dict):
-                        continue
-
-                    final_data = data.get('Final', {})
-
-                    # Извлекаем моточасы из FDT
-                    fdt_str = final_data.get('FDT', '0')
-                    moto_hours = service.parse_moto_hours(fdt_str)
-
-                    # Формируем объект
-                    processed_online[device_id] = {
-                        'Address': data.get('Address', 'Координаты не определены'),
-                        'Speed': data.get('Speed', 0),
-                        'DT': data.get('DT'),
-                        'moto_hours': moto_hours,
-                        'ignition': final_data.get('DIgnition', False),
-                        'fuel': final_data.get('TankMainFuelLevel', 0),
-                    }
-
-                except Exception as device_error:
-                    logger.error(f"Error processing device {device_id}: {device_error}")
-                    # Добавляем устройство с минимальными данными
-                    processed_online[device_id] = {
-                        'Address': 'Ошибка обработки данных',
-                        'Speed': 0,
-                        'DT': None,
-                        'moto_hours': 0,
-                        'ignition': False,
-                        'fuel': 0,
-                    }
-
-            # Формируем ответ
-            response_data = {
-                'success': True,
-                'online_data': processed_online,
-                'count': len(processed_online)
-            }
-
-            # Кэшируем на 30 секунд
-            cache.set(cache_key, response_data, timeout=30)
-
-            return Response(response_data)
+            # Без снимка версий нет - since не применяется, ответ полный
+            return conditional_response(request, response_data)
 
         except Exception as e:
             logger.error(f"Error fetching online data: {e}")
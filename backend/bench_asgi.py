@@ -0,0 +1,150 @@
+"""
+Бенчмарк: синхронные views (WSGI) против асинхронных (ASGI).
+
+Поднимает локальную заглушку AutoGRAPH с искусственной задержкой и гоняет
+/api/vehicles/online/ и /api/async/vehicles/online/ в одном процессе:
+- WSGI: фиксированное число потоков-воркеров, каждый блокируется на апстриме;
+- ASGI: один event loop, до --concurrency запросов одновременно.
+
+Запуск:
+    python bench_asgi.py --requests 500 --latency 200 --workers 8 --concurrency 200
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+
+def make_stub_handler(latency):
+    """Заглушка AutoGRAPH: отвечает на GetOnlineInfo после задержки"""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            query = parse_qs(urlparse(self.path).query)
+            ids = query.get('IDs', [''])[0].split(',')
+            payload = {
+                device_id: {
+                    'Address': 'Екатеринбург',
+                    'Speed': 42,
+                    'DT': '2026-01-17T09:56:50',
+                    'Final': {'FDT': '12.05:00:00', 'DIgnition': True, 'TankMainFuelLevel': 120.5},
+                }
+                for device_id in ids
+            }
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # По умолчанию очередь 5 соединений, сама заглушка становится узким местом
+    request_queue_size = 1024
+
+
+def serve_stub(latency, port_queue):
+    server = StubServer(('127.0.0.1', 0), make_stub_handler(latency))
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def start_stub(latency):
+    """Заглушка в отдельном процессе, чтобы не делить GIL с Django"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_stub, args=(latency, port_queue), daemon=True)
+    process.start()
+    return process, port_queue.get()
+
+
+def params_for(i):
+    # Уникальные device_ids, чтобы каждый запрос проходил мимо кэша
+    return {'session_id': 'bench', 'schema_id': 'bench', 'device_ids': f'dev-{i}'}
+
+
+def run_wsgi(total, workers):
+    from django.test import Client
+
+    local = threading.local()
+
+    def call(i):
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        return local.client.get('/api/vehicles/online/', params_for(i)).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        statuses = list(pool.map(call, range(total)))
+    return time.perf_counter() - start, statuses
+
+
+def run_asgi(total, concurrency, offset):
+    from django.test import AsyncClient
+
+    async def main():
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(i):
+            async with semaphore:
+                response = await client.get('/api/async/vehicles/online/', params_for(offset + i))
+                return response.status_code
+
+        return await asyncio.gather(*(call(i) for i in range(total)))
+
+    start = time.perf_counter()
+    statuses = asyncio.run(main())
+    return time.perf_counter() - start, statuses
+
+
+def report(label, elapsed, statuses):
+    ok = sum(1 for code in statuses if code == 200)
+    print(f"{label:<6} {len(statuses):>6} запросов  {elapsed:8.2f} сек  "
+          f"{len(statuses) / elapsed:8.1f} req/s  успешно: {ok}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--latency', type=int, default=200, help='задержка апстрима, мс')
+    parser.add_argument('--workers', type=int, default=8, help='потоков WSGI')
+    parser.add_argument('--concurrency', type=int, default=200, help='одновременных запросов ASGI')
+    args = parser.parse_args()
+
+    stub, port = start_stub(args.latency / 1000)
+
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.test.utils import setup_test_environment
+    settings.AUTOGRAPH = {**settings.AUTOGRAPH, 'BASE_URL': f'http://127.0.0.1:{port}'}
+    setup_test_environment()
+
+    print(f"Апстрим: задержка {args.latency} мс, WSGI потоков: {args.workers}, "
+          f"ASGI одновременно: {args.concurrency}")
+    report('WSGI', *run_wsgi(args.requests, args.workers))
+    report('ASGI', *run_asgi(args.requests, args.concurrency, offset=args.requests))
+
+    stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Бенчмарк форматов ответа трека: время кодирования и байт на точку.
+
+Строит синтетический трек (секундные точки, 2 ДУТ) и кодирует его
+каждым форматом из TRACK_FORMATS (json / columnar / msgpack).
+
+Запуск:
+    python bench_track_formats.py --points 200000 --repeat 5
+"""
+import argparse
+import gzip
+import os
+import statistics
+import time
+
+import numpy as np
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+
+def make_track(n):
+    from api.services.track import TrackColumns
+
+    rng = np.random.default_rng(42)
+    fuel = np.round(400 - np.cumsum(rng.uniform(0, 0.002, n)) + rng.normal(0, 0.3, n), 1)
+    return TrackColumns(
+        t=1768640000 + np.arange(n, dtype=np.int64),
+        s=rng.integers(0, 90, n),
+        lat=np.round(56.8 + np.cumsum(rng.normal(0, 1e-5, n)), 6),
+        lng=np.round(60.6 + np.cumsum(rng.normal(0, 1e-5, n)), 6),
+        f=fuel,
+        has_coords=rng.random(n) > 0.01,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    from api.services.track_formats import TRACK_FORMATS
+
+    columns = make_track(args.points)
+    fields = {'device_id': 'bench', 'period': {'from': '2026-01-17 00:00', 'to': '2026-01-19 07:33'}}
+
+    print(f"Точек: {args.points}, повторов: {args.repeat}")
+    print(f"{'формат':<10} {'кодирование, мс':>16} {'байт':>12} {'байт/точку':>11} {'gzip байт/точку':>16}")
+    for name, (media_type, encoder) in TRACK_FORMATS.items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            body = encoder(columns, **fields)
+            timings.append(time.perf_counter() - start)
+        compressed = gzip.compress(body, compresslevel=6)
+        print(f"{name:<10} {statistics.median(timings) * 1000:16.1f} {len(body):12d} "
+              f"{len(body) / args.points:11.1f} {len(compressed) / args.points:16.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+# Опрос онлайн-данных потоком в процессе сервера (ONLINE_POLLER['RUN_IN_PROCESS']).
+# Здесь, а не в AppConfig.ready: тот выполняется и в migrate, shell, тестах.
+from api.services.online_poller import start_in_process_poller  # noqa: E402
+
+start_in_process_poller()
@@ -129,10 +129,76 @@ REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'api.utils.exceptions.custom_exception_handler',
 }
 
-# Cache settings
+# Cache settings: LRU в памяти процесса + общий для всех процессов SQLite (api/utils/tiered_cache.py)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'api.utils.tiered_cache.TieredCache',
+        'LOCATION': str(BASE_DIR / 'cache.sqlite3'),
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_MAX_BYTES': 64 * 1024 * 1024,
+            'LOCAL_TIMEOUT': 60,
+            'SYNC_INTERVAL': 0.5,
+        },
     }
-}
\ No newline at end of file
+}
+
+# AutoGRAPH API settings
+AUTOGRAPH = {
+    'BASE_URL': 'https://web.tk-ekat.ru/ServiceJSON',
+    'POOL_CONNECTIONS': 4,      # Количество пулов (по хостам)
+    'POOL_MAXSIZE': 32,         # Keep-alive соединений на хост
+    'MAX_RETRIES': 3,           # Повторы идемпотентных запросов
+    'BACKOFF_FACTOR': 0.5,      # База экспоненциальной задержки (сек)
+    'BACKOFF_MAX': 8.0,
+    'DEFAULT_TIMEOUT': 15,
+    'TIMEOUTS': {
+        'Login': 15,
+        'EnumSchemas': 15,
+        'EnumDevices': 15,
+        'GetOnlineInfo': 15,
+        'GetTrack': 30,
+    },
+    'TRACK_CHUNK_HOURS': 24,    # Длинный период GetTrack качается частями по суткам
+    'TRACK_WORKERS': 4,         # Частей одновременно на один трек
+    'TRACK_CHUNK_RETRIES': 2,
+    'BATCH_TRACK_WORKERS': 8,   # ТС одновременно в /api/analytics/tracks/
+    'SESSION_TTL': 1800,        # Сколько держим токен Login (меньше времени жизни сессии AutoGRAPH)
+    'SESSION_REFRESH_BEFORE': 300,  # За сколько до истечения обновляем токен в фоне
+    'SINGLE_FLIGHT_SHARED': False,  # True - объединять одинаковые запросы между воркерами через кэш
+}
+
+# Локальное хранилище телеметрии (треки GetTrack)
+TELEMETRY_STORE = {
+    'PATH': BASE_DIR / 'telemetry.sqlite3',
+    'SETTLE_SECONDS': 900,      # Последние 15 минут всегда берутся из AutoGRAPH
+}
+
+# Фоновый опрос онлайн-данных (manage.py poll_online)
+ONLINE_POLLER = {
+    'INTERVAL': 15,             # Шаг опроса GetOnlineInfo, секунд
+    'BATCH_SIZE': 200,          # ID ТС в одном запросе
+    'RUN_IN_PROCESS': False,    # True - опрашивать потоком внутри приложения вместо команды
+}
+
+# Поиск сливов и заправок (manage.py detect_fuel_events)
+FUEL_EVENTS = {
+    'MEDIAN_POINTS': 5,         # Окно медианного фильтра, точек
+    'MEAN_POINTS': 3,           # Окно скользящего среднего, точек
+    'STEP_SECONDS': 600,        # За сколько проходит заправка/слив
+    'SETTLE_SECONDS': 300,      # Окно установившегося уровня до и после
+    'REFILL_MIN_LITRES': 15.0,
+    'DRAIN_MIN_LITRES': 10.0,
+    'STAND_SPEED': 5.0,         # км/ч; выше - ТС в движении (колебания топлива)
+    'MAX_MOVING_SHARE': 0.2,
+}
+
+# Расход против норм ТС и перерасход (analytics/consumption/, события overrun)
+CONSUMPTION = {
+    'STAND_SPEED': 5.0,             # км/ч; выше - движение
+    'MAX_GAP_SECONDS': 600,         # Разрыв связи длиннее не учитывается
+    'MAX_JUMP_KMH': 200.0,          # Скачок координат быстрее - ошибка GPS
+    'OVERRUN_TOLERANCE': 0.15,      # Допустимое превышение нормы
+    'OVERRUN_MIN_LITRES': 5.0,
+    'MIN_SEGMENT_SECONDS': 600,
+}
@@ -0,0 +1,147 @@
+import React, { useEffect, useMemo, useRef } from 'react';
+import Highcharts from 'highcharts';
+import HighchartsReact from 'highcharts-react-official';
+import { analyticsService, MIN_MAX_POINTS } from '../../../services/analytics';
+
+// Параметр графика -> колонка трека
+const FIELDS = {
+  speed: { column: 's', name: 'Скорость' },
+  fuel: { column: 'f', name: 'Топливо' }
+};
+
+// Пауза после зума/сдвига, прежде чем запрашивать детализацию
+const ZOOM_DEBOUNCE_MS = 300;
+
+// Время точки трека: секунды epoch или ISO-строка
+const toMs = (t) => (typeof t === 'number' ? t * 1000 : Date.parse(t));
+
+// Граница периода в формате API (шкала UTC, как у треков на сервере)
+const formatBound = (ms) => new Date(ms).toISOString().slice(0, 16).replace('T', ' ');
+
+// Детализация видимого окна поверх обзорного трека: за окном остается обзор,
+// поэтому график можно сдвигать по всему периоду
+const spliceDetail = (overview, detail, min, max) => {
+  const from = detail.length ? Math.min(min, detail[0][0]) : min;
+  const to = detail.length ? Math.max(max, detail[detail.length - 1][0] + 1) : max;
+  return [
+    ...overview.filter(([x]) => x < from),
+    ...detail,
+    ...overview.filter(([x]) => x >= to)
+  ];
+};
+
+/**
+ * Масштабируемый график трека.
+ * Обзор - точки data (уже прореженные до ширины графика); при зуме и сдвиге
+ * видимое окно догружается корзинами пирамиды (getTrackLevels) с тем же
+ * числом точек, что и пикселей по ширине.
+ */
+const TrackZoomChart = ({ chart, data, vehicles, sessionId, schemaId, theme }) => {
+  const chartRef = useRef(null);
+  const timerRef = useRef(null);
+  const requestRef = useRef(0);
+
+  // Серии обзора и для каждой - ТС и колонка
+  const { series, meta } = useMemo(() => {
+    const fields = chart.dataKeys.filter(key => FIELDS[key]);
+    const series = [];
+    const meta = [];
+    chart.vehicleIds.forEach(vehicleId => {
+      const name = vehicles.find(v => v.ID === vehicleId)?.Name || vehicleId;
+      fields.forEach(key => {
+        const { column } = FIELDS[key];
+        series.push({
+          name: `${name} · ${FIELDS[key].name}`,
+          data: (data[vehicleId] || []).map(point => [toMs(point.t), point[column]])
+        });
+        meta.push({ vehicleId, column });
+      });
+    });
+    return { series, meta };
+  }, [chart.vehicleIds, chart.dataKeys, data, vehicles]);
+
+  useEffect(() => () => clearTimeout(timerRef.current), []);
+
+  const loadWindow = async (min, max) => {
+    const instance = chartRef.current?.chart;
+    if (!instance) return;
+    const requestId = ++requestRef.current;
+    const maxPoints = Math.max(MIN_MAX_POINTS, Math.round(instance.plotWidth));
+
+    const levels = {};
+    await Promise.all(chart.vehicleIds.map(async vehicleId => {
+      try {
+        const response = await analyticsService.getTrackLevels(
+          sessionId, schemaId, vehicleId, formatBound(min), formatBound(max), maxPoints
+        );
+        levels[vehicleId] = response.columns;
+      } catch (error) {
+        console.error('Ошибка загрузки детализации:', error);
+      }
+    }));
+    // Пока ждали, окно уже сменилось - ответ устарел
+    if (requestId !== requestRef.current || !chartRef.current?.chart) return;
+
+    meta.forEach(({ vehicleId, column }, i) => {
+      const columns = levels[vehicleId];
+      if (!columns) return;
+      const detail = columns.t.map((t, j) => [t * 1000, columns[`${column}_mean`][j]]);
+      instance.series[i]?.setData(spliceDetail(series[i].data, detail, min, max), false);
+    });
+    instance.redraw();
+  };
+
+  const afterSetExtremes = (event) => {
+    // Без trigger - перерисовка после setData, а не действие пользователя
+    if (!event.trigger) return;
+    clearTimeout(timerRef.current);
+    if (event.userMin == null && event.userMax == null) {
+      // Сброс зума - возвращаем обзор
+      requestRef.current += 1;
+      const instance = chartRef.current?.chart;
+      series.forEach((item, i) => instance?.series[i]?.setData(item.data, false));
+      instance?.redraw();
+      return;
+    }
+    timerRef.current = setTimeout(() => loadWindow(event.min, event.max), ZOOM_DEBOUNCE_MS);
+  };
+
+  // Новые options пересоздают серии и сбрасывают детализацию - только при смене данных
+  const options = useMemo(() => ({
+    chart: {
+      type: chart.type === 'spline' ? 'line' : chart.type,
+      backgroundColor: 'transparent',
+      height: 256,
+      zooming: { type: 'x' },
+      panning: { enabled: true, type: 'x' },
+      panKey: 'shift'
+    },
+    title: { text: null },
+    credits: { enabled: false },
+    colors: chart.style?.colors,
+    xAxis: {
+      type: 'datetime',
+      events: { afterSetExtremes },
+      labels: { style: { color: theme.text } }
+    },
+    yAxis: {
+      title: { text: null },
+      gridLineColor: theme.border,
+      labels: { style: { color: theme.text } }
+    },
+    legend: { itemStyle: { color: theme.text } },
+    tooltip: { shared: true, xDateFormat: '%d.%m.%Y %H:%M' },
+    plotOptions: {
+      series: {
+        lineWidth: chart.style?.lineWidth || 2,
+        marker: { enabled: Boolean(chart.style?.showPoints) },
+        animation: false
+      }
+    },
+    series
+  }), [series, meta, chart.type, chart.style, theme, sessionId, schemaId]);
+
+  return <HighchartsReact highcharts={Highcharts} options={options} ref={chartRef} />;
+};
+
+export default TrackZoomChart;
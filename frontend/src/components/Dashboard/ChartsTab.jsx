@@ -1,11 +1,12 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import {
   Grid3x3, Layout, Maximize2, Rotate3d,
   Download, Plus, Trash2, Filter, Search,
   BarChart3, LineChart, PieChart, Activity
 } from 'lucide-react';
 import { useThemeContext } from '../../contexts/ThemeContext';
-import { apiService } from '../../services/api';
+import { analyticsService, MIN_MAX_POINTS } from '../../services/analytics';
+import TrackZoomChart from './ChartCanvas/TrackZoomChart';
 
 const ChartsTab = ({ sessionId, schemaId, vehicles = [] }) => {
   const { currentTheme, borderRadius } = useThemeContext();
@@ -17,6 +18,7 @@ const ChartsTab = ({ sessionId, schemaId, vehicles = [] }) => {
   const [layoutMode, setLayoutMode] = useState('grid');
   const [viewMode, setViewMode] = useState('2d');
   const [searchTerm, setSearchTerm] = useState('');
+  const chartsAreaRef = useRef(null);
   const [dateRange, setDateRange] = useState({
     from: new Date(Date.now() - 24 * 60 * 60 * 1000).toISOString().split('T')[0],
     to: new Date().toISOString().split('T')[0]
@@ -43,6 +45,12 @@ const ChartsTab = ({ sessionId, schemaId, vehicles = [] }) => {
     { id: 'spline', label: 'Плавный', icon: LineChart }
   ];
 
+  // Ширина одного графика в пикселях: больше точек на нем все равно не видно
+  const chartWidth = () => {
+    const width = chartsAreaRef.current?.clientWidth || window.innerWidth;
+    return Math.max(MIN_MAX_POINTS, Math.round(layoutMode === 'grid' ? width / 2 : width));
+  };
+
   // Загрузка данных по выбранным ТС
   const fetchDataForCharts = async () => {
     if (selectedVehicles.length === 0) {
@@ -52,15 +60,18 @@ const ChartsTab = ({ sessionId, schemaId, vehicles = [] }) => {
 
     setLoading(true);
     try {
+      // Трек прореживается на сервере (LTTB) до ширины графика
+      const maxPoints = chartWidth();
       const dataPromises = selectedVehicles.map(async (vehicleId) => {
-        const response = await apiService.getAnalytics({
-          session: sessionId,
-          schema_id: schemaId,
-          device_id: vehicleId,
-          from: `${dateRange.from} 00:00`,
-          to: `${dateRange.to} 23:59`
-        });
-        return { vehicleId, data: response };
+        const response = await analyticsService.getTrackData(
+          sessionId,
+          schemaId,
+          vehicleId,
+          `${dateRange.from} 00:00`,
+          `${dateRange.to} 23:59`,
+          maxPoints
+        );
+        return { vehicleId, data: response.points || [] };
       });
 
       const results = await Promise.all(dataPromises);
@@ -416,7 +427,7 @@ const ChartsTab = ({ sessionId, schemaId, vehicles = [] }) => {
         </div>
 
         {/* Область графиков */}
-        <div className="flex-1 overflow-auto">
+        <div ref={chartsAreaRef} className="flex-1 overflow-auto">
           {activeCharts.length === 0 ? (
             <div className="h-full flex flex-col items-center justify-center opacity-10 p-12">
               <BarChart3 size={64} />
@@ -454,15 +465,28 @@ const ChartsTab = ({ sessionId, schemaId, vehicles = [] }) => {
                     </button>
                   </div>
 
-                  <div className="h-64 flex items-center justify-center border border-white/5 rounded-xl">
-                    <div className="text-center">
-                      <BarChart3 size={32} className="mx-auto mb-2 opacity-20" />
-                      <p className="text-xs opacity-60">График "{chart.type}"</p>
-                      <p className="text-[10px] opacity-40 mt-1">
-                        Данные загружены: {chart.vehicleIds.length > 0 ? 'ДА' : 'НЕТ'}
-                      </p>
+                  {chart.vehicleIds.some(id => chartData[id]?.length) ? (
+                    <div className="h-64 border border-white/5 rounded-xl">
+                      <TrackZoomChart
+                        chart={chart}
+                        data={chartData}
+                        vehicles={vehicles}
+                        sessionId={sessionId}
+                        schemaId={schemaId}
+                        theme={currentTheme}
+                      />
                     </div>
-                  </div>
+                  ) : (
+                    <div className="h-64 flex items-center justify-center border border-white/5 rounded-xl">
+                      <div className="text-center">
+                        <BarChart3 size={32} className="mx-auto mb-2 opacity-20" />
+                        <p className="text-xs opacity-60">График "{chart.type}"</p>
+                        <p className="text-[10px] opacity-40 mt-1">
+                          Данные загружены: {chart.vehicleIds.length > 0 ? 'ДА' : 'НЕТ'}
+                        </p>
+                      </div>
+                    </div>
+                  )}
 
                   <div className="mt-4 flex gap-2">
                     <button
@@ -85,6 +85,9 @@ const ReportsTab = ({ sessionId, schemaId, vehicles }) => {
               <th className="p-6">Пробег (км)</th>
               <th className="p-6">Моточасы</th>
               <th className="p-6">Макс. Скорость</th>
+              <th className="p-6">Расход (л)</th>
+              <th className="p-6">Заправки (л)</th>
+              <th className="p-6">Сливы (л)</th>
             </tr>
           </thead>
           <tbody>
@@ -94,10 +97,13 @@ const ReportsTab = ({ sessionId, schemaId, vehicles }) => {
                 <td className="p-6">{r.distance}</td>
                 <td className="p-6">{r.engine_hours}</td>
                 <td className="p-6" style={{ color: currentTheme.accent }}>{r.max_speed}</td>
+                <td className="p-6">{r.fuel_consumed}</td>
+                <td className="p-6">{r.refill_litres}</td>
+                <td className="p-6">{r.drain_litres}</td>
               </tr>
             )) : (
               <tr>
-                <td colSpan="4" className="p-20 text-center opacity-10 uppercase font-black text-[10px] tracking-widest">
+                <td colSpan="7" className="p-20 text-center opacity-10 uppercase font-black text-[10px] tracking-widest">
                   Нет данных для отчета. Сформируйте отчет за выбранный период.
                 </td>
               </tr>
@@ -31,5 +31,16 @@ export const useVehicles = (sessionId, schemaId) => {
     fetchData();
   }, [fetchData]);
 
+  // После загрузки списка онлайн-данные приходят push-ом (только изменения);
+  // без EventSource или ASGI-сервера - опросом
+  useEffect(() => {
+    if (!sessionId || !schemaId || vehicles.length === 0) return;
+    const deviceIds = vehicles.map(v => v.ID).join(',');
+    if (typeof EventSource === 'undefined') {
+      return vehiclesService.pollOnline(sessionId, schemaId, deviceIds, setOnlineData);
+    }
+    return vehiclesService.subscribeOnline(sessionId, schemaId, deviceIds, setOnlineData);
+  }, [sessionId, schemaId, vehicles]);
+
   return { vehicles, onlineData, loading, error, refresh: fetchData };
 };
\ No newline at end of file
@@ -1,7 +1,10 @@
 import api from './api';
 
+// Меньше сервер не прореживает (MIN_MAX_POINTS в analytics.py)
+export const MIN_MAX_POINTS = 10;
+
 export const analyticsService = {
-  getTrackData: async (sessionId, schemaId, deviceId, fromDate, toDate) => {
+  getTrackData: async (sessionId, schemaId, deviceId, fromDate, toDate, maxPoints) => {
     // Твой бэк в analytics.py ожидает ключи session, schema_id, device_id, from, to
     const response = await api.get('analytics/track/', {
       params: {
@@ -9,9 +12,84 @@ export const analyticsService = {
         schema_id: schemaId,
         device_id: deviceId,
         from: fromDate, // Формат YYYY-MM-DD HH:mm (бэк сам его почистит)
-        to: toDate
+        to: toDate,
+        // Прореживание на сервере (LTTB): графику не нужно больше точек, чем пикселей
+        max_points: maxPoints
       }
     });
     return response.data; // Ожидаем { success: true, points: [...] }
+  },
+
+  // Трек для масштабируемого графика: корзины min/max/среднее (bucket - длина корзины в секундах).
+  // Размер ответа не зависит от масштаба: при зуме запрашивается новый период с тем же maxPoints
+  getTrackLevels: async (sessionId, schemaId, deviceId, fromDate, toDate, maxPoints) => {
+    const response = await api.get('analytics/track/levels/', {
+      params: {
+        session: sessionId,
+        schema_id: schemaId,
+        device_id: deviceId,
+        from: fromDate,
+        to: toDate,
+        max_points: maxPoints
+      }
+    });
+    return response.data; // Ожидаем { success: true, bucket, columns: { t, n, s_min, s_max, s_mean, f_min, f_max, f_mean } }
+  },
+
+  // Треки (или только сводки) сразу по нескольким ТС одним запросом
+  getFleetTracks: async (sessionId, schemaId, deviceIds, fromDate, toDate, { summary = true, maxPoints } = {}) => {
+    const response = await api.post('analytics/tracks/', {
+      session: sessionId,
+      schema_id: schemaId,
+      device_ids: deviceIds,
+      from: fromDate,
+      to: toDate,
+      summary,
+      max_points: maxPoints
+    });
+    return response.data; // Ожидаем { success: true, devices: { <id>: {...} } }
+  },
+
+  // Расход против норм по парку за период (без deviceIds - все ТС схемы)
+  getConsumption: async (sessionId, schemaId, fromDate, toDate, deviceIds) => {
+    const response = await api.get('analytics/consumption/', {
+      params: {
+        session: sessionId,
+        schema_id: schemaId,
+        from: fromDate,
+        to: toDate,
+        device_ids: deviceIds
+      }
+    });
+    return response.data; // Ожидаем { success: true, devices: { <id>: { totals } }, totals }
+  },
+
+  // События топлива по страницам: следующая страница - с cursor = next_cursor из ответа
+  getFuelEvents: async (sessionId, schemaId, { deviceIds, types, fromDate, toDate, confirmed, limit, cursor } = {}) => {
+    const response = await api.get('fuel-events/', {
+      params: {
+        session: sessionId,
+        schema_id: schemaId,
+        device_ids: deviceIds,
+        type: types,
+        from: fromDate,
+        to: toDate,
+        confirmed,
+        limit,
+        cursor
+      }
+    });
+    return response.data; // Ожидаем { success: true, events: [...], next_cursor }
+  },
+
+  // Массовое подтверждение (confirmed=false - снятие подтверждения)
+  confirmFuelEvents: async (sessionId, schemaId, ids, confirmed = true) => {
+    const response = await api.post('fuel-events/confirm/', {
+      session: sessionId,
+      schema_id: schemaId,
+      ids,
+      confirmed
+    });
+    return response.data; // Ожидаем { success: true, updated }
   }
 };
\ No newline at end of file
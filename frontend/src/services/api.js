@@ -25,8 +25,9 @@ export const apiService = {
 
   // Получение сводных отчетов
   getReports: async (params) => {
+    // Ответ: { success, period, vehicles: [...] } - строки собраны из суточных итогов
     const res = await api.get('/reports/', { params });
-    return res.data || [];
+    return res.data?.vehicles || [];
   },
 
   // Получение онлайн данных
@@ -1,5 +1,8 @@
 import api from './api';
 
+// Шаг опроса онлайн-данных, когда поток недоступен (шаг опросчика на сервере)
+const ONLINE_POLL_MS = 15000;
+
 export const vehiclesService = {
   getVehicles: async (sessionId, schemaId) => {
     const response = await api.get('vehicles/', {
@@ -8,14 +11,91 @@ export const vehiclesService = {
     return response.data; // Возвращает { success, vehicles: [processed_info], ... }
   },
 
-  getOnlineData: async (sessionId, schemaId, deviceIds) => {
+  // since - version из прошлого ответа: придут только изменившиеся ТС
+  getOnlineData: async (sessionId, schemaId, deviceIds, since) => {
     const response = await api.get('vehicles/online/', {
       params: {
         session_id: sessionId,
         schema_id: schemaId,
-        device_ids: deviceIds
+        device_ids: deviceIds,
+        ...(since !== undefined && { since })
       }
     });
-    return response.data; // Возвращает { success, online_data: { id: {...} } }
+    return response.data; // Возвращает { success, online_data: { id: {...} }, version }
+  },
+
+  // Опрос онлайн-данных с since: после первого ответа приходят только изменившиеся ТС.
+  // Возвращает функцию остановки.
+  pollOnline: (sessionId, schemaId, deviceIds, onData, initialState = {}) => {
+    let state = initialState;
+    let version;
+    let stopped = false;
+    let timer = null;
+
+    const poll = async () => {
+      try {
+        const data = await vehiclesService.getOnlineData(sessionId, schemaId, deviceIds, version);
+        if (stopped || !data.success) return;
+        // 'since' в ответе - пришли только изменения, иначе полное состояние
+        state = data.since !== undefined ? { ...state, ...data.online_data } : data.online_data;
+        version = data.version;
+        onData(state);
+      } catch (err) {
+        console.warn('Online polling failed:', err.message);
+      } finally {
+        if (!stopped) timer = setTimeout(poll, ONLINE_POLL_MS);
+      }
+    };
+    timer = setTimeout(poll, ONLINE_POLL_MS);
+
+    return () => {
+      stopped = true;
+      clearTimeout(timer);
+    };
+  },
+
+  // Подписка на онлайн-данные (SSE, нужен ASGI-сервер): сначала полный снимок,
+  // дальше только изменившиеся поля. Если поток не поднялся (под WSGI endpoint
+  // отвечает 501), EventSource не переподключается - переходим на опрос.
+  // Возвращает функцию отписки.
+  subscribeOnline: (sessionId, schemaId, deviceIds, onData) => {
+    const params = new URLSearchParams({ session_id: sessionId, schema_id: schemaId, device_ids: deviceIds });
+    const source = new EventSource(`${api.defaults.baseURL}/async/vehicles/online/stream/?${params}`);
+    let state = {};
+    let opened = false;
+    let stopPolling = null;
+
+    source.addEventListener('open', () => {
+      opened = true;
+    });
+    source.addEventListener('error', () => {
+      // Обрыв открытого потока EventSource переживает сам (readyState CONNECTING)
+      if (opened && source.readyState !== EventSource.CLOSED) return;
+      source.close();
+      if (!stopPolling) {
+        stopPolling = vehiclesService.pollOnline(sessionId, schemaId, deviceIds, onData, state);
+      }
+    });
+    source.addEventListener('snapshot', (event) => {
+      state = JSON.parse(event.data).online_data;
+      onData(state);
+    });
+    source.addEventListener('delta', (event) => {
+      const { changes, removed } = JSON.parse(event.data);
+      const next = { ...state };
+      Object.entries(changes).forEach(([id, fields]) => {
+        next[id] = { ...next[id], ...fields };
+      });
+      removed.forEach((id) => {
+        delete next[id];
+      });
+      state = next;
+      onData(state);
+    });
+
+    return () => {
+      source.close();
+      if (stopPolling) stopPolling();
+    };
   }
 };
\ No newline at end of file